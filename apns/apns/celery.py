@@ -26,9 +26,41 @@ app.conf.beat_schedule = {
         'task': 'notifications.tasks.send_scheduled_notifications',
         'schedule': crontab(minute='*'),  # 每分钟检查一次
     },
+    'flush-delivery-stats': {
+        'task': 'notifications.tasks.flush_delivery_stats_task',
+        'schedule': crontab(minute='*'),  # 每分钟汇总一次推送统计
+    },
+    'process-push-retries': {
+        'task': 'notifications.tasks.process_push_retries',
+        'schedule': 30.0,  # 每30秒处理一次到期的推送重试
+    },
+    'flush-device-last-seen': {
+        'task': 'devices.tasks.flush_device_last_seen',
+        'schedule': crontab(minute='*/5'),  # 每5分钟写入一次设备活跃时间
+    },
+    'prune-stale-devices': {
+        'task': 'devices.tasks.prune_stale_devices',
+        'schedule': crontab(hour=4, minute=0),  # 每天清理一次不活跃设备
+    },
     'sync-user-premium-status': {
         'task': 'purchase.tasks.sync_user_premium_status',
-        'schedule': crontab(hour='*', minute='*'),
+        'schedule': crontab(minute=0),  # 每小时兜底同步一次，到期由下面的定时器处理
+    },
+    'process-premium-expiries': {
+        'task': 'purchase.tasks.process_premium_expiries',
+        'schedule': 10.0,  # 每10秒处理一次到期的会员
+    },
+    'process-webhook-inbox': {
+        'task': 'purchase.tasks.process_webhook_inbox',
+        'schedule': crontab(minute='*'),  # 每分钟补偿处理未完成的苹果通知
+    },
+    'forward-webhook-mirrors': {
+        'task': 'purchase.tasks.forward_webhook_mirrors',
+        'schedule': 30.0,  # 每30秒重试一次积压的镜像转发
+    },
+    'flush-premium-status-outbox': {
+        'task': 'purchase.tasks.flush_premium_status_outbox',
+        'schedule': 30.0,  # 每30秒推送一次队列中到期的会员状态（含失败重试）
     },
 }
 
@@ -194,3 +194,63 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 
+# 群发活动：每批读取并发送的设备数，以及单次任务运行的时间预算（秒）
+CAMPAIGN_BATCH_SIZE = int(os.environ.get('CAMPAIGN_BATCH_SIZE', 500))
+CAMPAIGN_TIME_BUDGET = int(os.environ.get('CAMPAIGN_TIME_BUDGET', 20 * 60))
+
+# APNs 临时失败（429/500/503）的最大重试次数，以及每次处理的重试批量
+APNS_RETRY_MAX_ATTEMPTS = int(os.environ.get('APNS_RETRY_MAX_ATTEMPTS', 5))
+APNS_RETRY_BATCH_SIZE = int(os.environ.get('APNS_RETRY_BATCH_SIZE', 1000))
+
+# APNs 出站限速：每个应用按渠道划分的令牌桶，rate 为每秒补充的令牌数，burst 为桶容量
+APNS_RATE_LIMITS = {
+    'reminder': {
+        'rate': int(os.environ.get('APNS_RATE_REMINDER', 300)),
+        'burst': int(os.environ.get('APNS_BURST_REMINDER', 300)),
+    },
+    'campaign': {
+        'rate': int(os.environ.get('APNS_RATE_CAMPAIGN', 200)),
+        'burst': int(os.environ.get('APNS_BURST_CAMPAIGN', 200)),
+    },
+    'transactional': {
+        'rate': int(os.environ.get('APNS_RATE_TRANSACTIONAL', 100)),
+        'burst': int(os.environ.get('APNS_BURST_TRANSACTIONAL', 100)),
+    },
+}
+
+# 定时任务分片数（按 user_id 取模），以及执行租约的有效期（秒），租约应长于单次执行的最长耗时
+NOTIFICATION_SHARDS = int(os.environ.get('NOTIFICATION_SHARDS', 1))
+NOTIFICATION_LEASE_TTL = int(os.environ.get('NOTIFICATION_LEASE_TTL', 10 * 60))
+PREMIUM_SYNC_SHARDS = int(os.environ.get('PREMIUM_SYNC_SHARDS', 1))
+PREMIUM_SYNC_LEASE_TTL = int(os.environ.get('PREMIUM_SYNC_LEASE_TTL', 30 * 60))
+
+# 收据验证结果缓存：最长缓存时间，以及已到期收据的缓存时间（秒）
+RECEIPT_CACHE_MAX_TTL = int(os.environ.get('RECEIPT_CACHE_MAX_TTL', 24 * 60 * 60))
+RECEIPT_CACHE_EXPIRED_TTL = int(os.environ.get('RECEIPT_CACHE_EXPIRED_TTL', 5 * 60))
+
+# 订阅环境未知的收据是否同时向正式和沙盒环境验证，取先返回的有效结果
+RECEIPT_VERIFY_RACE = os.environ.get('RECEIPT_VERIFY_RACE', 'false').lower() == 'true'
+
+# 苹果通知收件箱：补偿处理的最大尝试次数，以及处理完成的通知保留天数
+WEBHOOK_INBOX_MAX_ATTEMPTS = int(os.environ.get('WEBHOOK_INBOX_MAX_ATTEMPTS', 5))
+WEBHOOK_INBOX_RETENTION_DAYS = int(os.environ.get('WEBHOOK_INBOX_RETENTION_DAYS', 30))
+
+# 苹果通知镜像转发：目标地址（逗号分隔，留空则不转发）、每个目标最多积压的通知数、单条通知的最大尝试次数
+WEBHOOK_MIRROR_TARGETS = [
+    target.strip() for target in os.environ.get(
+        'WEBHOOK_MIRROR_TARGETS', 'https://pocket.nicebudgeting.com/apns/api/purchase/webhook/'
+    ).split(',') if target.strip()
+]
+WEBHOOK_MIRROR_BACKLOG = int(os.environ.get('WEBHOOK_MIRROR_BACKLOG', 10000))
+WEBHOOK_MIRROR_MAX_ATTEMPTS = int(os.environ.get('WEBHOOK_MIRROR_MAX_ATTEMPTS', 10))
+
+# 会员状态推送队列：每批推送的用户数，以及放弃推送前的最大尝试次数
+PREMIUM_OUTBOX_BATCH_SIZE = int(os.environ.get('PREMIUM_OUTBOX_BATCH_SIZE', 200))
+PREMIUM_OUTBOX_MAX_ATTEMPTS = int(os.environ.get('PREMIUM_OUTBOX_MAX_ATTEMPTS', 10))
+
+# 定时通知平滑：大于 0 时每个用户的提醒按固定偏移分散到设定时间前后该分钟数内（最大 5），削平整点高峰
+NOTIFICATION_SMOOTHING_WINDOW = int(os.environ.get('NOTIFICATION_SMOOTHING_WINDOW', 0))
+
+# 设备清理：超过 DEVICE_IDLE_DAYS 天未活跃的设备停用（不删除）
+DEVICE_IDLE_DAYS = int(os.environ.get('DEVICE_IDLE_DAYS', 90))
+DEVICE_PRUNE_BATCH_SIZE = int(os.environ.get('DEVICE_PRUNE_BATCH_SIZE', 1000))
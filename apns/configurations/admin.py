@@ -3,6 +3,7 @@ from django.utils.html import format_html
 from django.utils import timezone
 from django.forms import ModelForm, PasswordInput
 from .models import AppleAppConfiguration, NotificationTemplate
+from .registry import app_registry
 
 
 class AppleAppConfigurationForm(ModelForm):
@@ -136,6 +137,8 @@ class AppleAppConfigurationAdmin(admin.ModelAdmin):
         批量激活应用配置
         """
         updated = queryset.update(is_active=True)
+        # queryset.update 不会触发信号，需要手动刷新配置注册表
+        app_registry.invalidate_on_commit()
         self.message_user(request, f'成功将 {updated} 个应用配置标记为活跃状态')
 
     mark_as_active.short_description = "将选中的应用配置标记为活跃"
@@ -145,6 +148,8 @@ class AppleAppConfigurationAdmin(admin.ModelAdmin):
         批量停用应用配置
         """
         updated = queryset.update(is_active=False)
+        # queryset.update 不会触发信号，需要手动刷新配置注册表
+        app_registry.invalidate_on_commit()
         self.message_user(request, f'成功将 {updated} 个应用配置标记为非活跃状态')
 
     mark_as_inactive.short_description = "将选中的应用配置标记为非活跃"
@@ -154,6 +159,8 @@ class AppleAppConfigurationAdmin(admin.ModelAdmin):
         批量切换到生产环境
         """
         updated = queryset.update(is_production=True)
+        # queryset.update 不会触发信号，需要手动刷新配置注册表
+        app_registry.invalidate_on_commit()
         self.message_user(request, f'成功将 {updated} 个应用配置切换到生产环境')
 
     switch_to_production.short_description = "切换到生产环境"
@@ -163,6 +170,8 @@ class AppleAppConfigurationAdmin(admin.ModelAdmin):
         批量切换到开发环境
         """
         updated = queryset.update(is_production=False)
+        # queryset.update 不会触发信号，需要手动刷新配置注册表
+        app_registry.invalidate_on_commit()
         self.message_user(request, f'成功将 {updated} 个应用配置切换到开发环境')
 
     switch_to_development.short_description = "切换到开发环境"
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class ConfigurationsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'configurations'
+
+    def ready(self):
+        """应用启动时执行的代码"""
+        # 导入信号处理器
+        import configurations.signals
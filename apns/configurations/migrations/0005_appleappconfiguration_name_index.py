@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 13:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('configurations', '0004_appleappconfiguration_admin_token'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='appleappconfiguration',
+            name='name',
+            field=models.CharField(db_index=True, help_text='应用的显示名称', max_length=100, verbose_name='应用名称'),
+        ),
+    ]
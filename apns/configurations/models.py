@@ -15,7 +15,7 @@ def validate_p8_file(value):
 class AppleAppConfiguration(models.Model):
     """苹果应用配置模型，用于存储多个苹果应用的配置信息"""
     
-    name = models.CharField(_('应用名称'), max_length=100, help_text=_('应用的显示名称'))
+    name = models.CharField(_('应用名称'), max_length=100, db_index=True, help_text=_('应用的显示名称'))
     bundle_id = models.CharField(_('Bundle ID'), max_length=255, unique=True, 
                                help_text=_('应用的Bundle ID，例如：com.example.app'))
     team_id = models.CharField(_('Team ID'), max_length=20, 
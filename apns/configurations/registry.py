@@ -0,0 +1,207 @@
+"""
+进程内的苹果应用配置注册表
+
+按应用名称、Bundle ID 和主键缓存所有 AppleAppConfiguration，并预先解析
+APNs 私钥、缓存 provider token，使推送、收据验证和用户中心调用不再每次查询配置表。
+与原先的查询保持一致：按名称获取时不检查是否启用，按 Bundle ID 和主键获取时只返回启用的配置。
+
+配置变更时通过 post_save / post_delete 信号清空本进程缓存，同时在 Redis 频道上广播，
+其他 Web 和 Celery 进程的订阅线程收到后清空各自的缓存；下次访问时重新加载。
+订阅中断等极端情况下，缓存最多保留 REGISTRY_TTL 秒。
+"""
+import logging
+import os
+import threading
+import time
+
+import jwt
+from django.db import transaction
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives.serialization import load_pem_private_key
+
+from utils.redis_client import get_redis_connection
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = 'apns:app-config:invalidate'
+REGISTRY_TTL = 5 * 60
+
+# Apple 要求 provider token 不超过 1 小时，且刷新间隔不少于 20 分钟
+PROVIDER_TOKEN_TTL = 50 * 60
+
+
+class AppleAppEntry:
+    """单个应用配置及其解析后的凭据，其余字段直接代理到模型实例"""
+
+    def __init__(self, config):
+        self.config = config
+        self._private_key = None
+        self._provider_token = None
+        self._provider_token_issued_at = 0
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.config, name)
+
+    @property
+    def private_key(self):
+        """解析后的 APNs 私钥，无法解析时返回原始字符串交由 jwt 处理"""
+        if self._private_key is None:
+            try:
+                self._private_key = load_pem_private_key(
+                    self.config.auth_key.encode('utf-8'),
+                    password=None,
+                    backend=default_backend()
+                )
+            except (ValueError, TypeError):
+                self._private_key = self.config.auth_key
+        return self._private_key
+
+    def provider_token(self):
+        """返回缓存的 APNs provider token，过期前复用"""
+        with self._lock:
+            now = int(time.time())
+            if not self._provider_token or now - self._provider_token_issued_at >= PROVIDER_TOKEN_TTL:
+                self._provider_token = jwt.encode(
+                    {'iss': self.config.team_id, 'iat': now},
+                    self.private_key,
+                    algorithm='ES256',
+                    headers={'alg': 'ES256', 'kid': self.config.key_id}
+                )
+                self._provider_token_issued_at = now
+            return self._provider_token
+
+
+class AppleAppRegistry:
+    """应用配置注册表，首次访问时加载全部配置（包括未启用的）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (按名称, 按 Bundle ID, 按主键) 三个索引，整体替换以保证读取时一致
+        self._indexes = None
+        self._loaded_at = 0
+        self._subscriber_pid = None
+
+    def _load(self):
+        from .models import AppleAppConfiguration
+
+        with self._lock:
+            if self._indexes is None or time.monotonic() - self._loaded_at >= REGISTRY_TTL:
+                entries = [AppleAppEntry(config) for config in AppleAppConfiguration.objects.order_by('id')]
+                self._indexes = {
+                    'name': self._index(entries, 'name'),
+                    'bundle_id': {entry.bundle_id: entry for entry in entries},
+                    'id': {entry.id: entry for entry in entries},
+                }
+                self._loaded_at = time.monotonic()
+            indexes = self._indexes
+
+        self._ensure_subscriber()
+        return indexes
+
+    @staticmethod
+    def _index(entries, field):
+        """
+        按不唯一的字段（应用名称）建索引：启用的配置优先于未启用的，
+        同为启用（或同为未启用）时保留 ID 最小的一条并记录错误
+        """
+        index = {}
+        for entry in entries:
+            key = getattr(entry, field)
+            existing = index.get(key)
+            if existing is None or (entry.is_active and not existing.is_active):
+                index[key] = entry
+            elif entry.is_active == existing.is_active:
+                logger.error(f"应用配置的 {field} 重复: {key}（ID {existing.id} 和 {entry.id}），使用 ID {existing.id}")
+        return index
+
+    def _lookup(self, index_name, key, active_only):
+        from .models import AppleAppConfiguration
+
+        indexes = self._indexes
+        if indexes is None or time.monotonic() - self._loaded_at >= REGISTRY_TTL:
+            indexes = self._load()
+
+        entry = indexes[index_name].get(key)
+        if entry is None:
+            raise AppleAppConfiguration.DoesNotExist(f"找不到应用配置: {key}")
+        if active_only and not entry.is_active:
+            raise AppleAppConfiguration.DoesNotExist(f"应用配置未启用: {key}")
+        return entry
+
+    def get(self, name):
+        """按应用名称获取配置（不检查是否启用），不存在时抛出 AppleAppConfiguration.DoesNotExist"""
+        return self._lookup('name', name, active_only=False)
+
+    def get_by_bundle_id(self, bundle_id):
+        """按 Bundle ID 获取启用的配置，不存在或未启用时抛出 AppleAppConfiguration.DoesNotExist"""
+        return self._lookup('bundle_id', bundle_id, active_only=True)
+
+    def get_by_id(self, config_id):
+        """按主键获取启用的配置，不存在或未启用时抛出 AppleAppConfiguration.DoesNotExist"""
+        return self._lookup('id', int(config_id), active_only=True)
+
+    def all(self):
+        """所有启用的应用配置"""
+        indexes = self._indexes
+        if indexes is None or time.monotonic() - self._loaded_at >= REGISTRY_TTL:
+            indexes = self._load()
+        return [entry for entry in indexes['name'].values() if entry.is_active]
+
+    def clear(self):
+        """清空本进程缓存"""
+        with self._lock:
+            self._indexes = None
+
+    def invalidate(self):
+        """清空本进程缓存，并通知其他进程"""
+        self.clear()
+        try:
+            redis = get_redis_connection()
+            if redis is not None:
+                redis.publish(INVALIDATION_CHANNEL, os.getpid())
+        except Exception as e:
+            logger.error(f"广播应用配置变更失败: {str(e)}")
+
+    def invalidate_on_commit(self):
+        """
+        配置在事务中修改时使用：事务提交后再清空缓存并通知其他进程，
+        避免其他进程在提交前重新加载到旧配置并缓存 REGISTRY_TTL 秒。
+        本进程的缓存立即清空，提交后再清空一次。
+        """
+        self.clear()
+        transaction.on_commit(self.invalidate)
+
+    def _ensure_subscriber(self):
+        """在当前进程中启动订阅线程，fork 出的子进程会重新启动"""
+        if self._subscriber_pid == os.getpid():
+            return
+
+        try:
+            redis = get_redis_connection()
+        except Exception as e:
+            logger.error(f"无法订阅应用配置变更: {str(e)}")
+            return
+        if redis is None:
+            return
+
+        self._subscriber_pid = os.getpid()
+        thread = threading.Thread(target=self._listen, args=(redis,), name='app-config-registry', daemon=True)
+        thread.start()
+
+    def _listen(self, redis):
+        while True:
+            try:
+                pubsub = redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(INVALIDATION_CHANNEL)
+                for message in pubsub.listen():
+                    if message.get('type') == 'message':
+                        self.clear()
+            except Exception as e:
+                logger.error(f"应用配置变更订阅中断，稍后重连: {str(e)}")
+                # 订阅中断期间可能错过变更，清空缓存后重连
+                self.clear()
+                time.sleep(5)
+
+
+app_registry = AppleAppRegistry()
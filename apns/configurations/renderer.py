@@ -0,0 +1,111 @@
+"""
+通知模板渲染
+
+模板中的 {{变量}} 在首次使用时解析为文本片段和变量名的列表，按 (模板ID, updated_at)
+缓存在进程内；模板被修改后 updated_at 变化，自然使用新的编译结果。
+渲染时只需按顺序拼接片段，同一模板可以一次渲染一批上下文。
+"""
+import re
+import threading
+from collections import OrderedDict
+
+from .models import NotificationTemplate
+
+PLACEHOLDER_PATTERN = re.compile(r'\{\{(\w+)\}\}')
+
+# 进程内最多缓存的编译模板数
+MAX_COMPILED_TEMPLATES = 256
+
+
+def _compile(text):
+    """将文本拆分为 (是否变量, 内容) 片段列表"""
+    parts = []
+    position = 0
+    for match in PLACEHOLDER_PATTERN.finditer(text):
+        if match.start() > position:
+            parts.append((False, text[position:match.start()]))
+        parts.append((True, match.group(1)))
+        position = match.end()
+    if position < len(text):
+        parts.append((False, text[position:]))
+    return parts
+
+
+def _render(parts, context):
+    """拼接片段，上下文中没有的变量保留原样"""
+    return ''.join(
+        (str(context[value]) if value in context else f'{{{{{value}}}}}') if is_variable else value
+        for is_variable, value in parts
+    )
+
+
+class CompiledTemplate:
+    """编译后的通知模板"""
+
+    def __init__(self, template):
+        self.id = template.id
+        self.updated_at = template.updated_at
+        self.badge = template.badge
+        self.sound = template.sound
+        self.custom_data = template.custom_data
+        self._title = _compile(template.title)
+        self._body = _compile(template.body)
+
+    def render(self, context=None):
+        """
+        渲染标题和内容
+
+        Returns:
+            tuple: (title, body)
+        """
+        context = context or {}
+        return _render(self._title, context), _render(self._body, context)
+
+    def render_batch(self, contexts):
+        """按顺序渲染一批上下文，返回 (title, body) 列表"""
+        return [self.render(context) for context in contexts]
+
+
+class TemplateRendererCache:
+    """按 (模板ID, updated_at) 缓存编译结果"""
+
+    def __init__(self, max_size=MAX_COMPILED_TEMPLATES):
+        self._lock = threading.Lock()
+        self._compiled = OrderedDict()
+        self.max_size = max_size
+
+    def get(self, template_id, app_config_id):
+        """
+        获取启用的模板的编译结果，每次只查询模板的 updated_at
+
+        Raises:
+            NotificationTemplate.DoesNotExist: 模板不存在或未启用
+        """
+        updated_at = NotificationTemplate.objects.filter(
+            id=template_id,
+            app_config_id=app_config_id,
+            is_active=True
+        ).values_list('updated_at', flat=True).first()
+        if updated_at is None:
+            raise NotificationTemplate.DoesNotExist(f"通知模板不存在或未激活: template_id={template_id}")
+
+        key = (template_id, updated_at)
+        with self._lock:
+            compiled = self._compiled.get(key)
+            if compiled is not None:
+                self._compiled.move_to_end(key)
+                return compiled
+
+        compiled = CompiledTemplate(NotificationTemplate.objects.get(id=template_id))
+        with self._lock:
+            self._compiled[(template_id, compiled.updated_at)] = compiled
+            while len(self._compiled) > self.max_size:
+                self._compiled.popitem(last=False)
+        return compiled
+
+    def clear(self):
+        with self._lock:
+            self._compiled.clear()
+
+
+template_renderer = TemplateRendererCache()
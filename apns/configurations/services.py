@@ -1,12 +1,17 @@
 import json
 import time
+from collections import defaultdict
+
 import httpx
-import jwt
-from cryptography.hazmat.primitives.serialization import load_pem_private_key
-from cryptography.hazmat.backends import default_backend
 from django.utils import timezone
-from .models import AppleAppConfiguration, NotificationTemplate
+from .models import NotificationTemplate
+from .registry import app_registry
+from .renderer import template_renderer
 from devices.models import DeviceToken
+from notifications.service.metrics import record_delivery, SUCCESS_REASON, NETWORK_ERROR_REASON
+from notifications.service.apple import AppleService
+from notifications.service.ratelimit import rate_limiter, CHANNEL_TRANSACTIONAL
+from notifications.service.retry import is_invalid_token, schedule_retries
 
 
 class AppleNotificationService:
@@ -18,9 +23,9 @@ class AppleNotificationService:
         可以通过app_config_id或bundle_id指定应用配置
         """
         if app_config_id:
-            self.app_config = AppleAppConfiguration.objects.get(id=app_config_id, is_active=True)
+            self.app_config = app_registry.get_by_id(app_config_id)
         elif bundle_id:
-            self.app_config = AppleAppConfiguration.objects.get(bundle_id=bundle_id, is_active=True)
+            self.app_config = app_registry.get_by_bundle_id(bundle_id)
         else:
             raise ValueError("必须提供app_config_id或bundle_id")
         
@@ -31,24 +36,12 @@ class AppleNotificationService:
         self.apns_host = self.app_config.get_apns_host()
         self.apns_port = 443
         
-        # 加载私钥
-        self.private_key = load_pem_private_key(
-            self.private_key_str.encode('utf-8'),
-            password=None,
-            backend=default_backend()
-        )
+        # 使用注册表中预先解析的私钥
+        self.private_key = self.app_config.private_key
     
     def _generate_token(self):
-        """生成 APNs JWT token"""
-        headers = {
-            'alg': 'ES256',
-            'kid': self.key_id
-        }
-        payload = {
-            'iss': self.team_id,
-            'iat': int(time.time())
-        }
-        return jwt.encode(payload, self.private_key, algorithm='ES256', headers=headers)
+        """获取 APNs JWT token，同一应用在进程内复用直到临近过期"""
+        return self.app_config.provider_token()
     
     def send_push_notification(self, device_token, title="", body="",
                               badge=1, sound="default", custom_data=None):
@@ -84,21 +77,33 @@ class AppleNotificationService:
             
             # 使用 httpx 发送请求
             url = f'https://{self.apns_host}/3/device/{device_token}'
+            rate_limiter.acquire(self.app_config.name, CHANNEL_TRANSACTIONAL)
+            started = time.monotonic()
             
-            with httpx.Client(http2=True) as client:
-                response = client.post(
-                    url,
-                    json=notification,
-                    headers=headers
-                )
+            try:
+                with httpx.Client(http2=True) as client:
+                    response = client.post(
+                        url,
+                        json=notification,
+                        headers=headers
+                    )
+            except httpx.HTTPError:
+                record_delivery(self.app_config.name, NETWORK_ERROR_REASON,
+                                (time.monotonic() - started) * 1000, device_token=device_token)
+                raise
+
+            latency_ms = (time.monotonic() - started) * 1000
+            apns_id = response.headers.get('apns-id')
             
             if response.status_code == 200:
                 print(f"推送发送成功: device_token={device_token}")
+                record_delivery(self.app_config.name, SUCCESS_REASON, latency_ms, apns_id, device_token)
                 return True
             else:
                 error_response = response.json()
                 reason = error_response.get('reason', 'Unknown error')
                 print(f"推送发送失败: {reason}")
+                record_delivery(self.app_config.name, reason, latency_ms, apns_id, device_token)
                 
                 if reason in ['BadDeviceToken', 'Unregistered']:
                     # 标记设备令牌为无效
@@ -119,21 +124,8 @@ class AppleNotificationService:
         context: 用于替换模板中的变量，例如 {"name": "张三"}
         """
         try:
-            template = NotificationTemplate.objects.get(
-                id=template_id, 
-                app_config=self.app_config,
-                is_active=True
-            )
-            
-            title = template.title
-            body = template.body
-            
-            # 替换模板中的变量
-            if context:
-                for key, value in context.items():
-                    placeholder = f"{{{{{key}}}}}"
-                    title = title.replace(placeholder, str(value))
-                    body = body.replace(placeholder, str(value))
+            template = template_renderer.get(template_id, self.app_config.id)
+            title, body = template.render(context)
             
             return self.send_push_notification(
                 device_token=device_token,
@@ -151,6 +143,47 @@ class AppleNotificationService:
             print(f"发送模板通知异常: {str(e)}")
             return False
     
+    def send_template_batch(self, template_id, recipients):
+        """
+        使用模板向一批设备发送通知
+        recipients: [(device_token, context), ...]，模板只查询和编译一次，
+        渲染结果相同的设备共用一份预编码内容批量发送，限流等临时失败加入重试队列
+
+        Returns:
+            dict: {'total': 设备数, 'success': 成功数}
+        """
+        recipients = list(recipients)
+        template = template_renderer.get(template_id, self.app_config.id)
+        rendered = template.render_batch(context for _, context in recipients)
+
+        tokens_by_content = defaultdict(list)
+        for (device_token, _), content in zip(recipients, rendered):
+            tokens_by_content[content].append(device_token)
+
+        apple_service = AppleService(app_id=self.app_config.name)
+        success_count = 0
+        invalid_tokens = []
+        for (title, body), device_tokens in tokens_by_content.items():
+            prepared = apple_service.prepare_notification(
+                title, body, template.badge, template.sound, template.custom_data
+            )
+            results = apple_service.send_bulk_payload(device_tokens, prepared)
+            schedule_retries(apple_service.app_id, prepared, results)
+            success_count += sum(1 for result in results if result['success'])
+            invalid_tokens.extend(result['device_token'] for result in results if is_invalid_token(result))
+
+        if invalid_tokens:
+            # 标记设备令牌为无效
+            DeviceToken.objects.filter(device_token__in=invalid_tokens).update(
+                is_active=False,
+                updated_at=timezone.now()
+            )
+
+        return {
+            'total': len(recipients),
+            'success': success_count
+        }
+    
     def send_notification_to_user(self, user_id, title, body, badge=1, sound="default", custom_data=None):
         """
         向用户的所有活跃设备发送通知
@@ -179,19 +212,20 @@ class AppleNotificationService:
         """
         使用模板向用户的所有活跃设备发送通知
         """
-        device_tokens = DeviceToken.objects.filter(user_id=user_id, is_active=True)
-        success_count = 0
-        
-        for device in device_tokens:
-            result = self.send_notification_by_template(
-                device_token=device.device_token,
-                template_id=template_id,
-                context=context
+        device_tokens = DeviceToken.objects.filter(
+            user_id=user_id, is_active=True
+        ).values_list('device_token', flat=True)
+
+        try:
+            return self.send_template_batch(
+                template_id, [(device_token, context) for device_token in device_tokens]
             )
-            if result:
-                success_count += 1
-        
+        except NotificationTemplate.DoesNotExist:
+            print(f"通知模板不存在或未激活: template_id={template_id}")
+        except Exception as e:
+            print(f"发送模板通知异常: {str(e)}")
+
         return {
-            'total': device_tokens.count(),
-            'success': success_count
-        } 
\ No newline at end of file
+            'total': len(device_tokens),
+            'success': 0
+        }
@@ -0,0 +1,11 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import AppleAppConfiguration
+from .registry import app_registry
+
+
+@receiver(post_save, sender=AppleAppConfiguration)
+@receiver(post_delete, sender=AppleAppConfiguration)
+def invalidate_app_registry(sender, instance, **kwargs):
+    """应用配置变更的事务提交后刷新所有进程的配置注册表"""
+    app_registry.invalidate_on_commit()
@@ -1,3 +1,155 @@
 from django.test import TestCase
 
-# Create your tests here.
+from .models import AppleAppConfiguration
+from .registry import app_registry
+
+
+class AppleAppRegistryTests(TestCase):
+    def setUp(self):
+        self.config = AppleAppConfiguration.objects.create(
+            name='pocket_ai',
+            bundle_id='com.example.pocket',
+            team_id='TEAM',
+            key_id='KEY',
+            auth_key='dummy'
+        )
+
+    def test_lookups_are_served_from_memory(self):
+        app_registry.get('pocket_ai')
+
+        with self.assertNumQueries(0):
+            self.assertEqual(app_registry.get('pocket_ai').bundle_id, 'com.example.pocket')
+            self.assertEqual(app_registry.get_by_bundle_id('com.example.pocket').name, 'pocket_ai')
+            self.assertEqual(app_registry.get_by_id(self.config.id).team_id, 'TEAM')
+
+    def test_save_invalidates_registry(self):
+        self.assertEqual(app_registry.get('pocket_ai').shared_secret, '')
+
+        self.config.shared_secret = 'secret'
+        self.config.save()
+        self.assertEqual(app_registry.get('pocket_ai').shared_secret, 'secret')
+
+        # 与原先的查询一致：按名称获取不检查是否启用，按 Bundle ID 和主键只返回启用的配置
+        self.config.is_active = False
+        self.config.save()
+        self.assertFalse(app_registry.get('pocket_ai').is_active)
+        with self.assertRaises(AppleAppConfiguration.DoesNotExist):
+            app_registry.get_by_bundle_id('com.example.pocket')
+        with self.assertRaises(AppleAppConfiguration.DoesNotExist):
+            app_registry.get_by_id(self.config.id)
+        self.assertEqual(app_registry.all(), [])
+
+
+    def test_active_config_wins_over_inactive_duplicate(self):
+        # 名称不唯一，ID 更大的未启用配置不能覆盖启用的配置
+        AppleAppConfiguration.objects.create(
+            name='pocket_ai',
+            bundle_id='com.example.pocket.old',
+            team_id='OLD',
+            key_id='OLD',
+            auth_key='old',
+            is_active=False
+        )
+
+        self.assertEqual(app_registry.get('pocket_ai').id, self.config.id)
+
+        # 同名的配置都启用时记录错误，使用 ID 最小的一条
+        AppleAppConfiguration.objects.filter(team_id='OLD').update(is_active=True)
+        app_registry.clear()
+        with self.assertLogs('configurations.registry', level='ERROR'):
+            self.assertEqual(app_registry.get('pocket_ai').id, self.config.id)
+
+    def test_other_processes_are_notified_after_commit(self):
+        from unittest import mock
+
+        redis = mock.Mock()
+        with mock.patch('configurations.registry.get_redis_connection', return_value=redis):
+            with self.captureOnCommitCallbacks() as callbacks:
+                self.config.is_active = False
+                self.config.save()
+                # 事务提交前不通知其他进程，避免它们重新加载到旧配置
+                redis.publish.assert_not_called()
+
+            for callback in callbacks:
+                callback()
+        redis.publish.assert_called_once()
+
+
+class TemplateRendererTests(TestCase):
+    def setUp(self):
+        from .models import NotificationTemplate
+        from .renderer import template_renderer
+
+        self.config = AppleAppConfiguration.objects.create(
+            name='pocket_ai',
+            bundle_id='com.example.pocket',
+            team_id='TEAM',
+            key_id='KEY',
+            auth_key='dummy'
+        )
+        self.template = NotificationTemplate.objects.create(
+            app_config=self.config,
+            name='welcome',
+            title='Hi {{name}}',
+            body='{{name}}, you have {{count}} new {{unknown}} items'
+        )
+        self.renderer = template_renderer
+        self.renderer.clear()
+
+    def test_compiled_template_is_cached_until_updated(self):
+        compiled = self.renderer.get(self.template.id, self.config.id)
+        self.assertEqual(
+            compiled.render_batch([{'name': 'Ann', 'count': 2}, {'name': 'Bob'}]),
+            [('Hi Ann', 'Ann, you have 2 new {{unknown}} items'),
+             ('Hi Bob', 'Bob, you have {{count}} new {{unknown}} items')]
+        )
+
+        with self.assertNumQueries(1):
+            self.assertIs(self.renderer.get(self.template.id, self.config.id), compiled)
+
+        self.template.title = 'Hello {{name}}'
+        self.template.save()
+        self.assertEqual(self.renderer.get(self.template.id, self.config.id).render({'name': 'Ann'})[0],
+                         'Hello Ann')
+
+    def test_batch_groups_identical_payloads(self):
+        from unittest import mock
+        from .services import AppleNotificationService
+
+        def results(device_tokens, prepared, **kwargs):
+            return [{'device_token': token, 'success': token != 'bad', 'status_code': 200,
+                     'reason': 'BadDeviceToken' if token == 'bad' else None, 'retry_after': None}
+                    for token in device_tokens]
+
+        with mock.patch('configurations.services.AppleService.send_bulk_payload',
+                        side_effect=results) as send_bulk:
+            stats = AppleNotificationService(app_config_id=self.config.id).send_template_batch(
+                self.template.id,
+                [('a', {'name': 'Ann'}), ('b', {'name': 'Ann'}), ('bad', {'name': 'Bob'})]
+            )
+
+        self.assertEqual(stats, {'total': 3, 'success': 2})
+        self.assertEqual(send_bulk.call_count, 2)
+        self.assertEqual(send_bulk.call_args_list[0].args[0], ['a', 'b'])
+
+    def test_batch_queues_transient_failures_for_retry(self):
+        from unittest import mock
+        from notifications.models import PushRetry
+        from .services import AppleNotificationService
+
+        def results(device_tokens, prepared, **kwargs):
+            return [{'device_token': token, 'success': token == 'a',
+                     'status_code': 200 if token == 'a' else 429,
+                     'reason': None if token == 'a' else 'TooManyRequests', 'retry_after': None}
+                    for token in device_tokens]
+
+        with mock.patch('configurations.services.AppleService.send_bulk_payload', side_effect=results):
+            stats = AppleNotificationService(app_config_id=self.config.id).send_template_batch(
+                self.template.id, [('a', {'name': 'Ann'}), ('b', {'name': 'Bob'})]
+            )
+
+        self.assertEqual(stats, {'total': 2, 'success': 1})
+        retry = PushRetry.objects.get()
+        self.assertEqual((retry.app_id, retry.device_token, retry.last_status_code),
+                         (self.config.name, 'b', 429))
+        self.assertEqual(retry.payload['aps']['alert']['body'], 'Bob, you have {{count}} new {{unknown}} items')
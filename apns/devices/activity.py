@@ -0,0 +1,75 @@
+"""
+设备最近活跃时间
+
+认证通过的 API 请求会标记用户今天已活跃：每个用户每天只有第一次请求写一次 Redis
+（SET NX 加入待写集合），定时任务再批量把待写集合中的用户的设备 last_seen_at 更新为当前时间。
+请求本身不访问数据库。
+
+API 请求只携带用户身份，不区分具体设备，因此 last_seen_at 实际记录的是用户的活跃时间：
+用户任一设备上的请求都会刷新其所有设备，按闲置时间停用设备（prune_stale_devices）也因此按用户生效。
+设备注册时会单独刷新该设备的 last_seen_at。
+"""
+import logging
+
+from django.core.cache import cache
+from django.utils import timezone
+
+from utils.redis_client import get_redis_connection
+
+logger = logging.getLogger(__name__)
+
+SEEN_KEY_PREFIX = 'apns:device-seen'
+PENDING_USERS = f'{SEEN_KEY_PREFIX}:pending'
+SEEN_TTL = 60 * 60 * 24
+
+
+def record_user_seen(user_id):
+    """标记用户今天已活跃，同一用户每天只记录一次"""
+    if not user_id:
+        return
+
+    try:
+        gate_key = f'{SEEN_KEY_PREFIX}:{timezone.now():%Y%m%d}:{user_id}'
+        redis = get_redis_connection()
+
+        if redis is not None:
+            if redis.set(gate_key, 1, nx=True, ex=SEEN_TTL):
+                redis.sadd(PENDING_USERS, user_id)
+            return
+
+        # 未配置 Redis 时使用进程内缓存，仅用于开发和测试
+        if cache.add(gate_key, 1, SEEN_TTL):
+            pending = cache.get(PENDING_USERS, set())
+            pending.add(int(user_id))
+            cache.set(PENDING_USERS, pending, SEEN_TTL)
+    except Exception as e:
+        # 活跃统计失败不能影响请求本身
+        logger.error(f"记录用户活跃时间失败: {str(e)}")
+
+
+def _pop_pending(batch_size):
+    redis = get_redis_connection()
+    if redis is not None:
+        return [int(user_id) for user_id in redis.spop(PENDING_USERS, batch_size) or []]
+
+    pending = cache.get(PENDING_USERS, set())
+    batch = set(list(pending)[:batch_size])
+    cache.set(PENDING_USERS, pending - batch, SEEN_TTL)
+    return list(batch)
+
+
+def flush_last_seen(batch_size=1000):
+    """
+    将待写集合中的用户的所有设备的 last_seen_at 批量更新为当前时间
+
+    Returns:
+        int: 更新的设备数
+    """
+    from devices.models import DeviceToken
+
+    updated = 0
+    while True:
+        user_ids = _pop_pending(batch_size)
+        if not user_ids:
+            return updated
+        updated += DeviceToken.objects.filter(user_id__in=user_ids).update(last_seen_at=timezone.now())
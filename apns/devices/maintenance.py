@@ -0,0 +1,129 @@
+"""
+设备表的维护操作
+
+去重分两步，每步都按组分批处理，每批一个短事务，可以在线上表上直接运行：
+1. 同一 (user_id, device_id) 的多条记录只保留最近更新的一条，其余删除；
+2. 同一 APNs 令牌出现在多条活跃记录上（如设备切换了登录用户）时，
+   只保留最近更新的一条为活跃，其余停用。
+
+函数接收模型类作为参数，以便迁移中传入历史模型。
+
+清理长期不活跃的设备同样按批处理：超过闲置天数的活跃设备停用，记录保留，
+设备重新注册时由 upsert 恢复为活跃。活跃时间按用户记录（见 devices.activity），
+因此只有用户的所有设备都长期未使用时才会停用；用户仍在使用其他设备时，
+不再使用的旧设备由 APNs 返回令牌无效时停用。
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils import timezone
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def dedupe_device_tokens(model, batch_size=1000, log=None):
+    """
+    清理重复的设备记录
+
+    Returns:
+        tuple: (删除的重复设备记录数, 停用的重复令牌记录数)
+    """
+    log = log or (lambda message: None)
+
+    duplicate_devices = list(
+        model.objects.values_list('user_id', 'device_id')
+        .annotate(rows=Count('id'))
+        .filter(rows__gt=1)
+        .order_by()
+    )
+    log(f"重复的 (user_id, device_id) 组: {len(duplicate_devices)}")
+
+    deleted = 0
+    for chunk in _chunks(duplicate_devices, batch_size):
+        condition = Q()
+        for user_id, device_id, _ in chunk:
+            condition |= Q(user_id=user_id, device_id=device_id)
+
+        with transaction.atomic():
+            rows = model.objects.filter(condition).order_by(
+                'user_id', 'device_id', '-updated_at', '-id'
+            ).values_list('id', 'user_id', 'device_id')
+            seen = set()
+            stale_ids = []
+            for row_id, user_id, device_id in rows:
+                if (user_id, device_id) in seen:
+                    stale_ids.append(row_id)
+                else:
+                    seen.add((user_id, device_id))
+            deleted += model.objects.filter(id__in=stale_ids).delete()[0]
+        log(f"已删除 {deleted} 条重复设备记录")
+
+    duplicate_tokens = [
+        device_token for device_token, _ in
+        model.objects.filter(is_active=True)
+        .values_list('device_token')
+        .annotate(rows=Count('id'))
+        .filter(rows__gt=1)
+        .order_by()
+    ]
+    log(f"出现在多条活跃记录上的令牌: {len(duplicate_tokens)}")
+
+    deactivated = 0
+    for chunk in _chunks(duplicate_tokens, batch_size):
+        with transaction.atomic():
+            rows = model.objects.filter(device_token__in=chunk, is_active=True).order_by(
+                'device_token', '-updated_at', '-id'
+            ).values_list('id', 'device_token')
+            seen = set()
+            stale_ids = []
+            for row_id, device_token in rows:
+                if device_token in seen:
+                    stale_ids.append(row_id)
+                else:
+                    seen.add(device_token)
+            deactivated += model.objects.filter(id__in=stale_ids).update(
+                is_active=False, updated_at=timezone.now()
+            )
+        log(f"已停用 {deactivated} 条重复令牌记录")
+
+    return deleted, deactivated
+
+
+def _update_in_batches(queryset, batch_size, **values):
+    """按主键分批更新，每批一条 UPDATE，避免长事务锁住大量行"""
+    total = 0
+    while True:
+        ids = list(queryset.values_list('id', flat=True).order_by()[:batch_size])
+        if not ids:
+            return total
+        total += queryset.model.objects.filter(id__in=ids).update(**values)
+
+
+def prune_stale_devices(model, idle_days, batch_size=1000, log=None):
+    """
+    停用长期不活跃的设备，只停用不删除
+
+    last_seen_at 按用户更新，同一用户的设备一起刷新，因此这里实际按用户判断是否长期不活跃。
+
+    Args:
+        idle_days: 超过该天数未活跃的设备停用，不再接收推送
+
+    Returns:
+        int: 停用的设备数
+    """
+    log = log or (lambda message: None)
+    now = timezone.now()
+
+    # 从未上报过活跃时间的旧记录以 updated_at 为准
+    idle_cutoff = now - timedelta(days=idle_days)
+    idle = model.objects.filter(is_active=True).filter(
+        Q(last_seen_at__lt=idle_cutoff) | Q(last_seen_at__isnull=True, updated_at__lt=idle_cutoff)
+    )
+    deactivated = _update_in_batches(idle, batch_size, is_active=False, updated_at=now)
+    log(f"已停用 {deactivated} 个超过 {idle_days} 天未活跃的设备")
+
+    return deactivated
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from devices.maintenance import dedupe_device_tokens
+from devices.models import DeviceToken
+
+
+class Command(BaseCommand):
+    help = '清理重复的设备记录：删除重复的 (user_id, device_id)，停用出现在多条记录上的同一令牌'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='每个事务处理的重复组数')
+
+    def handle(self, *args, **options):
+        deleted, deactivated = dedupe_device_tokens(
+            DeviceToken,
+            batch_size=options['batch_size'],
+            log=self.stdout.write
+        )
+        self.stdout.write(self.style.SUCCESS(f"完成：删除 {deleted} 条，停用 {deactivated} 条"))
@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from devices.maintenance import prune_stale_devices
+from devices.models import DeviceToken
+
+
+class Command(BaseCommand):
+    help = '停用长期不活跃的设备'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--idle-days', type=int, default=settings.DEVICE_IDLE_DAYS,
+                            help='超过该天数未活跃的设备停用')
+        parser.add_argument('--batch-size', type=int, default=settings.DEVICE_PRUNE_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        deactivated = prune_stale_devices(
+            DeviceToken,
+            idle_days=options['idle_days'],
+            batch_size=options['batch_size'],
+            log=self.stdout.write
+        )
+        self.stdout.write(self.style.SUCCESS(f"完成：停用 {deactivated} 个"))
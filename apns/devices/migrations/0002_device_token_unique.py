@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-19 13:22
+
+from django.db import migrations, models
+
+from utils.migrations import AddUniqueConstraintConcurrently, AlterFieldAddIndexConcurrently
+
+
+def dedupe(apps, schema_editor):
+    # 大表建议先在线执行 manage.py dedupe_device_tokens，这里只清理剩余的少量重复
+    from devices.maintenance import dedupe_device_tokens
+
+    dedupe_device_tokens(apps.get_model('devices', 'DeviceToken'))
+
+
+class Migration(migrations.Migration):
+
+    # 去重按批提交，索引并发创建，都不能放在同一个事务中
+    atomic = False
+
+    dependencies = [
+        ('devices', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe, migrations.RunPython.noop),
+        AlterFieldAddIndexConcurrently(
+            model_name='devicetoken',
+            name='device_token',
+            field=models.CharField(db_index=True, max_length=255),
+        ),
+        AddUniqueConstraintConcurrently(
+            model_name='devicetoken',
+            constraint=models.UniqueConstraint(fields=('user_id', 'device_id'), name='unique_user_device'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.30 on 2026-10-19 13:23
+
+from django.db import migrations, models
+
+from utils.migrations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY 不能在事务中执行
+    atomic = False
+
+    dependencies = [
+        ('devices', '0002_device_token_unique'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='devicetoken',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['user_id'], name='device_active_user_idx'),
+        ),
+    ]
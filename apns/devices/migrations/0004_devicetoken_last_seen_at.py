@@ -0,0 +1,27 @@
+# Generated by Django 4.2.30 on 2026-10-19 13:28
+
+from django.db import migrations, models
+
+from utils.migrations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY 不能在事务中执行
+    atomic = False
+
+    dependencies = [
+        ('devices', '0003_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='devicetoken',
+            name='last_seen_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='最近活跃时间'),
+        ),
+        AddIndexConcurrently(
+            model_name='devicetoken',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['last_seen_at'], name='device_active_last_seen_idx'),
+        ),
+    ]
@@ -5,9 +5,10 @@ from django.utils.translation import gettext_lazy as _
 class DeviceToken(models.Model):
     user_id = models.IntegerField(_('用户ID'), db_index=True, help_text=_('UserCenter的用户ID'))
     device_id = models.CharField(max_length=255)  # 设备ID，客户端传来
-    device_token = models.CharField(max_length=255)  # APNs设备Token
+    device_token = models.CharField(max_length=255, db_index=True)  # APNs设备Token
     send_time = models.DateTimeField(null=True, blank=True)
     is_active = models.BooleanField(default=True)  # 标记该Token是否有效
+    last_seen_at = models.DateTimeField('最近活跃时间', null=True, blank=True)
     created_at = models.DateTimeField(_('创建时间'), auto_now_add=True)
     updated_at = models.DateTimeField(_('更新时间'), auto_now=True)
 
@@ -18,6 +19,17 @@ class DeviceToken(models.Model):
         verbose_name = '设备管理'
         verbose_name_plural = '设备管理'
         ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(fields=['user_id', 'device_id'], name='unique_user_device'),
+        ]
+        indexes = [
+            # 按用户查找活跃设备，(user_id, device_id) 的查询由唯一约束的索引覆盖
+            models.Index(fields=['user_id'], name='device_active_user_idx',
+                         condition=models.Q(is_active=True)),
+            # 按最近活跃时间筛选和清理活跃设备
+            models.Index(fields=['last_seen_at'], name='device_active_last_seen_idx',
+                         condition=models.Q(is_active=True)),
+        ]
 
     def mark_inactive(self):
         self.is_active = False
@@ -1,3 +1,5 @@
+from django.db import transaction
+from django.utils import timezone
 from rest_framework import serializers
 
 from utils.serializers_fields import TimestampField
@@ -7,13 +9,15 @@ from .models import DeviceToken
 class DeviceTokenSerializer(serializers.ModelSerializer):
     """设备令牌序列化器"""
 
+    last_seen_at = TimestampField(read_only=True)
     created_at = TimestampField(read_only=True)
     updated_at = TimestampField(read_only=True)
     
     class Meta:
         model = DeviceToken
-        fields = ['id', 'user_id', 'device_id', 'device_token', 'is_active', 'created_at', 'updated_at']
-        read_only_fields = ['id', 'created_at', 'updated_at']
+        fields = ['id', 'user_id', 'device_id', 'device_token', 'is_active', 'last_seen_at',
+                  'created_at', 'updated_at']
+        read_only_fields = ['id', 'last_seen_at', 'created_at', 'updated_at']
 
 
 class DeviceTokenCreateSerializer(serializers.ModelSerializer):
@@ -22,25 +26,30 @@ class DeviceTokenCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = DeviceToken
         fields = ['user_id', 'device_id', 'device_token']
+        # 同一设备重复注册时更新原记录，唯一约束由 create 中的 upsert 处理
+        validators = []
     
     def create(self, validated_data):
-        """创建或更新设备令牌"""
-        user_id = validated_data.get('user_id')
-        device_id = validated_data.get('device_id')
-        
-        # 尝试查找现有设备令牌
-        try:
-            device_token = DeviceToken.objects.get(
-                user_id=user_id,
-                device_id=device_id
+        """
+        创建或更新设备令牌，单条 INSERT ... ON CONFLICT 语句完成，并发注册也不会产生重复记录
+
+        同一 APNs 令牌只保留一条活跃记录：设备切换登录用户或重装后换了 device_id 时，
+        停用其他记录上的同一令牌，避免同一设备收到重复推送。
+        """
+        now = timezone.now()
+        device_token = DeviceToken(**validated_data, is_active=True, last_seen_at=now)
+        with transaction.atomic():
+            DeviceToken.objects.bulk_create(
+                [device_token],
+                update_conflicts=True,
+                unique_fields=['user_id', 'device_id'],
+                update_fields=['device_token', 'is_active', 'last_seen_at', 'updated_at']
             )
-            # 更新现有记录
-            for key, value in validated_data.items():
-                setattr(device_token, key, value)
-            device_token.is_active = True  # 确保设置为活跃状态
-            device_token.save()
-        except DeviceToken.DoesNotExist:
-            # 创建新记录
-            device_token = DeviceToken.objects.create(**validated_data)
-        
-        return device_token 
\ No newline at end of file
+            DeviceToken.objects.filter(
+                device_token=device_token.device_token,
+                is_active=True
+            ).exclude(
+                user_id=device_token.user_id,
+                device_id=device_token.device_id
+            ).update(is_active=False, updated_at=now)
+        return device_token
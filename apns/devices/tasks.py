@@ -0,0 +1,27 @@
+from celery import shared_task
+from django.conf import settings
+
+from devices.activity import flush_last_seen
+from devices.maintenance import prune_stale_devices as prune
+from devices.models import DeviceToken
+from utils.leases import run_with_lease
+
+
+@shared_task
+def flush_device_last_seen():
+    """将最近活跃的用户批量写入设备的 last_seen_at"""
+    return flush_last_seen()
+
+
+@shared_task
+def prune_stale_devices():
+    """停用长期不活跃的设备"""
+    return run_with_lease(
+        'prune-stale-devices',
+        lambda: prune(
+            DeviceToken,
+            idle_days=settings.DEVICE_IDLE_DAYS,
+            batch_size=settings.DEVICE_PRUNE_BATCH_SIZE
+        ),
+        ttl=60 * 60
+    )
@@ -1,4 +1,7 @@
-from django.test import TestCase
+from unittest import mock
+
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APIClient
@@ -81,3 +84,122 @@ class DeviceTokenTests(TestCase):
         self.assertEqual(DeviceToken.objects.count(), 1)
         self.device_token.refresh_from_db()
         self.assertEqual(self.device_token.device_token, 'updated-device-token')
+
+
+class DeviceTokenUpsertTests(TestCase):
+    def test_registration_upserts_existing_device(self):
+        from .serializers import DeviceTokenCreateSerializer
+
+        DeviceToken.objects.create(user_id=1, device_id='phone', device_token='old', is_active=False)
+
+        serializer = DeviceTokenCreateSerializer(
+            data={'user_id': 1, 'device_id': 'phone', 'device_token': 'new'}
+        )
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        # 写入和停用其他记录上的同一令牌各一条语句，另外两条是测试事务中的保存点
+        with self.assertNumQueries(4):
+            serializer.save()
+
+        device = DeviceToken.objects.get()
+        self.assertEqual(device.device_token, 'new')
+        self.assertTrue(device.is_active)
+
+    def test_registration_deactivates_token_on_other_devices(self):
+        from .serializers import DeviceTokenCreateSerializer
+
+        previous_user = DeviceToken.objects.create(user_id=1, device_id='phone', device_token='shared')
+        reinstalled = DeviceToken.objects.create(user_id=2, device_id='old-install', device_token='shared')
+        other = DeviceToken.objects.create(user_id=2, device_id='tablet', device_token='other')
+
+        serializer = DeviceTokenCreateSerializer(
+            data={'user_id': 2, 'device_id': 'phone', 'device_token': 'shared'}
+        )
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        serializer.save()
+
+        self.assertEqual(
+            list(DeviceToken.objects.filter(device_token='shared', is_active=True).values_list('user_id', 'device_id')),
+            [(2, 'phone')]
+        )
+        for device in (previous_user, reinstalled):
+            device.refresh_from_db()
+            self.assertFalse(device.is_active)
+        other.refresh_from_db()
+        self.assertTrue(other.is_active)
+
+
+class DeviceActivityTests(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+
+    def test_last_seen_is_recorded_once_per_day_and_flushed_in_batch(self):
+        from .activity import record_user_seen, flush_last_seen
+
+        phone = DeviceToken.objects.create(user_id=1, device_id='phone', device_token='a')
+        DeviceToken.objects.create(user_id=1, device_id='tablet', device_token='b')
+        other = DeviceToken.objects.create(user_id=2, device_id='phone', device_token='c')
+
+        with self.assertNumQueries(0):
+            for _ in range(3):
+                record_user_seen(1)
+
+        self.assertEqual(flush_last_seen(batch_size=1), 2)
+        phone.refresh_from_db()
+        other.refresh_from_db()
+        self.assertIsNotNone(phone.last_seen_at)
+        self.assertIsNone(other.last_seen_at)
+
+        # 当天再次访问不会重复写入
+        record_user_seen(1)
+        self.assertEqual(flush_last_seen(), 0)
+
+    def test_prune_only_deactivates_idle_devices(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .maintenance import prune_stale_devices
+
+        now = timezone.now()
+        recent = DeviceToken.objects.create(user_id=1, device_id='recent', device_token='a',
+                                            last_seen_at=now - timedelta(days=1))
+        idle = DeviceToken.objects.create(user_id=1, device_id='idle', device_token='b',
+                                          last_seen_at=now - timedelta(days=100))
+        legacy = DeviceToken.objects.create(user_id=2, device_id='legacy', device_token='c')
+        old_inactive = DeviceToken.objects.create(user_id=3, device_id='old', device_token='d', is_active=False)
+        DeviceToken.objects.filter(id__in=[legacy.id, old_inactive.id]).update(
+            updated_at=now - timedelta(days=200)
+        )
+
+        self.assertEqual(prune_stale_devices(DeviceToken, idle_days=90, batch_size=1), 2)
+        self.assertEqual(
+            set(DeviceToken.objects.filter(is_active=True).values_list('id', flat=True)), {recent.id}
+        )
+        # 停用的记录都保留
+        self.assertEqual(DeviceToken.objects.count(), 4)
+        self.assertTrue(DeviceToken.objects.filter(id__in=[idle.id, old_inactive.id]).exists())
+
+
+class DeviceTokenDedupeTests(TransactionTestCase):
+    def setUp(self):
+        # 模拟加唯一约束之前遗留的重复数据（SQLite 按模型当前的约束重建表）
+        constraint = DeviceToken._meta.constraints[0]
+        with mock.patch.object(DeviceToken._meta, 'constraints', []):
+            with connection.schema_editor() as editor:
+                editor.remove_constraint(DeviceToken, constraint)
+
+    def tearDown(self):
+        DeviceToken.objects.all().delete()
+        with connection.schema_editor() as editor:
+            editor.add_constraint(DeviceToken, DeviceToken._meta.constraints[0])
+
+    def test_dedupe_removes_duplicates(self):
+        from .maintenance import dedupe_device_tokens
+
+        DeviceToken.objects.create(user_id=1, device_id='phone', device_token='a')
+        kept = DeviceToken.objects.create(user_id=1, device_id='phone', device_token='a')
+        DeviceToken.objects.create(user_id=2, device_id='tablet', device_token='b')
+        switched = DeviceToken.objects.create(user_id=3, device_id='tablet', device_token='b')
+
+        self.assertEqual(dedupe_device_tokens(DeviceToken, batch_size=1), (1, 1))
+        self.assertEqual(list(DeviceToken.objects.filter(user_id=1)), [kept])
+        self.assertEqual(list(DeviceToken.objects.filter(device_token='b', is_active=True)), [switched])
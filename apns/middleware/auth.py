@@ -4,6 +4,7 @@ from django.conf import settings
 from django.http import JsonResponse
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
+from devices.activity import record_user_seen
 import logging
 logger = logging.getLogger(__name__)
 
@@ -42,6 +43,7 @@ class TokenAuthMiddleware:
                 logger.warning(f"认证失败: {path}")
                 return user_info
             request.remote_user = user_info
+            record_user_seen(user_info.get('id'))
             logger.debug(f"认证成功: {path}, 用户ID: {user_info.get('id')}")
         else:
             logger.debug(f"路径 {path} 不需要认证")
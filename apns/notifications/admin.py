@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Notifications
+from .models import Notifications, Campaign, DeliveryStat, PushRetry, PushDelivery
 
 @admin.register(Notifications)
 class NotificationsAdmin(admin.ModelAdmin):
@@ -37,3 +37,52 @@ class NotificationsAdmin(admin.ModelAdmin):
         updated = queryset.update(is_active=False)
         self.message_user(request, f'成功停用 {updated} 个通知设置')
     deactivate_notifications.short_description = "停用选中的通知设置"
+
+
+@admin.register(Campaign)
+class CampaignAdmin(admin.ModelAdmin):
+    list_display = ('name', 'template', 'status', 'total_count', 'sent_count', 'failed_count',
+                    'started_at', 'finished_at', 'created_at')
+    list_filter = ('status', 'created_at')
+    search_fields = ('name',)
+    readonly_fields = ('status', 'total_count', 'sent_count', 'failed_count', 'last_device_id',
+                       'error', 'started_at', 'finished_at', 'created_at', 'updated_at')
+    fieldsets = (
+        ('基本信息', {
+            'fields': ('name', 'template', 'rate_per_second')
+        }),
+        ('分群条件', {
+            'fields': ('app_id', 'last_seen_after', 'is_premium', 'timezones')
+        }),
+        ('发送进度', {
+            'fields': ('status', 'total_count', 'sent_count', 'failed_count', 'last_device_id', 'error',
+                       'started_at', 'finished_at', 'created_at', 'updated_at')
+        }),
+    )
+
+
+@admin.register(DeliveryStat)
+class DeliveryStatAdmin(admin.ModelAdmin):
+    list_display = ('app_id', 'minute', 'reason', 'count', 'latency_ms_total')
+    list_filter = ('app_id', 'reason')
+    date_hierarchy = 'minute'
+    readonly_fields = ('app_id', 'minute', 'reason', 'count', 'latency_ms_total')
+
+
+@admin.register(PushRetry)
+class PushRetryAdmin(admin.ModelAdmin):
+    list_display = ('app_id', 'device_token', 'attempts', 'last_status_code', 'last_reason',
+                    'next_attempt_at', 'created_at')
+    list_filter = ('app_id', 'last_reason')
+    search_fields = ('device_token',)
+    readonly_fields = ('created_at', 'updated_at')
+
+
+
+@admin.register(PushDelivery)
+class PushDeliveryAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user_id', 'app_id', 'device_token', 'status', 'status_code', 'reason',
+                    'delivered_at', 'created_at')
+    list_filter = ('app_id', 'status')
+    search_fields = ('user_id', 'device_token')
+    readonly_fields = ('created_at', 'updated_at')
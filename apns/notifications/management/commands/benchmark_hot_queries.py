@@ -0,0 +1,154 @@
+"""
+热点查询的索引基准测试
+
+在一个最终回滚的事务中写入测试数据，分别在有、无新增索引的情况下执行
+EXPLAIN ANALYZE，输出执行计划和耗时。不会在数据库中留下任何数据或结构变更，
+但写入百万行数据期间会占用较多 IO，请在测试库或低峰期运行。
+
+    python manage.py benchmark_hot_queries --rows 1000000
+"""
+import random
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from devices.models import DeviceToken
+from notifications.models import Notifications
+from purchase.models import Purchase
+
+# 需要对比的新增索引
+BENCHMARK_INDEXES = [
+    (Notifications, 'notif_due_idx'),
+    (Notifications, 'notif_active_user_idx'),
+    (DeviceToken, 'device_active_user_idx'),
+    (Purchase, 'purchase_active_expiry_idx'),
+]
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = '写入测试数据，对比新增索引前后热点查询的执行计划和耗时（结束后全部回滚）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000, help='每张表写入的行数')
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=20, help='每个查询计时的执行次数')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('基准测试需要 PostgreSQL，当前数据库为 %s' % connection.vendor)
+
+        try:
+            with transaction.atomic():
+                users = self._seed(options['rows'], options['batch_size'])
+                queries = self._queries(users)
+
+                self.stdout.write(self.style.MIGRATE_HEADING('== 使用新增索引 =='))
+                after = self._run(queries, options['repeat'])
+
+                self._drop_indexes()
+                self.stdout.write(self.style.MIGRATE_HEADING('== 不使用新增索引 =='))
+                before = self._run(queries, options['repeat'])
+
+                self.stdout.write(self.style.MIGRATE_HEADING('== 对比 =='))
+                for name in queries:
+                    self.stdout.write(f"{name}: {before[name]:.2f}ms -> {after[name]:.2f}ms")
+                raise Rollback()
+        except Rollback:
+            self.stdout.write(self.style.SUCCESS('测试数据和索引变更已回滚'))
+
+    def _seed(self, rows, batch_size):
+        """写入测试数据，约 90% 的计划和设备为活跃状态，约 30% 的用户有有效订阅"""
+        now = timezone.now()
+        users = max(rows // 2, 1)
+        timezones = ['Asia/Shanghai', 'America/New_York', 'Europe/London', 'UTC']
+
+        started = time.monotonic()
+        for start in range(0, rows, batch_size):
+            ids = range(start, min(start + batch_size, rows))
+            Notifications.objects.bulk_create([
+                Notifications(
+                    user_id=i % users,
+                    timezone=timezones[i % len(timezones)],
+                    notify_time=f'{i % 24:02d}:{i % 60:02d}',
+                    days_remaining=i % 22,
+                    is_active=i % 10 != 0
+                ) for i in ids
+            ])
+            DeviceToken.objects.bulk_create([
+                DeviceToken(
+                    user_id=i % users,
+                    device_id=f'device-{i}',
+                    device_token=f'{i:064x}',
+                    is_active=i % 10 != 0
+                ) for i in ids
+            ])
+            Purchase.objects.bulk_create([
+                Purchase(
+                    user_id=i % users,
+                    app_id='pocket_ai',
+                    product_id='premium.monthly',
+                    transaction_id=f'benchmark-{i}',
+                    original_transaction_id=f'benchmark-{i % users}',
+                    purchase_date=now - timedelta(days=30),
+                    expires_at=now + timedelta(days=random.randint(-60, 30)),
+                    is_active=i % 3 == 0,
+                    is_successful=True
+                ) for i in ids
+            ])
+        self.stdout.write(f"写入 3 x {rows} 行，耗时 {time.monotonic() - started:.1f}s")
+
+        with connection.cursor() as cursor:
+            for model in (Notifications, DeviceToken, Purchase):
+                cursor.execute(f'ANALYZE {model._meta.db_table}')
+        return users
+
+    def _queries(self, users):
+        """与业务代码相同的 ORM 调用"""
+        now = timezone.now()
+        user_id = users // 3
+        return {
+            'reminder_schedules': lambda: Notifications.objects.filter(
+                is_active=True, days_remaining__gt=0
+            ),
+            'active_schedule_by_user': lambda: Notifications.objects.filter(
+                user_id=user_id, is_active=True
+            ),
+            'active_devices_by_user': lambda: DeviceToken.objects.filter(
+                user_id=user_id, is_active=True
+            ),
+            'device_by_user_and_device_id': lambda: DeviceToken.objects.filter(
+                user_id=user_id, device_id=f'device-{user_id}'
+            ).order_by('-created_at'),
+            'active_subscriptions': lambda: Purchase.objects.filter(
+                user_id=user_id, is_active=True, is_successful=True, expires_at__gt=now
+            ).order_by('-expires_at'),
+        }
+
+    def _run(self, queries, repeat):
+        """输出每个查询的执行计划，返回平均耗时（毫秒）"""
+        timings = {}
+        for name, build in queries.items():
+            self.stdout.write(self.style.SQL_KEYWORD(f'-- {name}'))
+            self.stdout.write(build().explain(analyze=True, buffers=True))
+
+            started = time.perf_counter()
+            for _ in range(repeat):
+                list(build()[:1000])
+            timings[name] = (time.perf_counter() - started) * 1000 / repeat
+        return timings
+
+    def _drop_indexes(self):
+        with connection.schema_editor(atomic=False) as editor:
+            for model, name in BENCHMARK_INDEXES:
+                index = next(index for index in model._meta.indexes if index.name == name)
+                editor.remove_index(model, index)
+        with connection.cursor() as cursor:
+            for model in (Notifications, DeviceToken, Purchase):
+                cursor.execute(f'ANALYZE {model._meta.db_table}')
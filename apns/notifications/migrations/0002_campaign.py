@@ -0,0 +1,43 @@
+# Generated by Django 4.2.30 on 2026-10-19 13:14
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('configurations', '0004_appleappconfiguration_admin_token'),
+        ('notifications', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Campaign',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, verbose_name='活动名称')),
+                ('app_id', models.CharField(blank=True, help_text='仅发送给在该应用有购买记录的用户，可填写应用名称或Bundle ID', max_length=255, null=True, verbose_name='应用')),
+                ('last_seen_after', models.DateTimeField(blank=True, null=True, verbose_name='最近活跃时间晚于')),
+                ('is_premium', models.BooleanField(blank=True, help_text='为空时不区分会员状态', null=True, verbose_name='是否会员')),
+                ('timezones', models.JSONField(blank=True, default=list, help_text='仅发送给通知设置在这些时区内的用户', verbose_name='时区')),
+                ('rate_per_second', models.PositiveIntegerField(default=50, verbose_name='每秒发送上限')),
+                ('status', models.CharField(choices=[('pending', '等待发送'), ('running', '发送中'), ('completed', '已完成'), ('cancelled', '已取消'), ('failed', '失败')], default='pending', max_length=20, verbose_name='状态')),
+                ('total_count', models.IntegerField(default=0, verbose_name='目标设备数')),
+                ('sent_count', models.IntegerField(default=0, verbose_name='成功数')),
+                ('failed_count', models.IntegerField(default=0, verbose_name='失败数')),
+                ('last_device_id', models.BigIntegerField(default=0, verbose_name='已处理到的设备ID')),
+                ('error', models.TextField(blank=True, null=True, verbose_name='错误信息')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='开始时间')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='完成时间')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+                ('template', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='campaigns', to='configurations.notificationtemplate', verbose_name='通知模板')),
+            ],
+            options={
+                'verbose_name': '群发活动',
+                'verbose_name_plural': '群发活动',
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
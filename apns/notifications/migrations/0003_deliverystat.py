@@ -0,0 +1,31 @@
+# Generated by Django 4.2.30 on 2026-10-19 13:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0002_campaign'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeliveryStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('app_id', models.CharField(max_length=100, verbose_name='应用')),
+                ('minute', models.DateTimeField(verbose_name='统计分钟')),
+                ('reason', models.CharField(help_text='成功为 Success，失败为 APNs 返回的 reason', max_length=64, verbose_name='结果')),
+                ('count', models.IntegerField(default=0, verbose_name='推送数')),
+                ('latency_ms_total', models.BigIntegerField(default=0, verbose_name='累计耗时(毫秒)')),
+            ],
+            options={
+                'verbose_name': '推送统计',
+                'verbose_name_plural': '推送统计',
+                'ordering': ['-minute'],
+                'indexes': [models.Index(fields=['minute'], name='notificatio_minute_17c353_idx')],
+                'unique_together': {('app_id', 'minute', 'reason')},
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.30 on 2026-10-19 13:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0003_deliverystat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PushRetry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('app_id', models.CharField(max_length=100, verbose_name='应用')),
+                ('device_token', models.CharField(max_length=255, verbose_name='设备令牌')),
+                ('payload', models.JSONField(verbose_name='推送内容')),
+                ('attempts', models.IntegerField(default=0, verbose_name='已重试次数')),
+                ('next_attempt_at', models.DateTimeField(db_index=True, verbose_name='下次重试时间')),
+                ('last_status_code', models.IntegerField(blank=True, null=True, verbose_name='上次状态码')),
+                ('last_reason', models.CharField(blank=True, max_length=64, null=True, verbose_name='上次失败原因')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+            ],
+            options={
+                'verbose_name': '推送重试队列',
+                'verbose_name_plural': '推送重试队列',
+                'ordering': ['next_attempt_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-19 13:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0004_pushretry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pushretry',
+            name='channel',
+            field=models.CharField(default='transactional', max_length=20, verbose_name='限速渠道'),
+        ),
+    ]
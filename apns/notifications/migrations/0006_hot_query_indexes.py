@@ -0,0 +1,26 @@
+# Generated by Django 4.2.30 on 2026-10-19 13:23
+
+from django.db import migrations, models
+
+from utils.migrations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY 不能在事务中执行
+    atomic = False
+
+    dependencies = [
+        ('notifications', '0005_pushretry_channel'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='notifications',
+            index=models.Index(condition=models.Q(('days_remaining__gt', 0), ('is_active', True)), fields=['notify_time', 'timezone'], name='notif_due_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='notifications',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['user_id'], name='notif_active_user_idx'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.30 on 2026-10-19 13:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0006_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PushDelivery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.IntegerField(db_index=True, help_text='UserCenter的用户ID', verbose_name='用户ID')),
+                ('app_id', models.CharField(max_length=100, verbose_name='应用')),
+                ('device_token', models.CharField(max_length=255, verbose_name='设备令牌')),
+                ('payload', models.JSONField(verbose_name='推送内容')),
+                ('status', models.CharField(choices=[('queued', '已受理'), ('retrying', '等待重试'), ('sent', '已送达'), ('failed', '失败')], default='queued', max_length=20, verbose_name='状态')),
+                ('status_code', models.IntegerField(blank=True, null=True, verbose_name='APNs 状态码')),
+                ('reason', models.CharField(blank=True, max_length=64, null=True, verbose_name='失败原因')),
+                ('apns_id', models.CharField(blank=True, max_length=64, null=True, verbose_name='APNs ID')),
+                ('delivered_at', models.DateTimeField(blank=True, null=True, verbose_name='送达时间')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+            ],
+            options={
+                'verbose_name': '异步推送',
+                'verbose_name_plural': '异步推送',
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='pushretry',
+            name='delivery',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='retries', to='notifications.pushdelivery', verbose_name='异步推送'),
+        ),
+    ]
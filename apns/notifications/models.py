@@ -15,9 +15,208 @@ class Notifications(models.Model):
         verbose_name = '定时通知设置'
         verbose_name_plural = verbose_name
         ordering = ['-created_at']
+        indexes = [
+            # 提醒任务每分钟扫描的待发送计划
+            models.Index(fields=['notify_time', 'timezone'], name='notif_due_idx',
+                         condition=models.Q(is_active=True, days_remaining__gt=0)),
+            # 按用户查找当前启用的计划
+            models.Index(fields=['user_id'], name='notif_active_user_idx',
+                         condition=models.Q(is_active=True)),
+        ]
 
     def decrease_days(self):
         self.days_remaining -= 1
         if self.days_remaining <= 0:
             self.is_active = False
         self.save()
+
+    def mark_sent(self, sent_at):
+        """记录一次发送并减少剩余天数，只修改内存中的对象，由调用方批量保存"""
+        self.last_sent = sent_at
+        self.days_remaining -= 1
+        if self.days_remaining <= 0:
+            self.is_active = False
+        self.updated_at = sent_at
+
+
+class Campaign(models.Model):
+    """群发活动，按分群条件向匹配的设备批量推送通知模板"""
+
+    STATUS_CHOICES = [
+        ('pending', '等待发送'),
+        ('running', '发送中'),
+        ('completed', '已完成'),
+        ('cancelled', '已取消'),
+        ('failed', '失败'),
+    ]
+
+    name = models.CharField('活动名称', max_length=100)
+    template = models.ForeignKey('configurations.NotificationTemplate', on_delete=models.PROTECT,
+                                 related_name='campaigns', verbose_name='通知模板')
+
+    # 分群条件，为空表示不限制
+    app_id = models.CharField('应用', max_length=255, blank=True, null=True,
+                              help_text='仅发送给在该应用有购买记录的用户，可填写应用名称或Bundle ID')
+    last_seen_after = models.DateTimeField('最近活跃时间晚于', null=True, blank=True)
+    is_premium = models.BooleanField('是否会员', null=True, blank=True,
+                                     help_text='为空时不区分会员状态')
+    timezones = models.JSONField('时区', default=list, blank=True,
+                                 help_text='仅发送给通知设置在这些时区内的用户')
+
+    rate_per_second = models.PositiveIntegerField('每秒发送上限', default=50)
+    status = models.CharField('状态', max_length=20, choices=STATUS_CHOICES, default='pending')
+
+    # 发送进度，发送过程中逐批更新
+    total_count = models.IntegerField('目标设备数', default=0)
+    sent_count = models.IntegerField('成功数', default=0)
+    failed_count = models.IntegerField('失败数', default=0)
+    last_device_id = models.BigIntegerField('已处理到的设备ID', default=0)
+    error = models.TextField('错误信息', blank=True, null=True)
+
+    started_at = models.DateTimeField('开始时间', null=True, blank=True)
+    finished_at = models.DateTimeField('完成时间', null=True, blank=True)
+    created_at = models.DateTimeField(_('创建时间'), auto_now_add=True)
+    updated_at = models.DateTimeField(_('更新时间'), auto_now=True)
+
+    class Meta:
+        verbose_name = '群发活动'
+        verbose_name_plural = verbose_name
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.name} ({self.get_status_display()})"
+
+    def get_device_queryset(self):
+        """根据分群条件返回匹配的活跃设备"""
+        from django.utils import timezone
+        from configurations.registry import app_registry
+        from devices.models import DeviceToken
+        from purchase.models import Purchase
+
+        devices = DeviceToken.objects.filter(is_active=True)
+
+        if self.app_id:
+            # 购买记录中的 app_id 可能是应用名称，也可能是 Bundle ID，两者都匹配
+            app_ids = {self.app_id}
+            for app_config in app_registry.all():
+                if self.app_id in (app_config.name, app_config.bundle_id):
+                    app_ids.update([app_config.name, app_config.bundle_id])
+
+            devices = devices.filter(
+                user_id__in=Purchase.objects.filter(app_id__in=app_ids).values('user_id')
+            )
+
+        if self.last_seen_after:
+            # 从未上报过活跃时间的旧记录以 updated_at 为准
+            devices = devices.filter(
+                models.Q(last_seen_at__gte=self.last_seen_after) |
+                models.Q(last_seen_at__isnull=True, updated_at__gte=self.last_seen_after)
+            )
+
+        if self.is_premium is not None:
+            premium_users = Purchase.objects.filter(
+                is_active=True,
+                is_successful=True,
+                expires_at__gt=timezone.now()
+            ).values('user_id')
+            if self.is_premium:
+                devices = devices.filter(user_id__in=premium_users)
+            else:
+                devices = devices.exclude(user_id__in=premium_users)
+
+        if self.timezones:
+            devices = devices.filter(
+                user_id__in=Notifications.objects.filter(timezone__in=self.timezones).values('user_id')
+            )
+
+        return devices
+
+
+class DeliveryStat(models.Model):
+    """按分钟汇总的推送结果统计，每个 (应用, 分钟, 原因) 一行"""
+
+    app_id = models.CharField('应用', max_length=100)
+    minute = models.DateTimeField('统计分钟')
+    reason = models.CharField('结果', max_length=64, help_text='成功为 Success，失败为 APNs 返回的 reason')
+    count = models.IntegerField('推送数', default=0)
+    latency_ms_total = models.BigIntegerField('累计耗时(毫秒)', default=0)
+
+    class Meta:
+        verbose_name = '推送统计'
+        verbose_name_plural = verbose_name
+        ordering = ['-minute']
+        unique_together = ('app_id', 'minute', 'reason')
+        indexes = [
+            models.Index(fields=['minute']),
+        ]
+
+    def __str__(self):
+        return f"{self.app_id} {self.minute:%Y-%m-%d %H:%M} {self.reason}: {self.count}"
+
+
+class PushRetry(models.Model):
+    """因 APNs 限流或临时故障发送失败、等待重试的推送"""
+
+    app_id = models.CharField('应用', max_length=100)
+    device_token = models.CharField('设备令牌', max_length=255)
+    payload = models.JSONField('推送内容')
+    channel = models.CharField('限速渠道', max_length=20, default='transactional')
+    attempts = models.IntegerField('已重试次数', default=0)
+    next_attempt_at = models.DateTimeField('下次重试时间', db_index=True)
+    last_status_code = models.IntegerField('上次状态码', null=True, blank=True)
+    last_reason = models.CharField('上次失败原因', max_length=64, blank=True, null=True)
+    delivery = models.ForeignKey('PushDelivery', on_delete=models.SET_NULL, null=True, blank=True,
+                                 related_name='retries', verbose_name='异步推送')
+    created_at = models.DateTimeField(_('创建时间'), auto_now_add=True)
+    updated_at = models.DateTimeField(_('更新时间'), auto_now=True)
+
+    class Meta:
+        verbose_name = '推送重试队列'
+        verbose_name_plural = verbose_name
+        ordering = ['next_attempt_at']
+
+    def __str__(self):
+        return f"{self.app_id} - {self.device_token} (第 {self.attempts} 次重试)"
+
+
+class PushDelivery(models.Model):
+    """异步模式下受理的单条推送，记录投递结果供调用方查询"""
+
+    STATUS_CHOICES = [
+        ('queued', '已受理'),
+        ('retrying', '等待重试'),
+        ('sent', '已送达'),
+        ('failed', '失败'),
+    ]
+
+    user_id = models.IntegerField(_('用户ID'), db_index=True, help_text=_('UserCenter的用户ID'))
+    app_id = models.CharField('应用', max_length=100)
+    device_token = models.CharField('设备令牌', max_length=255)
+    payload = models.JSONField('推送内容')
+    status = models.CharField('状态', max_length=20, choices=STATUS_CHOICES, default='queued')
+    status_code = models.IntegerField('APNs 状态码', null=True, blank=True)
+    reason = models.CharField('失败原因', max_length=64, blank=True, null=True)
+    apns_id = models.CharField('APNs ID', max_length=64, blank=True, null=True)
+    delivered_at = models.DateTimeField('送达时间', null=True, blank=True)
+    created_at = models.DateTimeField(_('创建时间'), auto_now_add=True)
+    updated_at = models.DateTimeField(_('更新时间'), auto_now=True)
+
+    class Meta:
+        verbose_name = '异步推送'
+        verbose_name_plural = verbose_name
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.user_id} - {self.device_token} ({self.get_status_display()})"
+
+    def record_result(self, result):
+        """根据 APNs 发送结果更新状态，只修改内存中的对象"""
+        from django.utils import timezone
+
+        self.status_code = result['status_code']
+        self.reason = result['reason']
+        self.apns_id = result.get('apns_id')
+        if result['success']:
+            self.status = 'sent'
+            self.delivered_at = timezone.now()
+        self.updated_at = timezone.now()
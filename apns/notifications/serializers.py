@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import Notifications
+from .models import Notifications, Campaign, PushDelivery
 from utils.serializers_fields import TimestampField
 import pytz
 
@@ -8,6 +8,22 @@ class NotificationSendSerializer(serializers.Serializer):
     title = serializers.CharField(required=True)
     body = serializers.CharField(required=True)
     app_id = serializers.CharField(required=True)
+    # 为 true 时只校验并受理，立即返回 202 和推送ID，由后台任务投递
+    async_mode = serializers.BooleanField(required=False, default=False)
+
+
+class PushDeliverySerializer(serializers.ModelSerializer):
+    """异步推送状态序列化器"""
+
+    delivered_at = TimestampField(read_only=True)
+    created_at = TimestampField(read_only=True)
+    updated_at = TimestampField(read_only=True)
+
+    class Meta:
+        model = PushDelivery
+        fields = ['id', 'app_id', 'status', 'status_code', 'reason', 'apns_id',
+                  'delivered_at', 'created_at', 'updated_at']
+        read_only_fields = fields
 
 
 class NotificationsSerializer(serializers.ModelSerializer):
@@ -51,3 +67,42 @@ class NotificationsSerializer(serializers.ModelSerializer):
         # 创建新的通知设置
         notification = Notifications.objects.create(**validated_data)
         return notification
+
+
+class CampaignSerializer(serializers.ModelSerializer):
+    """群发活动序列化器"""
+
+    created_at = TimestampField(read_only=True)
+    updated_at = TimestampField(read_only=True)
+    started_at = TimestampField(read_only=True)
+    finished_at = TimestampField(read_only=True)
+    progress = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Campaign
+        fields = ['id', 'name', 'template', 'app_id', 'last_seen_after', 'is_premium', 'timezones',
+                  'rate_per_second', 'status', 'total_count', 'sent_count', 'failed_count',
+                  'progress', 'error', 'started_at', 'finished_at', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'status', 'total_count', 'sent_count', 'failed_count',
+                            'error', 'started_at', 'finished_at', 'created_at', 'updated_at']
+
+    def get_progress(self, obj):
+        """已处理设备数占目标设备数的百分比"""
+        if not obj.total_count:
+            return 100 if obj.status == 'completed' else 0
+        return round((obj.sent_count + obj.failed_count) * 100 / obj.total_count, 2)
+
+    def validate_template(self, value):
+        if not value.is_active:
+            raise serializers.ValidationError("通知模板未启用")
+        return value
+
+    def validate_timezones(self, value):
+        """验证时区列表是否有效"""
+        for tz in value:
+            try:
+                pytz.timezone(tz)
+            except pytz.exceptions.UnknownTimeZoneError:
+                raise serializers.ValidationError(f"无效的时区: {tz}")
+        return value
+
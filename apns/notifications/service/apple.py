@@ -6,15 +6,39 @@ import jwt
 import requests
 from jwt.algorithms import RSAAlgorithm
 from jwt.exceptions import InvalidTokenError, ExpiredSignatureError
-from cryptography.hazmat.primitives.serialization import load_pem_private_key
-from cryptography.hazmat.backends import default_backend
-from django.conf import settings
-from configurations.models import AppleAppConfiguration
+from configurations.registry import app_registry
+from .metrics import record_delivery, SUCCESS_REASON, NETWORK_ERROR_REASON
+from .ratelimit import rate_limiter, CHANNEL_TRANSACTIONAL
+
+# 批量发送时每次向限速器申请的令牌数，减少访问 Redis 的次数
+RATE_LIMIT_ACQUIRE_CHUNK = 10
+
+# APNs 对普通推送内容的大小限制
+APNS_MAX_PAYLOAD_BYTES = 4096
+
+
+class PreparedNotification:
+    """
+    预先编码的推送内容
+
+    同一内容发给大量设备时只需构建、序列化并校验大小一次，
+    发送时每个设备只替换请求路径中的设备令牌。
+    """
+
+    def __init__(self, notification):
+        self.notification = notification
+        self.content = json.dumps(notification, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+        if len(self.content) > APNS_MAX_PAYLOAD_BYTES:
+            raise ValueError(f"推送内容为 {len(self.content)} 字节，超过 APNs 的 {APNS_MAX_PAYLOAD_BYTES} 字节限制")
 
 
 class AppleService:
     def __init__(self, app_id):
-        app_config = AppleAppConfiguration.objects.get(name=app_id)
+        # 从进程内注册表读取配置，私钥和 provider token 在进程内复用
+        app_config = app_registry.get(app_id)
+        self.app_config = app_config
+        self.app_id = app_id
         self.client_id = app_config.bundle_id  # 即bundle_id
         self.team_id = app_config.team_id
         self.key_id = app_config.key_id
@@ -24,7 +48,7 @@ class AppleService:
         self.apns_host = "api.push.apple.com"
         self.apns_port = 443
 
-        self.private_key = app_config.auth_key
+        self.private_key = app_config.private_key
 
         self.apns_client = None
 
@@ -105,16 +129,81 @@ class AppleService:
             return None
 
     def _generate_token(self):
-        """生成 APNs JWT token"""
-        headers = {
-            'alg': 'ES256',
-            'kid': self.key_id
+        """获取 APNs JWT token，同一应用在进程内复用直到临近过期"""
+        return self.app_config.provider_token()
+
+    def build_notification(self, title="", body="", badge=1, sound="default", custom_data=None):
+        """构建推送内容"""
+        notification = {
+            "aps": {
+                "alert": {
+                    "title": title,
+                    "body": body
+                },
+                "badge": badge,
+                "sound": sound
+            }
         }
-        payload = {
-            'iss': self.team_id,
-            'iat': int(time.time())
+
+        # 添加自定义数据
+        if custom_data:
+            notification.update(custom_data)
+
+        return notification
+
+    def prepare_notification(self, title="", body="", badge=1, sound="default", custom_data=None):
+        """构建并预先编码推送内容，超过大小限制时抛出 ValueError"""
+        return PreparedNotification(self.build_notification(title, body, badge, sound, custom_data))
+
+    def _build_headers(self):
+        """构建请求头，同一批次内的推送共用一份"""
+        return {
+            'apns-topic': self.bundle_id,
+            'authorization': f'bearer {self._generate_token()}',
+            'apns-push-type': 'alert',
+            'apns-priority': '10',
+            'apns-expiration': '0',
+            'content-type': 'application/json'
         }
-        return jwt.encode(payload, self.private_key, algorithm='ES256', headers=headers)
+
+    def _post(self, client, device_token, prepared, headers):
+        """
+        通过已建立的连接发送单条推送，并记录结果统计
+
+        Returns:
+            dict: 包含 device_token、success、status_code、reason、apns_id、retry_after 的发送结果
+        """
+        url = f'https://{self.apns_host}/3/device/{device_token}'
+        started = time.monotonic()
+
+        try:
+            response = client.post(url, content=prepared.content, headers=headers)
+        except Exception as e:
+            print(f"推送发送异常: {str(e)}")
+            record_delivery(self.app_id, NETWORK_ERROR_REASON, (time.monotonic() - started) * 1000,
+                            device_token=device_token)
+            return {'device_token': device_token, 'success': False, 'status_code': None,
+                    'reason': NETWORK_ERROR_REASON, 'apns_id': None, 'retry_after': None}
+
+        latency_ms = (time.monotonic() - started) * 1000
+        apns_id = response.headers.get('apns-id')
+
+        if response.status_code == 200:
+            print(f"推送发送成功: device_token={device_token}")
+            record_delivery(self.app_id, SUCCESS_REASON, latency_ms, apns_id, device_token)
+            return {'device_token': device_token, 'success': True, 'status_code': 200,
+                    'reason': None, 'apns_id': apns_id, 'retry_after': None}
+
+        try:
+            reason = response.json().get('reason', 'Unknown error')
+        except ValueError:
+            reason = 'Unknown error'
+        print(f"推送发送失败: {reason}")
+        record_delivery(self.app_id, reason, latency_ms, apns_id, device_token)
+
+        return {'device_token': device_token, 'success': False,
+                'status_code': response.status_code, 'reason': reason, 'apns_id': apns_id,
+                'retry_after': response.headers.get('retry-after')}
 
     def send_push_notification(self, device_token, title="", body="",
                                badge=1, sound="default", custom_data=None):
@@ -122,56 +211,23 @@ class AppleService:
         发送推送通知
         """
         try:
-            # 准备通知内容
-            notification = {
-                "aps": {
-                    "alert": {
-                        "title": title,
-                        "body": body
-                    },
-                    "badge": badge,
-                    "sound": sound
-                }
-            }
-
-            # 添加自定义数据
-            if custom_data:
-                notification.update(custom_data)
-
-            # 准备请求头
-            headers = {
-                'apns-topic': self.bundle_id,
-                'authorization': f'bearer {self._generate_token()}',
-                'apns-push-type': 'alert',
-                'apns-priority': '10',
-                'apns-expiration': '0',
-                'content-type': 'application/json'
-            }
-
-            # 使用 httpx 发送请求
-            url = f'https://{self.apns_host}/3/device/{device_token}'
+            prepared = self.prepare_notification(title, body, badge, sound, custom_data)
+            headers = self._build_headers()
+            rate_limiter.acquire(self.app_id, CHANNEL_TRANSACTIONAL)
 
             with httpx.Client(http2=True) as client:
-                response = client.post(
-                    url,
-                    json=notification,
-                    headers=headers
-                )
-
-            if response.status_code == 200:
-                print(f"推送发送成功: device_token={device_token}")
+                result = self._post(client, device_token, prepared, headers)
+
+            if result['success']:
                 return True
-            else:
-                error_response = response.json()
-                reason = error_response.get('reason', 'Unknown error')
-                print(f"推送发送失败: {reason}")
 
-                if reason == 'BadDeviceToken':
-                    raise ValueError("无效的设备令牌")
-                elif reason == 'Unregistered':
-                    raise ValueError("设备未注册或已注销")
-                else:
-                    raise ValueError(f"推送失败: {reason}")
+            reason = result['reason']
+            if reason == 'BadDeviceToken':
+                raise ValueError("无效的设备令牌")
+            elif reason == 'Unregistered':
+                raise ValueError("设备未注册或已注销")
+            else:
+                raise ValueError(f"推送失败: {reason}")
 
         except ValueError as ve:
             print(f"推送验证错误: {str(ve)}")
@@ -179,3 +235,59 @@ class AppleService:
         except Exception as e:
             print(f"推送发送异常: {str(e)}")
             return False
+
+    def send_bulk_notifications(self, device_tokens, title="", body="", badge=1, sound="default",
+                                custom_data=None, channel=CHANNEL_TRANSACTIONAL, rate_per_second=None):
+        """
+        在同一个 HTTP/2 连接上向多个设备发送相同内容的推送
+
+        Args:
+            device_tokens: 设备令牌的可迭代对象
+            channel: 限速渠道，决定使用哪一份令牌桶额度
+            rate_per_second: 额外的每秒发送上限，为空时只受渠道额度限制
+
+        Returns:
+            list: 每个设备的发送结果，格式同 _post
+        """
+        prepared = self.prepare_notification(title, body, badge, sound, custom_data)
+        return self.send_bulk_payload(device_tokens, prepared, channel=channel,
+                                      rate_per_second=rate_per_second)
+
+    def send_bulk_payload(self, device_tokens, notification, channel=CHANNEL_TRANSACTIONAL,
+                          rate_per_second=None):
+        """
+        使用已构建好的推送内容批量发送，重试队列等保存了原始内容的场景直接调用
+
+        Args:
+            notification: PreparedNotification，或尚未编码的推送内容字典
+
+        Returns:
+            list: 每个设备的发送结果，格式同 _post
+        """
+        prepared = notification if isinstance(notification, PreparedNotification) \
+            else PreparedNotification(notification)
+        # 同一批次内重复的令牌只发送一次
+        device_tokens = list(dict.fromkeys(device_tokens))
+        headers = self._build_headers()
+        interval = 1.0 / rate_per_second if rate_per_second else 0
+        allowance = 0
+        results = []
+
+        with httpx.Client(http2=True) as client:
+            for index, device_token in enumerate(device_tokens):
+                # 从该应用、该渠道的共享令牌桶中申请发送额度
+                if allowance <= 0:
+                    allowance = rate_limiter.acquire(
+                        self.app_id, channel, min(RATE_LIMIT_ACQUIRE_CHUNK, len(device_tokens) - index)
+                    )
+                allowance -= 1
+
+                started = time.monotonic()
+                results.append(self._post(client, device_token, prepared, headers))
+
+                # 按速率限制控制发送节奏
+                elapsed = time.monotonic() - started
+                if interval > elapsed:
+                    time.sleep(interval - elapsed)
+
+        return results
@@ -0,0 +1,169 @@
+"""
+推送结果统计
+
+每次推送的结果按 (应用, 分钟) 聚合为 Redis 哈希中的计数器，字段为
+``<reason>:count`` 与 ``<reason>:latency``（毫秒累计），另有每次写入加一的版本号 ``_v``，
+写入开销只有一次管道往返。
+定时任务将已结束分钟的计数器汇总写入 DeliveryStat 表，而不是每次推送写一行。
+
+计数器是该分钟的累计值，汇总时整体覆盖 DeliveryStat 中对应的行（INSERT ... ON CONFLICT），
+事务提交后才把该分钟移出待汇总集合，计数器本身保留到过期：汇总失败或重复执行不会丢失或重复累加。
+移出时比较版本号，读取之后又有写入（迟到的写入）时该分钟保留在待汇总集合中，下一次汇总再次覆盖。
+"""
+import logging
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from utils.redis_client import get_redis_connection
+
+logger = logging.getLogger(__name__)
+
+SUCCESS_REASON = 'Success'
+NETWORK_ERROR_REASON = 'NetworkError'
+
+STATS_KEY_PREFIX = 'apns:stats'
+PENDING_KEYS = f'{STATS_KEY_PREFIX}:pending'
+STATS_TTL = 60 * 60 * 24
+MINUTE_FORMAT = '%Y%m%d%H%M'
+VERSION_FIELD = '_v'
+
+# 计数器的版本号仍是汇总时读取的版本时才移出待汇总集合
+RELEASE_SCRIPT = """
+if redis.call('HGET', KEYS[1], ARGV[1]) == ARGV[2] then
+    return redis.call('SREM', KEYS[2], KEYS[1])
+end
+return 0
+"""
+
+
+def _stats_key(app_id, minute):
+    return f'{STATS_KEY_PREFIX}:{app_id}:{minute}'
+
+
+def record_delivery(app_id, reason, latency_ms, apns_id=None, device_token=None):
+    """
+    记录一次推送结果
+
+    Args:
+        app_id: 应用名称
+        reason: 成功时为 Success，失败时为 APNs 返回的 reason
+        latency_ms: 请求耗时（毫秒）
+        apns_id: APNs 返回的 apns-id，仅写入日志
+    """
+    logger.info(f"APNs 推送结果: app={app_id}, reason={reason}, apns_id={apns_id}, "
+                f"latency={latency_ms}ms, device_token={device_token}")
+
+    try:
+        key = _stats_key(app_id, timezone.now().strftime(MINUTE_FORMAT))
+        latency_ms = int(latency_ms)
+        redis = get_redis_connection()
+
+        if redis is not None:
+            pipe = redis.pipeline(transaction=False)
+            pipe.hincrby(key, f'{reason}:count', 1)
+            pipe.hincrby(key, f'{reason}:latency', latency_ms)
+            pipe.hincrby(key, VERSION_FIELD, 1)
+            pipe.expire(key, STATS_TTL)
+            pipe.sadd(PENDING_KEYS, key)
+            pipe.execute()
+            return
+
+        # 未配置 Redis 时使用进程内缓存，仅用于开发和测试
+        counters = cache.get(key, {})
+        counters[f'{reason}:count'] = counters.get(f'{reason}:count', 0) + 1
+        counters[f'{reason}:latency'] = counters.get(f'{reason}:latency', 0) + latency_ms
+        counters[VERSION_FIELD] = counters.get(VERSION_FIELD, 0) + 1
+        cache.set(key, counters, STATS_TTL)
+        pending = cache.get(PENDING_KEYS, set())
+        pending.add(key)
+        cache.set(PENDING_KEYS, pending, STATS_TTL)
+    except Exception as e:
+        # 统计失败不能影响推送本身
+        logger.error(f"记录推送统计失败: {str(e)}")
+
+
+def _read(key):
+    """读取某个分钟的累计计数器"""
+    redis = get_redis_connection()
+    if redis is not None:
+        return {field.decode(): int(value) for field, value in redis.hgetall(key).items()}
+    return cache.get(key, {})
+
+
+def _mark_flushed(versions):
+    """
+    把已写入数据库的分钟移出待汇总集合，计数器保留到过期
+
+    Args:
+        versions: {key: 汇总时读取的版本号}，版本号已变化（读取后又有写入）的分钟保留
+    """
+    redis = get_redis_connection()
+    if redis is not None:
+        pipe = redis.pipeline(transaction=False)
+        for key, version in versions.items():
+            pipe.eval(RELEASE_SCRIPT, 2, key, PENDING_KEYS, VERSION_FIELD, version)
+        pipe.execute()
+        return
+
+    pending = cache.get(PENDING_KEYS, set())
+    for key, version in versions.items():
+        if cache.get(key, {}).get(VERSION_FIELD, 0) == version:
+            pending.discard(key)
+    cache.set(PENDING_KEYS, pending, STATS_TTL)
+
+
+def _pending_keys():
+    redis = get_redis_connection()
+    if redis is not None:
+        return [key.decode() for key in redis.smembers(PENDING_KEYS)]
+    return list(cache.get(PENDING_KEYS, set()))
+
+
+def flush_delivery_stats():
+    """
+    将已结束分钟的累计计数器写入 DeliveryStat 汇总表
+
+    Returns:
+        int: 写入的汇总行数
+    """
+    from notifications.models import DeliveryStat
+
+    # 当前分钟仍在写入；上一分钟再留一分钟余量，等待跨分钟边界的请求写完
+    cutoff = (timezone.now() - timedelta(minutes=1)).strftime(MINUTE_FORMAT)
+    versions, stats = {}, []
+
+    for key in _pending_keys():
+        app_id, minute = key[len(STATS_KEY_PREFIX) + 1:].rsplit(':', 1)
+        if minute >= cutoff:
+            continue
+
+        counters = _read(key)
+        versions[key] = counters.get(VERSION_FIELD, 0)
+        minute_at = datetime.strptime(minute, MINUTE_FORMAT).replace(tzinfo=dt_timezone.utc)
+        for reason in {field.rsplit(':', 1)[0] for field in counters if ':' in field}:
+            stats.append(DeliveryStat(
+                app_id=app_id,
+                minute=minute_at,
+                reason=reason,
+                count=counters.get(f'{reason}:count', 0),
+                latency_ms_total=counters.get(f'{reason}:latency', 0)
+            ))
+
+    if not versions:
+        return 0
+
+    with transaction.atomic():
+        # 计数器是累计值，覆盖写入；多个进程同时汇总或重复汇总结果相同
+        DeliveryStat.objects.bulk_create(
+            stats,
+            update_conflicts=True,
+            unique_fields=['app_id', 'minute', 'reason'],
+            update_fields=['count', 'latency_ms_total'],
+            batch_size=500
+        )
+        transaction.on_commit(lambda: _mark_flushed(versions))
+
+    return len(stats)
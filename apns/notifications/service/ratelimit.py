@@ -0,0 +1,109 @@
+"""
+APNs 出站流量限速
+
+每个应用、每个渠道（定时提醒、群发活动、事务性推送）各有一个令牌桶，
+桶状态保存在 Redis 中并通过 Lua 脚本原子地补充与扣减，所有 Celery worker
+和 Web 进程共享同一份额度，使总发送速率稳定在 Apple 的限流阈值之下。
+未配置 Redis 时退化为进程内的令牌桶。
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+from utils.redis_client import get_redis_connection
+
+logger = logging.getLogger(__name__)
+
+CHANNEL_REMINDER = 'reminder'
+CHANNEL_CAMPAIGN = 'campaign'
+CHANNEL_TRANSACTIONAL = 'transactional'
+
+BUCKET_KEY_PREFIX = 'apns:ratelimit'
+
+# KEYS[1]: 桶的键；ARGV: 每秒补充速率、桶容量、请求的令牌数
+# 返回需要等待的秒数（字符串），为 0 表示已成功扣减
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+
+local wait = 0
+if tokens >= requested then
+    tokens = tokens - requested
+else
+    wait = (requested - tokens) / rate
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 60)
+return tostring(wait)
+"""
+
+
+class TokenBucketRateLimiter:
+    """按 (应用, 渠道) 划分的分布式令牌桶"""
+
+    def __init__(self):
+        self._script = None
+        self._local_buckets = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_limit(channel):
+        """返回渠道的 (每秒速率, 桶容量)，未配置的渠道使用事务性推送的额度"""
+        limits = settings.APNS_RATE_LIMITS
+        limit = limits.get(channel, limits[CHANNEL_TRANSACTIONAL])
+        return float(limit['rate']), float(limit.get('burst', limit['rate']))
+
+    def _try_acquire(self, key, rate, burst, tokens):
+        """尝试扣减令牌，返回需要等待的秒数"""
+        redis = get_redis_connection()
+        if redis is not None:
+            if self._script is None:
+                self._script = redis.register_script(TOKEN_BUCKET_SCRIPT)
+            return float(self._script(keys=[key], args=[rate, burst, tokens]))
+
+        with self._lock:
+            now = time.monotonic()
+            available, ts = self._local_buckets.get(key, (burst, now))
+            available = min(burst, available + (now - ts) * rate)
+            if available >= tokens:
+                self._local_buckets[key] = (available - tokens, now)
+                return 0.0
+            self._local_buckets[key] = (available, now)
+            return (tokens - available) / rate
+
+    def acquire(self, app_id, channel, tokens=1):
+        """
+        阻塞直到获得指定数量的令牌
+
+        Returns:
+            int: 获得的令牌数，最多不超过桶容量
+        """
+        rate, burst = self.get_limit(channel)
+        tokens = max(1, min(tokens, int(burst)))
+        key = f'{BUCKET_KEY_PREFIX}:{app_id}:{channel}'
+
+        while True:
+            try:
+                wait = self._try_acquire(key, rate, burst, tokens)
+            except Exception as e:
+                # 限速器故障时不阻断推送，只记录日志
+                logger.error(f"APNs 限速器不可用: {str(e)}")
+                return tokens
+
+            if wait <= 0:
+                return tokens
+            time.sleep(min(wait, 1.0))
+
+
+rate_limiter = TokenBucketRateLimiter()
@@ -0,0 +1,244 @@
+"""
+推送重试队列
+
+APNs 的失败分为两类：
+- 永久失败：设备令牌无效、请求内容错误等，重试没有意义，令牌类错误需要停用设备；
+- 临时失败：429 TooManyRequests、500 InternalServerError、503 ServiceUnavailable
+  以及网络异常，按指数退避加随机抖动重新入队，超过最大次数后放弃。
+
+重试由定时任务批量取出到期记录，按 (应用, 推送内容) 分组后通过批量发送接口发出，
+避免限流期间每条推送一个任务造成的重试风暴。
+"""
+import json
+import logging
+import random
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .metrics import NETWORK_ERROR_REASON
+from .ratelimit import CHANNEL_TRANSACTIONAL
+
+logger = logging.getLogger(__name__)
+
+TRANSIENT_STATUS_CODES = {429, 500, 503}
+INVALID_TOKEN_REASONS = {'BadDeviceToken', 'Unregistered', 'DeviceTokenNotForTopic'}
+
+# 针对单个设备的限流（429）需要等待更久，服务端故障可以较快重试
+BASE_DELAY_SECONDS = {429: 60}
+DEFAULT_BASE_DELAY_SECONDS = 10
+MAX_DELAY_SECONDS = 60 * 60
+
+# 领取后在此时间内其他进程不会重复处理，处理进程崩溃时到期后自动重新可见
+CLAIM_SECONDS = 5 * 60
+
+
+def is_transient(result):
+    """是否为可以重试的临时失败"""
+    return not result['success'] and (
+        result['status_code'] in TRANSIENT_STATUS_CODES or result['reason'] == NETWORK_ERROR_REASON
+    )
+
+
+def is_invalid_token(result):
+    """是否为需要停用设备的令牌错误"""
+    return not result['success'] and result['reason'] in INVALID_TOKEN_REASONS
+
+
+def compute_backoff(attempts, status_code=None, retry_after=None):
+    """
+    计算下一次重试前的等待秒数
+
+    指数退避：base * 2^attempts，上限 MAX_DELAY_SECONDS，在 [delay/2, delay] 之间取随机值
+    打散同一批失败的重试时间；若 APNs 返回了 Retry-After 则不早于该时间。
+    """
+    base = BASE_DELAY_SECONDS.get(status_code, DEFAULT_BASE_DELAY_SECONDS)
+    delay = min(MAX_DELAY_SECONDS, base * (2 ** attempts))
+    delay = random.uniform(delay / 2, delay)
+
+    if retry_after:
+        try:
+            delay = max(delay, float(retry_after))
+        except (TypeError, ValueError):
+            pass
+
+    return delay
+
+
+def schedule_retries(app_id, notification, results, attempts=0, channel=CHANNEL_TRANSACTIONAL, delivery=None):
+    """
+    将批量发送结果中的临时失败加入重试队列，重试时沿用原渠道的限速额度
+
+    Args:
+        notification: 推送内容字典，或 AppleService.prepare_notification 返回的预编码内容
+        delivery: 关联的异步推送，重试的最终结果会回写到该记录
+
+    Returns:
+        int: 加入队列的推送数
+    """
+    from notifications.models import PushRetry
+
+    if attempts >= settings.APNS_RETRY_MAX_ATTEMPTS:
+        return 0
+
+    payload = getattr(notification, 'notification', notification)
+    now = timezone.now()
+    retries = [
+        PushRetry(
+            app_id=app_id,
+            device_token=result['device_token'],
+            payload=payload,
+            channel=channel,
+            attempts=attempts,
+            next_attempt_at=now + timedelta(
+                seconds=compute_backoff(attempts, result['status_code'], result.get('retry_after'))
+            ),
+            last_status_code=result['status_code'],
+            last_reason=result['reason'],
+            delivery=delivery
+        )
+        for result in results if is_transient(result)
+    ]
+    PushRetry.objects.bulk_create(retries, batch_size=500)
+    return len(retries)
+
+
+def _claim_due_retries(batch_size):
+    """领取一批到期的重试记录，并把下次重试时间推后，避免被并发的任务重复处理"""
+    from notifications.models import PushRetry
+
+    now = timezone.now()
+    with transaction.atomic():
+        retries = list(
+            PushRetry.objects.select_for_update(skip_locked=True)
+            .filter(next_attempt_at__lte=now)
+            .order_by('next_attempt_at')[:batch_size]
+        )
+        if retries:
+            PushRetry.objects.filter(id__in=[retry.id for retry in retries]).update(
+                next_attempt_at=now + timedelta(seconds=CLAIM_SECONDS)
+            )
+    return retries
+
+
+def process_due_retries(batch_size=1000):
+    """
+    批量重发到期的推送
+
+    Returns:
+        dict: 本次处理的 total、success、rescheduled、dropped 数量
+    """
+    from devices.models import DeviceToken
+    from notifications.models import PushRetry
+    from notifications.service.apple import AppleService
+
+    retries = _claim_due_retries(batch_size)
+    stats = {'total': len(retries), 'success': 0, 'rescheduled': 0, 'dropped': 0}
+    if not retries:
+        return stats
+
+    # 相同应用、相同内容的推送合并为一次批量发送
+    groups = defaultdict(list)
+    for retry in retries:
+        groups[(retry.app_id, retry.channel, json.dumps(retry.payload, sort_keys=True))].append(retry)
+
+    done_ids = []
+    rescheduled = []
+    invalid_tokens = []
+    delivery_outcomes = {}
+    now = timezone.now()
+
+    for (app_id, channel, _), group in groups.items():
+        try:
+            apple_service = AppleService(app_id=app_id)
+        except Exception as e:
+            logger.error(f"重试推送时无法加载应用 {app_id} 的配置: {str(e)}")
+            done_ids.extend(retry.id for retry in group)
+            stats['dropped'] += len(group)
+            continue
+
+        retries_by_token = defaultdict(list)
+        for retry in group:
+            retries_by_token[retry.device_token].append(retry)
+        results = apple_service.send_bulk_payload(list(retries_by_token), group[0].payload, channel=channel)
+
+        for result in results:
+            # 同一设备重复入队的记录共享这一次发送结果
+            duplicates = retries_by_token[result['device_token']]
+            retry = duplicates[0]
+            attempts = retry.attempts + 1
+
+            if result['success']:
+                outcome = 'sent'
+                done_ids.extend(duplicate.id for duplicate in duplicates)
+                stats['success'] += 1
+            elif is_transient(result) and attempts < settings.APNS_RETRY_MAX_ATTEMPTS:
+                outcome = 'retrying'
+                next_attempt_at = now + timedelta(
+                    seconds=compute_backoff(attempts, result['status_code'], result.get('retry_after'))
+                )
+                # 关联了异步推送的重复记录一并保留，以便最终结果能回写到每条异步推送
+                for duplicate in duplicates:
+                    if duplicate is not retry and not duplicate.delivery_id:
+                        done_ids.append(duplicate.id)
+                        continue
+                    duplicate.attempts = attempts
+                    duplicate.next_attempt_at = next_attempt_at
+                    duplicate.last_status_code = result['status_code']
+                    duplicate.last_reason = result['reason']
+                    duplicate.updated_at = now
+                    rescheduled.append(duplicate)
+                stats['rescheduled'] += 1
+            else:
+                outcome = 'failed'
+                if is_invalid_token(result):
+                    invalid_tokens.append(result['device_token'])
+                logger.warning(f"推送重试放弃: app={app_id}, device_token={retry.device_token}, "
+                               f"attempts={attempts}, reason={result['reason']}")
+                done_ids.extend(duplicate.id for duplicate in duplicates)
+                stats['dropped'] += 1
+
+            for duplicate in duplicates:
+                if duplicate.delivery_id:
+                    delivery_outcomes[duplicate.delivery_id] = (outcome, result)
+
+    if done_ids:
+        PushRetry.objects.filter(id__in=done_ids).delete()
+    if rescheduled:
+        PushRetry.objects.bulk_update(
+            rescheduled,
+            ['attempts', 'next_attempt_at', 'last_status_code', 'last_reason', 'updated_at'],
+            batch_size=500
+        )
+    if invalid_tokens:
+        DeviceToken.objects.filter(device_token__in=invalid_tokens).update(
+            is_active=False, updated_at=now
+        )
+    if delivery_outcomes:
+        update_deliveries(delivery_outcomes)
+
+    return stats
+
+
+def update_deliveries(outcomes):
+    """
+    将发送结果回写到异步推送记录
+
+    Args:
+        outcomes: {delivery_id: (status, result)}，status 为 sent / retrying / failed
+    """
+    from notifications.models import PushDelivery
+
+    deliveries = PushDelivery.objects.in_bulk(list(outcomes))
+    for delivery_id, delivery in deliveries.items():
+        status, result = outcomes[delivery_id]
+        delivery.record_result(result)
+        delivery.status = status
+    PushDelivery.objects.bulk_update(
+        deliveries.values(),
+        ['status', 'status_code', 'reason', 'apns_id', 'delivered_at', 'updated_at'],
+        batch_size=500
+    )
@@ -1,12 +1,27 @@
+import time
+import zlib
+from collections import defaultdict
+from datetime import datetime, timedelta
+
 from celery import shared_task
+from django.conf import settings
+from django.db.models import F
+from django.db.models.functions import Mod
 from django.utils import timezone
 import pytz
-from .models import Notifications
+from .models import Notifications, Campaign, PushDelivery
 from devices.models import DeviceToken
+from utils.leases import run_with_lease
 from .service.apple import AppleService
+from .service.metrics import flush_delivery_stats
+from .service.ratelimit import CHANNEL_REMINDER, CHANNEL_CAMPAIGN, CHANNEL_TRANSACTIONAL
+from .service.retry import is_invalid_token, schedule_retries, process_due_retries
 from .services import NotificationScheduleService
 
 
+# 定时通知允许的发送误差（分钟）
+SEND_TOLERANCE_MINUTES = 5
+
 # 定义每周的通知内容
 WEEKLY_NOTIFICATIONS = {
     0: {  # 周一
@@ -51,7 +66,41 @@ WEEKLY_NOTIFICATIONS = {
 
 @shared_task
 def send_scheduled_notifications():
-    """发送定时通知"""
+    """
+    发送定时通知
+
+    分片数大于 1 时按 user_id 取模分发给各分片任务，由不同的 worker 并行处理；
+    否则在当前任务中直接处理。
+    """
+    scheduled_at = timezone.now().replace(second=0, microsecond=0)
+    shards = settings.NOTIFICATION_SHARDS
+    if shards <= 1:
+        return send_scheduled_notifications_shard(0, 1, scheduled_at.isoformat())
+
+    for shard in range(shards):
+        send_scheduled_notifications_shard.delay(shard, shards, scheduled_at.isoformat())
+    return 0
+
+
+@shared_task
+def send_scheduled_notifications_shard(shard, shards, scheduled_at):
+    """
+    处理一个分片的定时通知
+
+    同一分片同时只有一个执行者；上一轮未结束时本轮合并到上一轮结束后补跑，
+    发送窗口为前后 5 分钟，补跑仍能覆盖被合并这一分钟的计划。
+    """
+    return run_with_lease(
+        f'scheduled-notifications:{shard}/{shards}',
+        lambda: _send_scheduled_notifications(shard, shards),
+        ttl=settings.NOTIFICATION_LEASE_TTL,
+        scheduled_at=datetime.fromisoformat(scheduled_at),
+        coalesce=True
+    )
+
+
+def _send_scheduled_notifications(shard=0, shards=1):
+    """发送一个分片内到期的定时通知，返回处理的计划数"""
     apple_service = AppleService(app_id="pocket_ai")
     utc_now = timezone.now()
 
@@ -60,16 +109,23 @@ def send_scheduled_notifications():
         is_active=True,
         days_remaining__gt=0  # 确保还有剩余天数
     )
+    if shards > 1:
+        schedules = schedules.alias(shard=Mod('user_id', shards)).filter(shard=shard)
 
+    # 平滑窗口不超过发送误差范围，保证每个用户仍在设定时间前后 5 分钟内收到
+    smoothing_window = min(settings.NOTIFICATION_SMOOTHING_WINDOW, SEND_TOLERANCE_MINUTES)
+
+    # 第一遍：只在内存中筛选出本分钟需要发送的计划，不访问数据库
+    due_schedules = []
     for schedule in schedules:
         try:
             # 转换到用户时区
             user_tz = pytz.timezone(schedule.timezone)
             user_time = utc_now.astimezone(user_tz)
-            
+
             # 解析计划时间
             schedule_hour, schedule_minute = map(int, schedule.notify_time.split(':'))
-            
+
             # 创建用户时区的目标时间
             target_time = user_time.replace(
                 hour=schedule_hour,
@@ -77,50 +133,258 @@ def send_scheduled_notifications():
                 second=0,
                 microsecond=0
             )
-            
-            # 计算时间差（分钟）
-            time_diff = abs((user_time - target_time).total_seconds() / 60)
-            
-            # 如果在5分钟误差范围内且今天还未发送
-            if time_diff <= 5 and (
-                not schedule.last_sent or 
-                schedule.last_sent.astimezone(user_tz).date() < user_time.date()
+
+            if smoothing_window:
+                # 平滑模式：按用户固定的偏移错开整点高峰，到达偏移后的时间才发送，
+                # 误差范围只用于补发错过的分钟
+                target_time += _smoothing_offset(schedule.user_id, smoothing_window)
+
+            # 计算时间差（分钟），折算到 [-12h, 12h)，计划时间前后跨越午夜时也能正确比较
+            time_diff = _minutes_since(target_time, user_time)
+            if smoothing_window:
+                in_window = 0 <= time_diff <= SEND_TOLERANCE_MINUTES
+            else:
+                in_window = abs(time_diff) <= SEND_TOLERANCE_MINUTES
+
+            # 本次计划时间（可能在前一天或后一天），在误差范围内且本次还未发送
+            occurrence = user_time - timedelta(minutes=time_diff)
+            if in_window and (
+                not schedule.last_sent or
+                schedule.last_sent < occurrence - timedelta(minutes=SEND_TOLERANCE_MINUTES)
             ):
-                # 获取当前是周几（0-6，0是周一）
-                weekday = user_time.weekday()
-                notification = WEEKLY_NOTIFICATIONS[weekday]
-                
-                # 获取用户的所有活跃设备
-                devices = DeviceToken.objects.filter(
-                    user_id=schedule.user_id,
-                    is_active=True
-                )
+                due_schedules.append((schedule, user_time))
 
-                # 计算进度信息
-                days_passed = 21 - schedule.days_remaining + 1
-                progress_message = f"第 {days_passed} 天 / 共 21 天"
-
-                # 发送通知
-                for device in devices:
-                    success = apple_service.send_push_notification(
-                        device_token=device.device_token,
-                        title=notification['title'],
-                        body=notification['body']
-                    )
-
-                    if not success:
-                        device.mark_inactive()
-
-                # 更新通知计划
-                schedule.last_sent = utc_now
-                schedule.decrease_days()
-                
-                if schedule.days_remaining <= 0:
-                    schedule.is_active = False
-                    print(f"用户 {schedule.user_id} 已完成21天计划")
-                
-                schedule.save()
-                
         except Exception as e:
             print(f"处理用户 {schedule.user_id} 的通知计划时出错: {str(e)}")
-            continue
\ No newline at end of file
+            continue
+
+    if not due_schedules:
+        return 0
+
+    # 一次查询取出所有到期用户的活跃设备，并在内存中按用户分组
+    devices_by_user = defaultdict(list)
+    devices = DeviceToken.objects.filter(
+        user_id__in={schedule.user_id for schedule, _ in due_schedules},
+        is_active=True
+    ).values_list('user_id', 'device_token')
+    for user_id, device_token in devices:
+        devices_by_user[user_id].append(device_token)
+
+    # 同一天（周几）的提醒内容相同，按周几分组后批量发送
+    # 同一令牌可能挂在多个用户或计划上，每个令牌本轮只推送一次
+    tokens_by_weekday = defaultdict(list)
+    schedules_by_weekday = defaultdict(list)
+    seen_tokens = set()
+    for schedule, user_time in due_schedules:
+        # 获取当前是周几（0-6，0是周一）
+        weekday = user_time.weekday()
+        schedules_by_weekday[weekday].append(schedule)
+        for device_token in devices_by_user.get(schedule.user_id, []):
+            if device_token not in seen_tokens:
+                seen_tokens.add(device_token)
+                tokens_by_weekday[weekday].append(device_token)
+
+    invalid_tokens = []
+    sent_schedules = []
+    for weekday, weekday_schedules in schedules_by_weekday.items():
+        device_tokens = tokens_by_weekday.get(weekday)
+        if device_tokens:
+            try:
+                prepared = _get_weekly_notification(apple_service, weekday)
+                results = apple_service.send_bulk_payload(device_tokens, prepared, channel=CHANNEL_REMINDER)
+                invalid_tokens.extend(result['device_token'] for result in results if is_invalid_token(result))
+                schedule_retries(apple_service.app_id, prepared, results, channel=CHANNEL_REMINDER)
+            except Exception as e:
+                # 整批发送失败时不更新这些计划，仍在发送窗口内的下一分钟会再次尝试
+                print(f"发送周{weekday + 1}的定时通知时出错: {str(e)}")
+                continue
+
+        # 更新通知计划（仅修改内存中的对象，最后统一写回）
+        # 单个令牌的临时失败会进入重试队列，因此这里直接记为已发送
+        for schedule in weekday_schedules:
+            schedule.mark_sent(utc_now)
+            if not schedule.is_active:
+                print(f"用户 {schedule.user_id} 已完成21天计划")
+            sent_schedules.append(schedule)
+
+    # 一条 UPDATE 停用所有令牌无效的设备
+    if invalid_tokens:
+        DeviceToken.objects.filter(device_token__in=invalid_tokens).update(
+            is_active=False,
+            updated_at=utc_now
+        )
+
+    # 批量写回已发送的通知计划的状态
+    if sent_schedules:
+        Notifications.objects.bulk_update(
+            sent_schedules,
+            ['last_sent', 'days_remaining', 'is_active', 'updated_at'],
+            batch_size=500
+        )
+
+    return len(sent_schedules)
+
+
+def _minutes_since(target_time, user_time):
+    """user_time 距离 target_time 的分钟数，按一天取模折算到 [-720, 720)"""
+    minutes = (user_time - target_time).total_seconds() / 60
+    return (minutes + 720) % 1440 - 720
+
+
+def _smoothing_offset(user_id, window):
+    """
+    用户固定的发送时间偏移，在 [-window, window] 分钟内均匀分布
+
+    使用 crc32 而不是 hash()，保证不同进程、不同日期计算结果一致，用户每天的提醒时间不变。
+    """
+    return timedelta(minutes=zlib.crc32(str(user_id).encode('utf-8')) % (2 * window + 1) - window)
+
+
+# 每周通知内容是固定的，按 (应用, 周几) 缓存预编码结果，worker 进程内只构建一次
+_prepared_weekly_notifications = {}
+
+
+def _get_weekly_notification(apple_service, weekday):
+    """获取某天的预编码通知内容"""
+    key = (apple_service.app_id, weekday)
+    if key not in _prepared_weekly_notifications:
+        notification = WEEKLY_NOTIFICATIONS[weekday]
+        _prepared_weekly_notifications[key] = apple_service.prepare_notification(
+            title=notification['title'], body=notification['body']
+        )
+    return _prepared_weekly_notifications[key]
+
+
+@shared_task
+def deliver_campaign(campaign_id):
+    """
+    分批发送群发活动
+
+    使用服务端游标按设备ID顺序流式读取匹配的设备，每批发送后持久化进度。
+    单次任务运行超过时间预算后会从上次处理到的设备ID继续重新入队，
+    避免超出 Celery 的任务时间限制，也便于任务中断后续传。
+    """
+    campaign = Campaign.objects.select_related('template__app_config').get(id=campaign_id)
+    if campaign.status not in ('pending', 'running'):
+        return 0
+
+    template = campaign.template
+    devices = campaign.get_device_queryset().filter(id__gt=campaign.last_device_id).order_by('id')
+
+    if campaign.status == 'pending':
+        campaign.status = 'running'
+        campaign.started_at = timezone.now()
+        campaign.total_count = devices.count()
+        campaign.save(update_fields=['status', 'started_at', 'total_count', 'updated_at'])
+
+    try:
+        apple_service = AppleService(app_id=template.app_config.name)
+        # 所有设备共用同一份内容，整个活动只编码和校验大小一次
+        prepared = apple_service.prepare_notification(
+            template.title, template.body, template.badge, template.sound, template.custom_data
+        )
+    except Exception as e:
+        Campaign.objects.filter(id=campaign_id).update(
+            status='failed', error=str(e), finished_at=timezone.now(), updated_at=timezone.now()
+        )
+        return 0
+
+    deadline = time.monotonic() + settings.CAMPAIGN_TIME_BUDGET
+    rows = devices.values_list('id', 'device_token').iterator(chunk_size=settings.CAMPAIGN_BATCH_SIZE)
+    delivered = 0
+
+    for batch in _chunked(rows, settings.CAMPAIGN_BATCH_SIZE):
+        # 每批开始前检查活动是否已被取消
+        if Campaign.objects.filter(id=campaign_id, status='cancelled').exists():
+            return delivered
+
+        results = apple_service.send_bulk_payload(
+            [device_token for _, device_token in batch],
+            prepared,
+            channel=CHANNEL_CAMPAIGN,
+            rate_per_second=campaign.rate_per_second
+        )
+
+        sent = sum(1 for result in results if result['success'])
+        invalid_tokens = [result['device_token'] for result in results if is_invalid_token(result)]
+        schedule_retries(apple_service.app_id, prepared, results, channel=CHANNEL_CAMPAIGN)
+        if invalid_tokens:
+            DeviceToken.objects.filter(device_token__in=invalid_tokens).update(
+                is_active=False, updated_at=timezone.now()
+            )
+
+        Campaign.objects.filter(id=campaign_id).update(
+            sent_count=F('sent_count') + sent,
+            failed_count=F('failed_count') + len(results) - sent,
+            last_device_id=batch[-1][0],
+            updated_at=timezone.now()
+        )
+        delivered += sent
+
+        if time.monotonic() > deadline:
+            deliver_campaign.delay(campaign_id)
+            return delivered
+
+    Campaign.objects.filter(id=campaign_id, status='running').update(
+        status='completed', finished_at=timezone.now(), updated_at=timezone.now()
+    )
+    return delivered
+
+
+@shared_task
+def deliver_push(delivery_id):
+    """
+    发送异步模式受理的单条推送
+
+    临时失败进入重试队列，由重试任务回写最终结果；其他失败直接记为失败。
+    """
+    delivery = PushDelivery.objects.get(id=delivery_id)
+    if delivery.status != 'queued':
+        return delivery.status
+
+    try:
+        apple_service = AppleService(app_id=delivery.app_id)
+        result = apple_service.send_bulk_payload(
+            [delivery.device_token], delivery.payload, channel=CHANNEL_TRANSACTIONAL
+        )[0]
+    except Exception as e:
+        print(f"发送异步推送 {delivery_id} 时出错: {str(e)}")
+        result = {'device_token': delivery.device_token, 'success': False, 'status_code': None,
+                  'reason': str(e)[:64], 'apns_id': None, 'retry_after': None}
+
+    delivery.record_result(result)
+    if not result['success']:
+        if schedule_retries(delivery.app_id, delivery.payload, [result], delivery=delivery):
+            delivery.status = 'retrying'
+        else:
+            delivery.status = 'failed'
+            if is_invalid_token(result):
+                DeviceToken.objects.filter(device_token=delivery.device_token).update(
+                    is_active=False, updated_at=timezone.now()
+                )
+    delivery.save(update_fields=['status', 'status_code', 'reason', 'apns_id', 'delivered_at', 'updated_at'])
+    return delivery.status
+
+
+@shared_task
+def flush_delivery_stats_task():
+    """将 Redis 中已结束分钟的推送统计汇总写入数据库"""
+    return flush_delivery_stats()
+
+
+@shared_task
+def process_push_retries():
+    """批量重发到期的临时失败推送"""
+    return process_due_retries(batch_size=settings.APNS_RETRY_BATCH_SIZE)
+
+
+def _chunked(iterable, size):
+    """将可迭代对象按固定大小切分为列表"""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
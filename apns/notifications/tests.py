@@ -1,3 +1,522 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.core.cache import cache
 from django.test import TestCase
+from django.utils import timezone
+
+from configurations.models import AppleAppConfiguration, NotificationTemplate
+from devices.models import DeviceToken
+from purchase.models import Purchase
+from .models import Notifications, Campaign, PushRetry, PushDelivery
+from .tasks import send_scheduled_notifications, deliver_campaign
+
+
+class ScheduledNotificationTaskTests(TestCase):
+    def setUp(self):
+        # 清空上一个用例留下的租约和周期占位
+        cache.clear()
+        AppleAppConfiguration.objects.create(
+            name='pocket_ai',
+            bundle_id='com.example.pocket',
+            team_id='TEAM',
+            key_id='KEY',
+            auth_key='dummy'
+        )
+
+        # 当前 UTC 时间对应的 HH:mm，保证计划在发送窗口内
+        self.notify_time = timezone.now().strftime('%H:%M')
+
+    def _create_schedule(self, user_id, days_remaining=21, **kwargs):
+        return Notifications.objects.create(
+            user_id=user_id,
+            timezone='UTC',
+            notify_time=self.notify_time,
+            days_remaining=days_remaining,
+            **kwargs
+        )
+
+    def _create_device(self, user_id, token):
+        return DeviceToken.objects.create(
+            user_id=user_id,
+            device_id=f'device-{token}',
+            device_token=token
+        )
+
+    @staticmethod
+    def _results(device_tokens, failures=None):
+        failures = failures or {}
+        return [
+            {'device_token': token, 'success': token not in failures,
+             'status_code': failures.get(token, (200, None))[0],
+             'reason': failures.get(token, (200, None))[1], 'retry_after': None}
+            for token in device_tokens
+        ]
+
+    @mock.patch('notifications.tasks.AppleService.send_bulk_payload')
+    def test_due_schedules_are_sent_and_updated(self, send_bulk):
+        send_bulk.side_effect = lambda device_tokens, payload, **kwargs: self._results(
+            device_tokens, {'bad': (400, 'BadDeviceToken'), 'busy': (429, 'TooManyRequests')}
+        )
+
+        first = self._create_schedule(user_id=1)
+        last_day = self._create_schedule(user_id=2, days_remaining=1)
+        already_sent = self._create_schedule(user_id=3, last_sent=timezone.now())
+        self._create_device(1, 'good')
+        bad_device = self._create_device(1, 'bad')
+        busy_device = self._create_device(2, 'busy')
+        self._create_device(3, 'skipped')
+
+        self.assertEqual(send_scheduled_notifications(), 2)
+        self.assertEqual(send_bulk.call_count, 1)
+        self.assertCountEqual(send_bulk.call_args[0][0], ['good', 'bad', 'busy'])
+
+        first.refresh_from_db()
+        self.assertEqual(first.days_remaining, 20)
+        self.assertTrue(first.is_active)
+        self.assertIsNotNone(first.last_sent)
+
+        last_day.refresh_from_db()
+        self.assertEqual(last_day.days_remaining, 0)
+        self.assertFalse(last_day.is_active)
+
+        already_sent.refresh_from_db()
+        self.assertEqual(already_sent.days_remaining, 21)
+
+        # 令牌无效的设备被停用，被限流的设备保持活跃并进入重试队列
+        bad_device.refresh_from_db()
+        self.assertFalse(bad_device.is_active)
+        busy_device.refresh_from_db()
+        self.assertTrue(busy_device.is_active)
+        self.assertEqual(list(PushRetry.objects.values_list('device_token', flat=True)), ['busy'])
+
+    @mock.patch('notifications.tasks.AppleService.send_bulk_payload')
+    def test_failed_batch_is_not_marked_sent(self, send_bulk):
+        send_bulk.side_effect = RuntimeError('connection reset')
+        schedule = self._create_schedule(user_id=1)
+        self._create_device(1, 'good')
+
+        self.assertEqual(send_scheduled_notifications(), 0)
+
+        # 整批发送失败时计划保持未发送，下一分钟重试
+        schedule.refresh_from_db()
+        self.assertIsNone(schedule.last_sent)
+        self.assertEqual(schedule.days_remaining, 21)
+
+    @mock.patch('notifications.tasks.AppleService.send_bulk_payload')
+    def test_query_count_does_not_grow_with_users(self, send_bulk):
+        send_bulk.side_effect = lambda device_tokens, payload, **kwargs: self._results(
+            device_tokens, {token: (410, 'Unregistered') for token in device_tokens}
+        )
+        for user_id in range(1, 21):
+            self._create_schedule(user_id=user_id)
+            self._create_device(user_id, f'token-{user_id}')
+
+        # 配置、计划、设备、停用设备、批量更新计划
+        with self.assertNumQueries(5):
+            send_scheduled_notifications()
+
+        self.assertFalse(DeviceToken.objects.filter(is_active=True).exists())
+        self.assertFalse(Notifications.objects.filter(last_sent__isnull=True).exists())
+
+    @mock.patch('notifications.tasks.AppleService.send_bulk_payload')
+    def test_shards_split_users(self, send_bulk):
+        from .tasks import send_scheduled_notifications_shard
+
+        send_bulk.side_effect = lambda device_tokens, payload, **kwargs: self._results(device_tokens)
+        for user_id in range(1, 5):
+            self._create_schedule(user_id=user_id)
+            self._create_device(user_id, f'token-{user_id}')
+
+        scheduled_at = timezone.now().replace(second=0, microsecond=0).isoformat()
+        self.assertEqual(send_scheduled_notifications_shard(1, 2, scheduled_at), 2)
+        self.assertCountEqual(send_bulk.call_args[0][0], ['token-1', 'token-3'])
+        # 同一计划时间重复投递时跳过
+        self.assertIsNone(send_scheduled_notifications_shard(1, 2, scheduled_at))
+        self.assertEqual(send_scheduled_notifications_shard(0, 2, scheduled_at), 2)
+
+
+    @mock.patch('notifications.tasks.AppleService.send_bulk_payload')
+    def test_smoothing_spreads_users_with_stable_offsets(self, send_bulk):
+        from .tasks import _smoothing_offset
+
+        send_bulk.side_effect = lambda device_tokens, payload, **kwargs: self._results(device_tokens)
+        offsets = {user_id: _smoothing_offset(user_id, 5) for user_id in range(1, 1001)}
+        # 偏移固定且覆盖整个窗口
+        self.assertEqual(offsets, {user_id: _smoothing_offset(user_id, 5) for user_id in range(1, 1001)})
+        self.assertEqual({int(offset.total_seconds() // 60) for offset in offsets.values()}, set(range(-5, 6)))
+
+        for user_id in range(1, 31):
+            self._create_schedule(user_id=user_id)
+            self._create_device(user_id, f'token-{user_id}')
+
+        with self.settings(NOTIFICATION_SMOOTHING_WINDOW=5):
+            send_scheduled_notifications()
+
+        # 只有偏移后的时间已到达的用户在本分钟发送
+        expected = [f'token-{user_id}' for user_id in range(1, 31)
+                    if -timedelta(minutes=4) <= offsets[user_id] <= timedelta(0)]
+        self.assertCountEqual(send_bulk.call_args[0][0], expected)
+
+    @mock.patch('notifications.tasks.AppleService.send_bulk_payload')
+    def test_smoothing_across_midnight(self, send_bulk):
+        from datetime import datetime
+        from .tasks import _send_scheduled_notifications, _smoothing_offset
+
+        send_bulk.side_effect = lambda device_tokens, payload, **kwargs: self._results(device_tokens)
+        late = next(user_id for user_id in range(1, 1000) if _smoothing_offset(user_id, 5) == timedelta(minutes=3))
+        early = next(user_id for user_id in range(1, 1000) if _smoothing_offset(user_id, 5) == timedelta(minutes=-3))
+        self.notify_time = '23:58'
+        self._create_schedule(user_id=late)
+        self._create_device(late, 'token-late')
+        self.notify_time = '00:01'
+        self._create_schedule(user_id=early)
+        self._create_device(early, 'token-early')
+
+        cases = [
+            # 00:01 - 3 分钟 → 前一天 23:58
+            (datetime(2026, 3, 9, 23, 58, tzinfo=timezone.utc), 'token-early'),
+            # 23:58 + 3 分钟 → 次日 00:01；00:01 的计划已在前一天 23:58 发送，不再补发
+            (datetime(2026, 3, 10, 0, 1, tzinfo=timezone.utc), 'token-late'),
+        ]
+        with self.settings(NOTIFICATION_SMOOTHING_WINDOW=5):
+            for now, token in cases:
+                send_bulk.reset_mock()
+                with mock.patch('notifications.tasks.timezone.now', return_value=now):
+                    self.assertEqual(_send_scheduled_notifications(), 1)
+                    self.assertEqual(send_bulk.call_args[0][0], [token])
+                    # 同一次计划不会重复发送
+                    self.assertEqual(_send_scheduled_notifications(), 0)
+
+
+class LeaseTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_overlapping_runs_are_skipped_or_coalesced(self):
+        from utils.leases import Lease, run_with_lease, get_run_stats
+
+        calls = []
+        holder = Lease('job', 60)
+        self.assertTrue(holder.acquire())
+        self.assertIsNone(run_with_lease('job', lambda: calls.append(1), ttl=60))
+        self.assertIsNone(run_with_lease('job', lambda: calls.append(1), ttl=60, coalesce=True))
+        self.assertEqual(calls, [])
+        holder.release()
+
+        # 合并的请求在下一次执行结束后补跑一次
+        self.assertEqual(run_with_lease('job', lambda: calls.append(1) or len(calls), ttl=60, coalesce=True), 2)
+        self.assertEqual(calls, [1, 1])
+        self.assertEqual(get_run_stats('job')['result'], 2)
+
+
+class CampaignDeliveryTests(TestCase):
+    def setUp(self):
+        app_config = AppleAppConfiguration.objects.create(
+            name='pocket_ai',
+            bundle_id='com.example.pocket',
+            team_id='TEAM',
+            key_id='KEY',
+            auth_key='dummy'
+        )
+        self.template = NotificationTemplate.objects.create(
+            app_config=app_config,
+            name='promo',
+            title='Hello',
+            body='World'
+        )
+        for user_id in range(1, 6):
+            DeviceToken.objects.create(user_id=user_id, device_id=f'device-{user_id}',
+                                       device_token=f'token-{user_id}')
+        Purchase.objects.create(
+            user_id=2, app_id='com.example.pocket', transaction_id='t-2',
+            purchase_date=timezone.now(), expires_at=timezone.now() + timedelta(days=30),
+            is_active=True, is_successful=True
+        )
+
+    def _bulk_results(self, device_tokens, payload, **kwargs):
+        return [{'device_token': token, 'success': token != 'token-3',
+                 'status_code': 200 if token != 'token-3' else 400,
+                 'reason': None if token != 'token-3' else 'BadDeviceToken', 'retry_after': None}
+                for token in device_tokens]
+
+    @mock.patch('notifications.tasks.AppleService.send_bulk_payload')
+    def test_delivers_to_whole_segment_in_batches(self, send_bulk):
+        send_bulk.side_effect = self._bulk_results
+        campaign = Campaign.objects.create(name='all', template=self.template)
+
+        with self.settings(CAMPAIGN_BATCH_SIZE=2):
+            self.assertEqual(deliver_campaign(campaign.id), 4)
+
+        campaign.refresh_from_db()
+        self.assertEqual(campaign.status, 'completed')
+        self.assertEqual(campaign.total_count, 5)
+        self.assertEqual(campaign.sent_count, 4)
+        self.assertEqual(campaign.failed_count, 1)
+        self.assertEqual(send_bulk.call_count, 3)
+        self.assertFalse(DeviceToken.objects.get(device_token='token-3').is_active)
+
+    @mock.patch('notifications.tasks.AppleService.send_bulk_payload')
+    def test_segment_filters(self, send_bulk):
+        send_bulk.side_effect = self._bulk_results
+        Notifications.objects.create(user_id=4, timezone='Europe/London', notify_time='09:00')
+
+        premium = Campaign.objects.create(name='premium', template=self.template, is_premium=True)
+        self.assertEqual(list(premium.get_device_queryset().values_list('user_id', flat=True)), [2])
+
+        by_app = Campaign.objects.create(name='app', template=self.template, app_id='pocket_ai')
+        self.assertEqual(list(by_app.get_device_queryset().values_list('user_id', flat=True)), [2])
+
+        by_timezone = Campaign.objects.create(name='tz', template=self.template, timezones=['Europe/London'])
+        self.assertEqual(list(by_timezone.get_device_queryset().values_list('user_id', flat=True)), [4])
+
+    @mock.patch('notifications.tasks.AppleService.send_bulk_payload')
+    def test_cancelled_campaign_is_not_sent(self, send_bulk):
+        campaign = Campaign.objects.create(name='all', template=self.template, status='cancelled')
+        self.assertEqual(deliver_campaign(campaign.id), 0)
+        send_bulk.assert_not_called()
+
+    def test_oversized_template_fails_campaign(self):
+        self.template.body = 'x' * 5000
+        self.template.save()
+        campaign = Campaign.objects.create(name='all', template=self.template)
+
+        self.assertEqual(deliver_campaign(campaign.id), 0)
+        campaign.refresh_from_db()
+        self.assertEqual(campaign.status, 'failed')
+        self.assertIn('4096', campaign.error)
+
+
+class PreparedNotificationTests(TestCase):
+    def setUp(self):
+        AppleAppConfiguration.objects.create(
+            name='pocket_ai',
+            bundle_id='com.example.pocket',
+            team_id='TEAM',
+            key_id='KEY',
+            auth_key='dummy'
+        )
+
+    @mock.patch('notifications.service.apple.AppleService._build_headers', return_value={})
+    @mock.patch('notifications.service.apple.httpx.Client')
+    def test_payload_is_encoded_once_and_shared(self, client_class, build_headers):
+        from .service.apple import AppleService
+
+        client = client_class.return_value.__enter__.return_value
+        client.post.return_value = mock.Mock(status_code=200, headers={})
+
+        apple_service = AppleService(app_id='pocket_ai')
+        prepared = apple_service.prepare_notification(title='标题', body='内容')
+        with mock.patch('notifications.service.apple.json.dumps') as dumps:
+            results = apple_service.send_bulk_payload(['a', 'b'], prepared)
+            dumps.assert_not_called()
+
+        self.assertTrue(all(result['success'] for result in results))
+        urls = [call.args[0] for call in client.post.call_args_list]
+        self.assertTrue(urls[0].endswith('/3/device/a'))
+        self.assertTrue(urls[1].endswith('/3/device/b'))
+        self.assertTrue(all(call.kwargs['content'] is prepared.content for call in client.post.call_args_list))
+        self.assertIn('标题'.encode('utf-8'), prepared.content)
+
+    def test_oversized_payload_is_rejected(self):
+        from .service.apple import PreparedNotification
+
+        with self.assertRaises(ValueError):
+            PreparedNotification({'aps': {'alert': {'body': 'x' * 5000}}})
+
+
+
+class DeliveryStatsTests(TestCase):
+    def test_counters_are_flushed_into_rollups(self):
+        from django.core.cache import cache
+        from .models import DeliveryStat
+        from .service.metrics import record_delivery, flush_delivery_stats
+
+        cache.clear()
+        past = timezone.now() - timedelta(minutes=2)
+        with mock.patch('notifications.service.metrics.timezone.now', return_value=past):
+            record_delivery('pocket_ai', 'Success', 40)
+            record_delivery('pocket_ai', 'Success', 60)
+            record_delivery('pocket_ai', 'BadDeviceToken', 10)
+        # 当前分钟的计数器不会被汇总
+        record_delivery('pocket_ai', 'Success', 5)
+
+        # 事务提交前失败时保留待汇总状态，再次汇总覆盖写入，不会重复累加
+        with mock.patch('notifications.service.metrics._mark_flushed'):
+            self.assertEqual(flush_delivery_stats(), 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(flush_delivery_stats(), 2)
+        success = DeliveryStat.objects.get(reason='Success')
+        self.assertEqual(success.count, 2)
+        self.assertEqual(success.latency_ms_total, 100)
+        self.assertEqual(success.minute, past.replace(second=0, microsecond=0))
+        self.assertEqual(DeliveryStat.objects.get(reason='BadDeviceToken').count, 1)
+
+        # 提交后移出待汇总集合
+        self.assertEqual(flush_delivery_stats(), 0)
+
+        # 迟到的写入让该分钟重新汇总，写入的是累计值
+        with mock.patch('notifications.service.metrics.timezone.now', return_value=past):
+            record_delivery('pocket_ai', 'Success', 20)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(flush_delivery_stats(), 2)
+        success.refresh_from_db()
+        self.assertEqual((success.count, success.latency_ms_total), (3, 120))
+        self.assertEqual(DeliveryStat.objects.count(), 2)
+
+        # 读取之后、提交之前又有写入：版本号变化，该分钟不会被移出待汇总集合
+        with mock.patch('notifications.service.metrics.timezone.now', return_value=past):
+            record_delivery('pocket_ai', 'Success', 30)
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertEqual(flush_delivery_stats(), 2)
+        with mock.patch('notifications.service.metrics.timezone.now', return_value=past):
+            record_delivery('pocket_ai', 'Success', 50)
+        for callback in callbacks:
+            callback()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(flush_delivery_stats(), 2)
+        success.refresh_from_db()
+        self.assertEqual((success.count, success.latency_ms_total), (5, 200))
+        self.assertEqual(flush_delivery_stats(), 0)
+
+
+class PushRetryTests(TestCase):
+    def setUp(self):
+        AppleAppConfiguration.objects.create(
+            name='pocket_ai',
+            bundle_id='com.example.pocket',
+            team_id='TEAM',
+            key_id='KEY',
+            auth_key='dummy'
+        )
+        self.payload = {'aps': {'alert': {'title': 'Hi', 'body': 'There'}}}
+
+    def test_only_transient_failures_are_queued(self):
+        from .service.retry import schedule_retries
+
+        results = [
+            {'device_token': 'throttled', 'success': False, 'status_code': 429,
+             'reason': 'TooManyRequests', 'retry_after': '120'},
+            {'device_token': 'unavailable', 'success': False, 'status_code': 503,
+             'reason': 'ServiceUnavailable', 'retry_after': None},
+            {'device_token': 'bad', 'success': False, 'status_code': 400,
+             'reason': 'BadDeviceToken', 'retry_after': None},
+            {'device_token': 'ok', 'success': True, 'status_code': 200, 'reason': None, 'retry_after': None},
+        ]
+        self.assertEqual(schedule_retries('pocket_ai', self.payload, results), 2)
+
+        throttled = PushRetry.objects.get(device_token='throttled')
+        self.assertGreaterEqual(throttled.next_attempt_at, timezone.now() + timedelta(seconds=119))
+
+    @mock.patch('notifications.service.apple.AppleService.send_bulk_payload')
+    def test_due_retries_are_sent_in_bulk_and_rescheduled(self, send_bulk):
+        from .service.retry import process_due_retries
+
+        past = timezone.now() - timedelta(seconds=1)
+        for token in ('a', 'b', 'c'):
+            PushRetry.objects.create(app_id='pocket_ai', device_token=token, payload=self.payload,
+                                     next_attempt_at=past)
+        PushRetry.objects.create(app_id='pocket_ai', device_token='d', payload=self.payload,
+                                 attempts=4, next_attempt_at=past)
+        PushRetry.objects.create(app_id='pocket_ai', device_token='later', payload=self.payload,
+                                 next_attempt_at=timezone.now() + timedelta(hours=1))
+
+        send_bulk.return_value = [
+            {'device_token': 'a', 'success': True, 'status_code': 200, 'reason': None, 'retry_after': None},
+            {'device_token': 'b', 'success': False, 'status_code': 503,
+             'reason': 'ServiceUnavailable', 'retry_after': None},
+            {'device_token': 'c', 'success': False, 'status_code': 410,
+             'reason': 'Unregistered', 'retry_after': None},
+            {'device_token': 'd', 'success': False, 'status_code': 429,
+             'reason': 'TooManyRequests', 'retry_after': None},
+        ]
+
+        stats = process_due_retries()
+
+        self.assertEqual(send_bulk.call_count, 1)
+        self.assertEqual(stats, {'total': 4, 'success': 1, 'rescheduled': 1, 'dropped': 2})
+        self.assertEqual(
+            sorted(PushRetry.objects.values_list('device_token', 'attempts')),
+            [('b', 1), ('later', 0)]
+        )
+
+
+class AsyncPushTests(TestCase):
+    def setUp(self):
+        AppleAppConfiguration.objects.create(
+            name='pocket_ai',
+            bundle_id='com.example.pocket',
+            team_id='TEAM',
+            key_id='KEY',
+            auth_key='dummy'
+        )
+        DeviceToken.objects.create(user_id=1, device_id='phone', device_token='token-1')
+        self.send_url = '/api/notifications/send/'
+        patcher = mock.patch('middleware.auth.TokenAuthMiddleware.authenticate', return_value={'id': 1})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @mock.patch('notifications.views.deliver_push.delay')
+    def test_async_send_is_accepted_and_queued(self, delay):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.send_url, {
+                'device_id': 'phone', 'title': 'Hi', 'body': 'There', 'app_id': 'pocket_ai', 'async_mode': True
+            }, content_type='application/json')
+
+        self.assertEqual(response.status_code, 202)
+        delivery_id = response.json()['data']['id']
+        delay.assert_called_once_with(delivery_id)
+
+        response = self.client.get(f'{self.send_url}{delivery_id}/')
+        self.assertEqual(response.json()['data']['status'], 'queued')
+
+        # 其他用户的推送不可见
+        PushDelivery.objects.filter(id=delivery_id).update(user_id=2)
+        response = self.client.get(f'{self.send_url}{delivery_id}/')
+        self.assertEqual(response.status_code, 404)
+
+    def test_async_send_rejects_unknown_app(self):
+        response = self.client.post(self.send_url, {
+            'device_id': 'phone', 'title': 'Hi', 'body': 'There', 'app_id': 'missing', 'async_mode': True
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(PushDelivery.objects.exists())
+
+    @mock.patch('notifications.service.apple.AppleService.send_bulk_payload')
+    def test_transient_failure_outcome_is_written_back(self, send_bulk):
+        from .service.retry import process_due_retries
+        from .tasks import deliver_push
+
+        delivery = PushDelivery.objects.create(user_id=1, app_id='pocket_ai', device_token='token-1',
+                                               payload={'aps': {'alert': {'title': 'Hi'}}})
+        send_bulk.return_value = [{'device_token': 'token-1', 'success': False, 'status_code': 503,
+                                   'reason': 'ServiceUnavailable', 'apns_id': None, 'retry_after': None}]
+        self.assertEqual(deliver_push(delivery.id), 'retrying')
+
+        PushRetry.objects.update(next_attempt_at=timezone.now() - timedelta(seconds=1))
+        send_bulk.return_value = [{'device_token': 'token-1', 'success': True, 'status_code': 200,
+                                   'reason': None, 'apns_id': 'apns-1', 'retry_after': None}]
+        process_due_retries()
+
+        delivery.refresh_from_db()
+        self.assertEqual(delivery.status, 'sent')
+        self.assertEqual(delivery.apns_id, 'apns-1')
+        self.assertIsNotNone(delivery.delivered_at)
+        self.assertFalse(PushRetry.objects.exists())
+
+class RateLimiterTests(TestCase):
+    def test_local_bucket_limits_burst_and_refills(self):
+        from .service.ratelimit import TokenBucketRateLimiter
+
+        limiter = TokenBucketRateLimiter()
+        limits = {'transactional': {'rate': 1000, 'burst': 5}}
+
+        with self.settings(APNS_RATE_LIMITS=limits):
+            self.assertEqual(limiter.acquire('pocket_ai', 'transactional', 5), 5)
+            # 桶已耗尽，需要等待补充
+            self.assertGreater(limiter._try_acquire('apns:ratelimit:pocket_ai:transactional', 1000, 5, 5), 0)
+            # 其他应用的额度互不影响
+            self.assertEqual(limiter._try_acquire('apns:ratelimit:other:transactional', 1000, 5, 5), 0)
+            # 申请数量不会超过桶容量
+            self.assertEqual(limiter.acquire('pocket_ai', 'campaign', 50), 5)
 
-# Create your tests here.
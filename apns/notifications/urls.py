@@ -1,10 +1,12 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import NotificationsViewSet, NotificationsSendViewSet
+from .views import NotificationsViewSet, NotificationsSendViewSet, CampaignViewSet, DeliveryStatViewSet
 
 router = DefaultRouter()
 router.register(r'send', NotificationsSendViewSet, basename='notification-send')
 router.register(r'settings', NotificationsViewSet, basename='notification-settings')
+router.register(r'campaigns', CampaignViewSet, basename='notification-campaigns')
+router.register(r'stats', DeliveryStatViewSet, basename='notification-stats')
 
 urlpatterns = [
     path('', include(router.urls)),
@@ -1,11 +1,20 @@
+from datetime import timedelta
+
+from django.db import transaction
+from rest_framework.permissions import IsAdminUser
+
 from devices.models import DeviceToken
 from notifications.serializers import NotificationSendSerializer
 from notifications.service.apple import AppleService
 from utils.mixins import *
 from rest_framework.viewsets import GenericViewSet
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
-from .models import Notifications
-from .serializers import NotificationsSerializer
+from django.db.models import Sum
+from configurations.models import AppleAppConfiguration
+from .models import Notifications, Campaign, DeliveryStat, PushDelivery
+from .serializers import NotificationsSerializer, CampaignSerializer, PushDeliverySerializer
+from .tasks import deliver_campaign, deliver_push
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework import status
@@ -14,11 +23,20 @@ from utils.permissions import IsAuthenticatedExternal
 
 
 class NotificationsSendViewSet(CreateModelMixin,
+                               RetrieveModelMixin,
                                GenericViewSet):
 
     permission_classes = [IsAuthenticatedExternal]
     serializer_class = NotificationSendSerializer
 
+    def get_queryset(self):
+        """只能查询当前用户的异步推送"""
+        return PushDelivery.objects.filter(user_id=self.request.remote_user.get('id'))
+
+    def get_serializer_class(self):
+        if self.action == 'retrieve':
+            return PushDeliverySerializer
+        return NotificationSendSerializer
 
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -36,6 +54,9 @@ class NotificationsSendViewSet(CreateModelMixin,
                 'data': {}
             }, status=status.HTTP_404_NOT_FOUND)
 
+        if serializer.validated_data.get('async_mode'):
+            return self._accept(serializer.validated_data, user_id, device_token_record.device_token)
+
         apple_service = AppleService(serializer.validated_data.get('app_id'))
 
         rsp = apple_service.send_push_notification(
@@ -56,6 +77,41 @@ class NotificationsSendViewSet(CreateModelMixin,
             'code': status.HTTP_400_BAD_REQUEST,
         })
 
+    def _accept(self, validated_data, user_id, device_token):
+        """异步模式：校验应用和推送内容后入队，返回 202 和推送ID"""
+        app_id = validated_data.get('app_id')
+        try:
+            prepared = AppleService(app_id).prepare_notification(
+                title=validated_data.get('title'),
+                body=validated_data.get('body')
+            )
+        except AppleAppConfiguration.DoesNotExist:
+            return Response({
+                'code': status.HTTP_400_BAD_REQUEST,
+                'msg': f'应用配置不存在: {app_id}',
+                'data': {}
+            }, status=status.HTTP_400_BAD_REQUEST)
+        except ValueError as e:
+            return Response({
+                'code': status.HTTP_400_BAD_REQUEST,
+                'msg': str(e),
+                'data': {}
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        delivery = PushDelivery.objects.create(
+            user_id=user_id,
+            app_id=app_id,
+            device_token=device_token,
+            payload=prepared.notification
+        )
+        transaction.on_commit(lambda: deliver_push.delay(delivery.id))
+
+        return Response({
+            'code': status.HTTP_202_ACCEPTED,
+            'msg': '已受理',
+            'data': PushDeliverySerializer(delivery).data
+        }, status=status.HTTP_202_ACCEPTED)
+
 
 class NotificationsViewSet(CreateModelMixin,
                           UpdateModelMixin,
@@ -157,3 +213,95 @@ class NotificationsViewSet(CreateModelMixin,
             'data': {}
         }, status=status.HTTP_404_NOT_FOUND)
 
+
+class CampaignViewSet(CreateModelMixin,
+                      RetrieveModelMixin,
+                      ListModelMixin,
+                      GenericViewSet):
+    """群发活动视图集，创建后在后台分批发送，发送进度可通过详情接口查询"""
+    queryset = Campaign.objects.select_related('template')
+    serializer_class = CampaignSerializer
+    permission_classes = [IsAdminUser]  # 仅管理员可访问
+
+    def perform_create(self, serializer):
+        campaign = serializer.save()
+        transaction.on_commit(lambda: deliver_campaign.delay(campaign.id))
+
+    @action(detail=True, methods=['post'])
+    def cancel(self, request, pk=None):
+        """取消尚未完成的群发活动，正在发送的批次结束后停止"""
+        updated = Campaign.objects.filter(
+            pk=self.get_object().pk,
+            status__in=['pending', 'running']
+        ).update(status='cancelled', finished_at=timezone.now())
+
+        if not updated:
+            return Response({
+                'code': status.HTTP_400_BAD_REQUEST,
+                'msg': '活动已结束，无法取消',
+                'data': {}
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            'code': status.HTTP_200_OK,
+            'msg': '取消成功',
+            'data': self.get_serializer(Campaign.objects.get(pk=pk)).data
+        })
+
+
+class DeliveryStatViewSet(GenericViewSet):
+    """推送统计看板，读取按分钟汇总的推送结果"""
+    queryset = DeliveryStat.objects.all()
+    permission_classes = [IsAdminUser]  # 仅管理员可访问
+
+    def list(self, request, *args, **kwargs):
+        """
+        汇总最近一段时间的推送吞吐量、失败原因分布和平均耗时
+
+        查询参数:
+            app_id: 应用名称，可选
+            minutes: 统计时间窗口（分钟），默认 60
+        """
+        try:
+            minutes = min(int(request.query_params.get('minutes', 60)), 60 * 24 * 7)
+        except ValueError:
+            return Response({
+                'code': status.HTTP_400_BAD_REQUEST,
+                'msg': 'minutes 必须为整数',
+                'data': {}
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        queryset = self.get_queryset().filter(minute__gte=timezone.now() - timedelta(minutes=minutes))
+        app_id = request.query_params.get('app_id')
+        if app_id:
+            queryset = queryset.filter(app_id=app_id)
+
+        by_reason = [
+            {
+                'app_id': row['app_id'],
+                'reason': row['reason'],
+                'count': row['total'],
+                'avg_latency_ms': round(row['latency'] / row['total'], 2) if row['total'] else 0,
+            }
+            for row in queryset.values('app_id', 'reason').annotate(
+                total=Sum('count'), latency=Sum('latency_ms_total')
+            ).order_by('app_id', '-total')
+        ]
+
+        per_minute = list(
+            queryset.values('minute').annotate(total=Sum('count')).order_by('minute')
+        )
+        total = sum(row['count'] for row in by_reason)
+
+        return Response({
+            'code': status.HTTP_200_OK,
+            'msg': '获取成功',
+            'data': {
+                'minutes': minutes,
+                'total': total,
+                'per_minute_avg': round(total / minutes, 2) if minutes else 0,
+                'by_reason': by_reason,
+                'per_minute': [{'minute': row['minute'], 'count': row['total']} for row in per_minute],
+            }
+        })
+
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Purchase
+from .models import Purchase, PurchaseBlob, PremiumState, PremiumStatusOutbox, WebhookInbox
 
 @admin.register(Purchase)
 class PurchaseAdmin(admin.ModelAdmin):
@@ -7,7 +7,7 @@ class PurchaseAdmin(admin.ModelAdmin):
                     'expires_at', 'is_active', 'is_successful', 'status', 'notification_type')
     list_filter = ('is_active', 'is_successful', 'status', 'notification_type')
     search_fields = ('user_id', 'transaction_id', 'original_transaction_id', 'product_id')
-    readonly_fields = ('created_at', 'updated_at')
+    readonly_fields = ('created_at', 'updated_at', 'blob_text')
     fieldsets = (
         ('基本信息', {
             'fields': ('user_id', 'app_id', 'product_id', 'transaction_id', 'original_transaction_id')
@@ -19,7 +19,35 @@ class PurchaseAdmin(admin.ModelAdmin):
             'fields': ('purchase_date', 'expires_at', 'created_at', 'updated_at')
         }),
         ('详细数据', {
-            'fields': ('receipt_data', 'notes'),
+            'fields': ('blob_text', 'notes'),
             'classes': ('collapse',)
         }),
     )
+
+    @admin.display(description='原始数据')
+    def blob_text(self, obj):
+        blob = PurchaseBlob.objects.filter(purchase_id=obj.transaction_id).first()
+        return blob.text if blob else '-'
+
+
+@admin.register(PremiumState)
+class PremiumStateAdmin(admin.ModelAdmin):
+    list_display = ('user_id', 'is_premium', 'expires_at', 'app_id', 'synced', 'updated_at')
+    list_filter = ('is_premium', 'synced')
+    search_fields = ('user_id',)
+    readonly_fields = ('updated_at',)
+
+
+@admin.register(PremiumStatusOutbox)
+class PremiumStatusOutboxAdmin(admin.ModelAdmin):
+    list_display = ('user_id', 'is_premium', 'expires_at', 'app_id', 'attempts', 'next_attempt_at', 'updated_at')
+    search_fields = ('user_id',)
+    readonly_fields = ('created_at', 'updated_at')
+
+
+@admin.register(WebhookInbox)
+class WebhookInboxAdmin(admin.ModelAdmin):
+    list_display = ('notification_uuid', 'notification_type', 'status', 'attempts', 'received_at', 'processed_at')
+    list_filter = ('status', 'notification_type')
+    search_fields = ('notification_uuid', 'original_transaction_id')
+    readonly_fields = ('received_at', 'claimed_at', 'processed_at')
@@ -0,0 +1,112 @@
+"""
+会员到期定时器
+
+会员只会在已知的到期时间失效，不需要轮询全部购买记录。每个会员用户按当前权益的到期时间
+（最晚到期的有效订阅）登记在 Redis 有序集合中，score 为到期时间戳；后台任务每隔几秒取出
+已到期的用户重新计算权益，状态变化写入推送队列，仍有其他有效订阅的用户按新的到期时间重新登记。
+
+续订、退款等变化经过 Purchase.update_user_privileges 重新计算权益时会覆盖或移除登记，
+因此登记始终对应用户当前的到期时间。取出后处理失败或 Redis 数据丢失时，
+每小时的增量同步（按到期时间越过水位查找）兜底，也可以用 schedule_premium_expiries 命令重建。
+"""
+import logging
+
+from django.core.cache import cache
+from django.utils import timezone
+
+from utils.redis_client import get_redis_connection
+
+logger = logging.getLogger(__name__)
+
+EXPIRY_KEY = 'apns:premium-expiry'
+
+# 取出一批到期用户并从集合中删除，多个进程同时执行时每个用户只会被一个进程取出
+POP_DUE_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+if #due > 0 then
+    redis.call('ZREM', KEYS[1], unpack(due))
+end
+return due
+"""
+
+
+def schedule_entitlement_expiries(entitlements):
+    """
+    按权益登记或移除到期定时器
+
+    Args:
+        entitlements: {user_id: {'is_premium', 'expires_at', ...}}，与 PurchaseService.get_entitlements 的返回一致
+    """
+    if not entitlements:
+        return
+
+    now = timezone.now()
+    scheduled, removed = {}, []
+    for user_id, entitlement in entitlements.items():
+        expires_at = entitlement.get('expires_at')
+        if entitlement.get('is_premium') and expires_at and expires_at > now:
+            scheduled[user_id] = expires_at.timestamp()
+        else:
+            removed.append(user_id)
+
+    try:
+        redis = get_redis_connection()
+        if redis is not None:
+            pipeline = redis.pipeline(transaction=False)
+            if scheduled:
+                pipeline.zadd(EXPIRY_KEY, scheduled)
+            if removed:
+                pipeline.zrem(EXPIRY_KEY, *removed)
+            pipeline.execute()
+            return
+
+        # 未配置 Redis 时使用进程内缓存，仅用于开发和测试
+        timers = cache.get(EXPIRY_KEY, {})
+        timers.update(scheduled)
+        for user_id in removed:
+            timers.pop(user_id, None)
+        cache.set(EXPIRY_KEY, timers, None)
+    except Exception as e:
+        # 登记失败时由定时同步兜底
+        logger.error(f"登记会员到期定时器失败: {str(e)}")
+
+
+def _pop_due(now, limit):
+    redis = get_redis_connection()
+    if redis is not None:
+        return [int(user_id) for user_id in redis.eval(POP_DUE_SCRIPT, 1, EXPIRY_KEY, now.timestamp(), limit)]
+
+    timers = cache.get(EXPIRY_KEY, {})
+    due = sorted((user_id for user_id, score in timers.items() if score <= now.timestamp()),
+                 key=timers.get)[:limit]
+    for user_id in due:
+        del timers[user_id]
+    cache.set(EXPIRY_KEY, timers, None)
+    return due
+
+
+def process_due_expiries(batch_size=500):
+    """
+    重新计算已到期用户的权益，写入推送队列，仍是会员的用户按新的到期时间重新登记
+
+    Returns:
+        int: 处理的用户数
+    """
+    from purchase.outbox import enqueue_premium_statuses
+    from purchase.services import PurchaseService
+
+    now = timezone.now()
+    processed = 0
+    while True:
+        user_ids = _pop_due(now, batch_size)
+        if not user_ids:
+            break
+
+        entitlements = PurchaseService.get_entitlements(user_ids, now)
+        enqueue_premium_statuses(entitlements)
+        schedule_entitlement_expiries(entitlements)
+        processed += len(user_ids)
+
+    if processed:
+        logger.info(f"处理会员到期: {processed} 个用户")
+    return processed
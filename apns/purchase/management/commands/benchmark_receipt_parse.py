@@ -0,0 +1,77 @@
+"""
+收据验证响应解析的基准测试
+
+生成包含大量历史交易的模拟 verifyReceipt 响应，对比 json.loads 整体解析与流式解析的耗时和峰值内存。
+
+    python manage.py benchmark_receipt_parse --transactions 2000
+"""
+import json
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+
+from purchase.verifier import CHUNK_SIZE, parse_verify_response
+
+
+class Command(BaseCommand):
+    help = '对比整体解析与流式解析大型 verifyReceipt 响应的耗时和峰值内存'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--transactions', type=int, default=2000, help='模拟响应中的历史交易数')
+        parser.add_argument('--repeat', type=int, default=20, help='计时的执行次数')
+
+    def handle(self, *args, **options):
+        raw = json.dumps(self._response(options['transactions'])).encode()
+        chunks = [raw[i:i + CHUNK_SIZE] for i in range(0, len(raw), CHUNK_SIZE)]
+        self.stdout.write(f"响应大小: {len(raw) / 1024:.0f}KB，{options['transactions']} 条交易 x 2")
+
+        parsers = {
+            'json.loads': lambda: json.loads(b''.join(chunks)),
+            'parse_verify_response': lambda: parse_verify_response(chunks),
+        }
+        for name, parse in parsers.items():
+            started = time.perf_counter()
+            for _ in range(options['repeat']):
+                parse()
+            elapsed = (time.perf_counter() - started) * 1000 / options['repeat']
+
+            tracemalloc.start()
+            result = parse()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            del result
+
+            self.stdout.write(f"{name}: {elapsed:.2f}ms, 峰值内存 {peak / 1024:.0f}KB")
+
+    def _response(self, transactions):
+        """与苹果返回的结构一致，latest_receipt_info 和 receipt.in_app 各包含全部历史交易"""
+        purchase_ms = 1600000000000
+        history = [{
+            'quantity': '1',
+            'product_id': 'premium.monthly',
+            'transaction_id': str(1000000000 + i),
+            'original_transaction_id': '1000000000',
+            'purchase_date': '2020-09-13 12:26:40 Etc/GMT',
+            'purchase_date_ms': str(purchase_ms + i * 2592000000),
+            'purchase_date_pst': '2020-09-13 05:26:40 America/Los_Angeles',
+            'original_purchase_date_ms': str(purchase_ms),
+            'expires_date_ms': str(purchase_ms + (i + 1) * 2592000000),
+            'web_order_line_item_id': str(2000000000 + i),
+            'is_trial_period': 'false',
+            'is_in_intro_offer_period': 'false',
+            'in_app_ownership_type': 'PURCHASED',
+            'subscription_group_identifier': '20000000',
+        } for i in range(transactions)]
+        return {
+            'status': 0,
+            'environment': 'Production',
+            'receipt': {
+                'receipt_type': 'Production',
+                'bundle_id': 'com.example.app',
+                'in_app': history,
+            },
+            'latest_receipt_info': list(reversed(history)),
+            'latest_receipt': 'A' * (transactions * 600),
+            'pending_renewal_info': [{'auto_renew_status': '1', 'product_id': 'premium.monthly'}],
+        }
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from purchase.expiry import schedule_entitlement_expiries
+from purchase.services import PurchaseService
+
+
+class Command(BaseCommand):
+    help = '按当前权益重建全部用户的会员到期定时器（首次部署或 Redis 数据丢失后执行）'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        batch, scheduled = {}, 0
+        for user_id, entitlement in PurchaseService.iter_entitlements(chunk_size=options['batch_size']):
+            batch[user_id] = entitlement
+            scheduled += entitlement['is_premium']
+            if len(batch) >= options['batch_size']:
+                schedule_entitlement_expiries(batch)
+                batch = {}
+        schedule_entitlement_expiries(batch)
+        self.stdout.write(self.style.SUCCESS(f"完成：登记 {scheduled} 个会员的到期时间"))
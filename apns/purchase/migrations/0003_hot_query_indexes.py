@@ -0,0 +1,22 @@
+# Generated by Django 4.2.30 on 2026-10-19 13:23
+
+from django.db import migrations, models
+
+from utils.migrations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY 不能在事务中执行
+    atomic = False
+
+    dependencies = [
+        ('purchase', '0002_purchase_notification_type'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='purchase',
+            index=models.Index(condition=models.Q(('is_active', True), ('is_successful', True)), fields=['user_id', '-expires_at'], name='purchase_active_expiry_idx'),
+        ),
+    ]
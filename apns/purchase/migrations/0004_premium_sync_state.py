@@ -0,0 +1,59 @@
+# Generated by Django 4.2.30 on 2026-10-19 13:29
+
+from django.db import migrations, models
+
+from utils.migrations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY 不能在事务中执行
+    atomic = False
+
+    dependencies = [
+        ('purchase', '0003_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PremiumState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.IntegerField(help_text='UserCenter的用户ID', unique=True, verbose_name='用户ID')),
+                ('is_premium', models.BooleanField(default=False, verbose_name='是否会员')),
+                ('expires_at', models.DateTimeField(blank=True, null=True, verbose_name='到期时间')),
+                ('app_id', models.CharField(blank=True, max_length=255, null=True, verbose_name='应用')),
+                ('synced', models.BooleanField(default=False, help_text='推送失败时为 False，下次同步时重试', verbose_name='已推送')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+            ],
+            options={
+                'verbose_name': '会员状态',
+                'verbose_name_plural': '会员状态',
+            },
+        ),
+        migrations.CreateModel(
+            name='SyncCursor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True, verbose_name='任务')),
+                ('value', models.DateTimeField(verbose_name='水位时间')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+            ],
+            options={
+                'verbose_name': '同步水位',
+                'verbose_name_plural': '同步水位',
+            },
+        ),
+        AddIndexConcurrently(
+            model_name='purchase',
+            index=models.Index(fields=['updated_at'], name='purchase_updated_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='purchase',
+            index=models.Index(fields=['expires_at'], name='purchase_expires_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='premiumstate',
+            index=models.Index(condition=models.Q(('synced', False)), fields=['user_id'], name='premium_state_unsynced_idx'),
+        ),
+    ]
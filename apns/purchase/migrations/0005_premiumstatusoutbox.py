@@ -0,0 +1,33 @@
+# Generated by Django 4.2.30 on 2026-10-19 13:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('purchase', '0004_premium_sync_state'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PremiumStatusOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.IntegerField(help_text='UserCenter的用户ID', unique=True, verbose_name='用户ID')),
+                ('is_premium', models.BooleanField(default=False, verbose_name='是否会员')),
+                ('expires_at', models.DateTimeField(blank=True, null=True, verbose_name='到期时间')),
+                ('app_id', models.CharField(blank=True, max_length=255, null=True, verbose_name='应用')),
+                ('attempts', models.IntegerField(default=0, verbose_name='已尝试次数')),
+                ('next_attempt_at', models.DateTimeField(db_index=True, verbose_name='下次推送时间')),
+                ('last_error', models.TextField(blank=True, null=True, verbose_name='上次失败原因')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='创建时间')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+            ],
+            options={
+                'verbose_name': '会员状态推送队列',
+                'verbose_name_plural': '会员状态推送队列',
+                'ordering': ['next_attempt_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.30 on 2026-10-19 13:39
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('purchase', '0005_premiumstatusoutbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PurchaseBlob',
+            fields=[
+                ('purchase', models.OneToOneField(db_column='transaction_id', on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='blob', serialize=False, to='purchase.purchase', to_field='transaction_id', verbose_name='购买记录')),
+                ('kind', models.CharField(choices=[('receipt', '收据'), ('notification', '通知')], max_length=20, verbose_name='类型')),
+                ('data', models.BinaryField(verbose_name='压缩数据')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='更新时间')),
+            ],
+            options={
+                'verbose_name': '交易原始数据',
+                'verbose_name_plural': '交易原始数据',
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-19 13:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('purchase', '0006_purchase_blob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebhookInbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('notification_uuid', models.CharField(max_length=64, unique=True, verbose_name='通知UUID')),
+                ('notification_type', models.CharField(blank=True, max_length=64, null=True, verbose_name='通知类型')),
+                ('signed_payload', models.TextField(verbose_name='原始载荷')),
+                ('status', models.CharField(choices=[('pending', '待处理'), ('processing', '处理中'), ('done', '已处理'), ('failed', '处理失败'), ('invalid', '无效通知')], default='pending', max_length=20, verbose_name='状态')),
+                ('attempts', models.IntegerField(default=0, verbose_name='已尝试次数')),
+                ('last_error', models.TextField(blank=True, null=True, verbose_name='上次失败原因')),
+                ('received_at', models.DateTimeField(auto_now_add=True, verbose_name='接收时间')),
+                ('claimed_at', models.DateTimeField(blank=True, null=True, verbose_name='开始处理时间')),
+                ('processed_at', models.DateTimeField(blank=True, null=True, verbose_name='处理完成时间')),
+            ],
+            options={
+                'verbose_name': '苹果通知收件箱',
+                'verbose_name_plural': '苹果通知收件箱',
+                'ordering': ['-received_at'],
+                'indexes': [models.Index(condition=models.Q(('status__in', ['pending', 'processing', 'failed'])), fields=['received_at'], name='webhook_inbox_unfinished_idx')],
+            },
+        ),
+    ]
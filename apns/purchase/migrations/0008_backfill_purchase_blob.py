@@ -0,0 +1,67 @@
+# Generated by Django 4.2.30 on 2026-10-19 13:41
+
+import zlib
+
+from django.db import migrations, transaction
+
+BATCH_SIZE = 1000
+
+
+def move_receipt_data(apps, schema_editor):
+    """把 Purchase.receipt_data 压缩后写入 PurchaseBlob，按主键分批，每批一个短事务"""
+    Purchase = apps.get_model('purchase', 'Purchase')
+    PurchaseBlob = apps.get_model('purchase', 'PurchaseBlob')
+
+    last_id = 0
+    while True:
+        rows = list(
+            Purchase.objects.filter(id__gt=last_id, transaction_id__isnull=False, receipt_data__isnull=False)
+            .exclude(receipt_data='')
+            .order_by('id')
+            .values_list('id', 'transaction_id', 'receipt_data')[:BATCH_SIZE]
+        )
+        if not rows:
+            return
+
+        blobs = []
+        for _, transaction_id, receipt_data in rows:
+            # 通知处理存储的是 JSON，收据验证存储的是 base64 收据
+            kind = 'notification' if receipt_data.lstrip().startswith('{') else 'receipt'
+            blobs.append(PurchaseBlob(purchase_id=transaction_id, kind=kind,
+                                      data=zlib.compress(receipt_data.encode('utf-8'))))
+        with transaction.atomic():
+            # 新代码已经写入的原始数据更新，不覆盖
+            PurchaseBlob.objects.bulk_create(blobs, ignore_conflicts=True)
+        last_id = rows[-1][0]
+
+
+def restore_receipt_data(apps, schema_editor):
+    Purchase = apps.get_model('purchase', 'Purchase')
+    PurchaseBlob = apps.get_model('purchase', 'PurchaseBlob')
+
+    last_id = ''
+    while True:
+        blobs = list(PurchaseBlob.objects.filter(purchase_id__gt=last_id).order_by('purchase_id')[:BATCH_SIZE])
+        if not blobs:
+            return
+
+        with transaction.atomic():
+            for blob in blobs:
+                Purchase.objects.filter(transaction_id=blob.purchase_id).update(
+                    receipt_data=zlib.decompress(blob.data).decode('utf-8')
+                )
+        last_id = blobs[-1].purchase_id
+
+
+class Migration(migrations.Migration):
+
+    # 回填按批提交，不放在同一个事务中
+    atomic = False
+
+    dependencies = [
+        ('purchase', '0007_webhook_inbox'),
+    ]
+
+    operations = [
+        migrations.RunPython(move_receipt_data, restore_receipt_data),
+    ]
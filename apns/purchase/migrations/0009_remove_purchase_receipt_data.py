@@ -0,0 +1,30 @@
+# Generated by Django 4.2.30 on 2026-10-19 13:41
+
+from importlib import import_module
+
+from django.db import migrations
+
+backfill = import_module('purchase.migrations.0008_backfill_purchase_blob')
+
+
+class Migration(migrations.Migration):
+    """
+    删除已回填到 PurchaseBlob 的 receipt_data 列
+
+    代码已不再读写该列（列允许为空），滚动发布时可以先执行到 0008，
+    等旧版本的进程全部退出后再执行本迁移；删除前再回填一次期间旧进程写入的数据。
+    """
+
+    atomic = False
+
+    dependencies = [
+        ('purchase', '0008_backfill_purchase_blob'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill.move_receipt_data, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='purchase',
+            name='receipt_data',
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.30 on 2026-10-19 14:01
+
+from django.db import migrations, models
+
+from utils.migrations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY 不能在事务中执行
+    atomic = False
+
+    dependencies = [
+        ('purchase', '0009_remove_purchase_receipt_data'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='webhookinbox',
+            name='original_transaction_id',
+            field=models.CharField(blank=True, max_length=255, null=True, verbose_name='原始交易ID'),
+        ),
+        migrations.AlterField(
+            model_name='webhookinbox',
+            name='status',
+            field=models.CharField(choices=[('pending', '待处理'), ('processing', '处理中'), ('done', '已处理'), ('failed', '处理失败'), ('invalid', '无效通知'), ('waiting', '等待购买记录')], default='pending', max_length=20, verbose_name='状态'),
+        ),
+        AddIndexConcurrently(
+            model_name='webhookinbox',
+            index=models.Index(condition=models.Q(('status', 'waiting')), fields=['original_transaction_id'], name='webhook_inbox_waiting_idx'),
+        ),
+    ]
@@ -0,0 +1,168 @@
+"""
+苹果通知的镜像转发
+
+其他环境（如另一套部署）需要收到同样的苹果通知。通知处理时只把原始载荷写入每个镜像目标的待转发队列，
+由后台任务通过连接池转发，镜像缓慢或不可用不会影响本地处理。
+
+- 队列有上限（WEBHOOK_MIRROR_BACKLOG），镜像长时间不可用时丢弃最旧的通知；
+- 转发失败（网络错误、5xx、429）时放回队首，本轮停止向该目标转发，下一轮重试；
+- 超过最大尝试次数或镜像返回其他 4xx 时丢弃。
+
+有 Redis 时使用 Redis 列表，本地开发使用内存缓存时回退到 Django 缓存接口。
+"""
+import hashlib
+import json
+import logging
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from requests.adapters import HTTPAdapter
+
+from utils.redis_client import get_redis_connection
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'apns:webhook-mirror'
+
+# 请求超时：(连接, 读取) 秒
+TIMEOUT = (3, 10)
+
+# 单次转发的结果
+FORWARDED = 'forwarded'
+RETRY = 'retry'
+REJECTED = 'rejected'
+
+
+def _build_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+mirror_session = _build_session()
+
+
+def _queue_key(target):
+    return f'{KEY_PREFIX}:{hashlib.sha1(target.encode()).hexdigest()[:16]}'
+
+
+def _push(target, items, oldest=False):
+    """
+    写入待转发队列：新通知从左侧写入并裁剪到上限，失败放回的通知写回右侧（下一次最先取出）
+    """
+    key = _queue_key(target)
+    redis = get_redis_connection()
+    if redis is not None:
+        pipeline = redis.pipeline(transaction=False)
+        if oldest:
+            pipeline.rpush(key, *items)
+        else:
+            pipeline.lpush(key, *items)
+            pipeline.ltrim(key, 0, settings.WEBHOOK_MIRROR_BACKLOG - 1)
+        pipeline.execute()
+        return
+
+    # 进程内缓存中的队列按从旧到新排列
+    queue = cache.get(key, [])
+    if oldest:
+        queue = list(items) + queue
+    else:
+        queue = (queue + list(items))[-settings.WEBHOOK_MIRROR_BACKLOG:]
+    cache.set(key, queue, None)
+
+
+def _pop(target):
+    """取出最早的一条通知"""
+    key = _queue_key(target)
+    redis = get_redis_connection()
+    if redis is not None:
+        return redis.rpop(key)
+
+    queue = cache.get(key, [])
+    if not queue:
+        return None
+    item = queue.pop(0)
+    cache.set(key, queue, None)
+    return item
+
+
+def backlog_size(target):
+    redis = get_redis_connection()
+    if redis is not None:
+        return redis.llen(_queue_key(target))
+    return len(cache.get(_queue_key(target), []))
+
+
+def enqueue_mirror(signed_payload):
+    """把通知写入所有镜像目标的待转发队列，返回目标数"""
+    targets = settings.WEBHOOK_MIRROR_TARGETS
+    if not targets:
+        return 0
+
+    item = json.dumps({'signed_payload': signed_payload, 'attempts': 0})
+    for target in targets:
+        try:
+            _push(target, [item])
+        except Exception as e:
+            logger.error(f"写入镜像 {target} 的转发队列失败: {str(e)}")
+    return len(targets)
+
+
+def _forward(target, signed_payload):
+    """
+    转发一条通知
+
+    Returns:
+        str: FORWARDED 转发成功，RETRY 需要重试，REJECTED 镜像拒绝（其他 4xx），不再重试
+    """
+    try:
+        response = mirror_session.post(target, data={'signedPayload': signed_payload}, timeout=TIMEOUT)
+    except requests.RequestException as e:
+        logger.warning(f"转发苹果通知到 {target} 失败: {str(e)}")
+        return RETRY
+
+    if response.status_code < 400:
+        return FORWARDED
+    if response.status_code == 429 or response.status_code >= 500:
+        logger.warning(f"转发苹果通知到 {target} 失败: HTTP {response.status_code}")
+        return RETRY
+    logger.error(f"镜像 {target} 拒绝了苹果通知: HTTP {response.status_code}，丢弃")
+    return REJECTED
+
+
+def forward_mirrors(batch_size=200):
+    """
+    转发各镜像目标队列中的通知，每个目标每轮最多转发 batch_size 条
+
+    Returns:
+        dict: forwarded 转发成功、rejected 被镜像拒绝（4xx）、dropped 超过最大尝试次数丢弃的通知数
+    """
+    counts = {FORWARDED: 0, REJECTED: 0, 'dropped': 0}
+    for target in settings.WEBHOOK_MIRROR_TARGETS:
+        for _ in range(batch_size):
+            raw = _pop(target)
+            if raw is None:
+                break
+
+            item = json.loads(raw)
+            result = _forward(target, item['signed_payload'])
+            if result != RETRY:
+                counts[result] += 1
+                continue
+
+            item['attempts'] += 1
+            if item['attempts'] >= settings.WEBHOOK_MIRROR_MAX_ATTEMPTS:
+                logger.error(f"转发苹果通知到 {target} 失败 {item['attempts']} 次，丢弃")
+                counts['dropped'] += 1
+                continue
+            # 放回队首，本轮不再向该目标转发，避免持续请求不可用的镜像
+            _push(target, [json.dumps(item)], oldest=True)
+            break
+
+    if counts[REJECTED] or counts['dropped']:
+        logger.warning(f"转发苹果通知: 成功 {counts[FORWARDED]} 条，被拒绝 {counts[REJECTED]} 条，"
+                       f"重试失败丢弃 {counts['dropped']} 条")
+    return counts
@@ -1,12 +1,13 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.utils.translation import gettext_lazy as _
-import requests
 import json
 from django.conf import settings
 from celery import shared_task
 from configurations.models import AppleAppConfiguration
+from configurations.registry import app_registry
 import logging
+import zlib
 from .services import UserService
 import base64
 
@@ -40,7 +41,6 @@ class Purchase(models.Model):
     product_id = models.CharField(max_length=255, blank=True, null=True)
     transaction_id = models.CharField(max_length=255, unique=True, blank=True, null=True)
     original_transaction_id = models.CharField(max_length=255, blank=True, null=True)
-    receipt_data = models.TextField(blank=True, null=True)
     purchase_date = models.DateTimeField()
     expires_at = models.DateTimeField(blank=True, null=True)
     is_active = models.BooleanField(default=True)
@@ -63,36 +63,66 @@ class Purchase(models.Model):
         indexes = [
             models.Index(fields=['user_id', 'is_active']),
             models.Index(fields=['original_transaction_id']),
+            # 查询用户有效订阅并按到期时间倒序取最新一条
+            models.Index(fields=['user_id', '-expires_at'], name='purchase_active_expiry_idx',
+                         condition=models.Q(is_active=True, is_successful=True)),
+            # 增量同步会员状态时按更新时间和到期时间查找变化的记录
+            models.Index(fields=['updated_at'], name='purchase_updated_idx'),
+            models.Index(fields=['expires_at'], name='purchase_expires_idx'),
         ]
 
     def __str__(self):
         return f"用户ID:{self.user_id} - {self.product_id} - {'成功' if self.is_successful else '处理中'}"
 
+    # 交易已存在时更新的字段；notification_type 由通知处理追加。
+    # 不包含 user_id：交易的归属在第一次写入时确定，其他账号提交同一收据不会转移已有的交易
+    UPSERT_FIELDS = [
+        'app_id', 'product_id', 'original_transaction_id', 'purchase_date', 'expires_at',
+        'is_active', 'is_successful', 'status', 'notes', 'updated_at',
+    ]
+
+    @classmethod
+    def upsert_transactions(cls, purchases, update_fields=None):
+        """
+        一条 INSERT ... ON CONFLICT (transaction_id) DO UPDATE 写入一批交易
+
+        不先查询再写入，并发的收据验证和通知处理不会互相覆盖读到的旧值。
+        同一批中重复的交易只保留最后一笔（同一条语句不能两次更新同一行）。
+
+        Args:
+            purchases: 未保存的 Purchase 实例列表
+            update_fields: 交易已存在时更新的字段，默认为 UPSERT_FIELDS
+        """
+        unique = {purchase.transaction_id: purchase for purchase in purchases if purchase.transaction_id}
+        return cls.objects.bulk_create(
+            list(unique.values()),
+            update_conflicts=True,
+            unique_fields=['transaction_id'],
+            update_fields=update_fields or cls.UPSERT_FIELDS
+        )
+
     @classmethod
-    def verify_receipt(cls, receipt_data, sandbox=settings.SANDBOX, app_id='pocket_ai'):
+    def verify_receipt(cls, receipt_data, sandbox=settings.SANDBOX, app_id='pocket_ai', original_transaction_id=None):
         """
         验证苹果收据
 
         Args:
             receipt_data: 苹果收据数据
-            sandbox: 是否使用沙盒环境
+            sandbox: 没有环境记忆时是否先使用沙盒环境
             app_id: 应用ID，用于获取对应的共享密钥
+            original_transaction_id: 之前验证这份收据时响应中的原始交易ID（已知时），用于直接发往该订阅所在的环境
 
         Returns:
             dict: 验证结果
         """
         try:
-            # 根据环境选择验证URL
-            if sandbox:
-                verify_url = 'https://sandbox.itunes.apple.com/verifyReceipt'
-            else:
-                verify_url = 'https://buy.itunes.apple.com/verifyReceipt'
+            from purchase.verifier import PRODUCTION, SANDBOX, receipt_verifier
 
             # 获取应用配置
             shared_secret = None
             if app_id:
                 try:
-                    config = AppleAppConfiguration.objects.get(name=app_id)
+                    config = app_registry.get(app_id)
                     shared_secret = config.shared_secret
                 except AppleAppConfiguration.DoesNotExist:
                     logger.error(f"找不到应用 {app_id} 的配置")
@@ -113,41 +143,29 @@ class Purchase(models.Model):
                 'include-history': True  # 确保包含历史记录
             }
 
-            # 发送验证请求
-            response = requests.post(
-                verify_url,
-                data=json.dumps(request_data),
-                headers={'Content-Type': 'application/json'},
-                timeout=30  # 设置超时时间
+            # 发送验证请求，21007/21008 时由验证器换到另一个环境重新验证
+            return receipt_verifier.verify(
+                request_data,
+                app_id=app_id,
+                original_transaction_id=original_transaction_id,
+                default_environment=SANDBOX if sandbox else PRODUCTION
             )
-
-            # 解析响应
-            result = response.json()
-
-            # 如果状态码为21007，表示这是沙盒收据，需要使用沙盒环境重新验证
-            if result.get('status') == 21007 and not sandbox:
-                return cls.verify_receipt(receipt_data, sandbox=True, app_id=app_id)
-
-            # 如果状态码为21008，表示这是正式环境收据，需要使用正式环境重新验证
-            if result.get('status') == 21008 and sandbox:
-                return cls.verify_receipt(receipt_data, sandbox=False, app_id=app_id)
-
-            return result
         except Exception as e:
             logger.error(f"收据验证错误: {str(e)}")
             return {'status': -1, 'error': str(e)}
 
     @classmethod
-    def process_verification_result(cls, verification_result, user_id):
+    def process_verification_result(cls, verification_result, user_id, app_id='pocket_ai'):
         """
-        处理验证结果，创建或更新购买记录
+        处理验证结果，一次写入收据中的全部交易
 
         Args:
             verification_result: 验证结果
             user_id: 用户ID
+            app_id: 应用ID
 
         Returns:
-            Purchase: 创建或更新的购买记录
+            Purchase: 最新一笔交易的购买记录
         """
         try:
             if verification_result.get('status') != 0:
@@ -157,56 +175,63 @@ class Purchase(models.Model):
             receipt = verification_result.get('receipt', {})
             latest_receipt_info = verification_result.get('latest_receipt_info', [])
 
-            # 如果有latest_receipt_info，使用最新的一条
+            # 优先使用 latest_receipt_info（已按到期时间排序，最后一条为最新交易）
             if latest_receipt_info and isinstance(latest_receipt_info, list):
-                transaction = latest_receipt_info[-1]
-            # 否则使用receipt中的in_app最新的一条
+                transactions = latest_receipt_info
+            # 否则使用receipt中的in_app
             elif 'in_app' in receipt and receipt['in_app']:
-                transaction = receipt['in_app'][-1]
+                transactions = receipt['in_app']
             else:
                 logger.error("No transaction found in verification result")
                 return None
 
-            # 提取交易信息
-            transaction_id = transaction.get('transaction_id')
-            original_transaction_id = transaction.get('original_transaction_id')
-            product_id = transaction.get('product_id')
-            purchase_date_ms = int(transaction.get('purchase_date_ms', 0))
-            expires_date_ms = int(transaction.get('expires_date_ms', 0)) if 'expires_date_ms' in transaction else None
-
             from django.utils import timezone
             import datetime
 
-            # 转换时间戳为datetime对象
-            purchase_date = timezone.make_aware(
-                datetime.datetime.fromtimestamp(purchase_date_ms / 1000)
-            )
+            def to_datetime(ms):
+                # 转换时间戳为datetime对象
+                return timezone.make_aware(datetime.datetime.fromtimestamp(int(ms) / 1000)) if ms else None
 
-            expires_at = None
-            if expires_date_ms:
-                expires_at = timezone.make_aware(
-                    datetime.datetime.fromtimestamp(expires_date_ms / 1000)
+            # 同一订阅（原始交易ID）已归属其他用户时，续订的新交易也归属原用户，不转移给提交收据的用户
+            owners = dict(
+                cls.objects.filter(
+                    original_transaction_id__in={transaction.get('original_transaction_id') for transaction in transactions}
+                ).exclude(user_id=user_id).values_list('original_transaction_id', 'user_id')
+            )
+            if owners:
+                logger.warning(f"用户 {user_id} 提交的收据中的订阅已归属其他用户: {owners}，不转移归属")
+
+            purchases = [
+                cls(
+                    user_id=owners.get(transaction.get('original_transaction_id'), user_id),
+                    app_id=app_id,
+                    product_id=transaction.get('product_id'),
+                    transaction_id=transaction.get('transaction_id'),
+                    original_transaction_id=transaction.get('original_transaction_id'),
+                    purchase_date=to_datetime(transaction.get('purchase_date_ms')) or timezone.now(),
+                    expires_at=to_datetime(transaction.get('expires_date_ms')),
+                    # 退款或撤销的交易带有 cancellation_date_ms
+                    is_active=not transaction.get('cancellation_date_ms'),
+                    is_successful=True,
+                    status='success',
+                    notes=f"验证成功记录"
                 )
-
-            # 检查是否已存在该交易
-            purchase, created = cls.objects.update_or_create(
-                transaction_id=transaction_id,
-                defaults={
-                    'user_id': user_id,
-                    'app_id': 'pocket_ai',
-                    'product_id': product_id,
-                    'original_transaction_id': original_transaction_id,
-                    'receipt_data': verification_result.get('latest_receipt', verification_result.get('receipt-data')),
-                    'purchase_date': purchase_date,
-                    'expires_at': expires_at,
-                    'is_active': True,
-                    'is_successful': True,
-                    'status': 'success',
-                    'notes': f"验证成功记录"
-                }
+                for transaction in transactions
+            ]
+            cls.upsert_transactions(purchases)
+
+            # 在收据验证之前到达、因找不到用户而等待的通知重新处理
+            from purchase.webhooks import replay_waiting_notifications
+            replay_waiting_notifications({purchase.original_transaction_id for purchase in purchases})
+
+            # 收据只保存在最新的交易上
+            latest = purchases[-1]
+            PurchaseBlob.store(
+                latest.transaction_id, 'receipt',
+                verification_result.get('latest_receipt', verification_result.get('receipt-data'))
             )
 
-            return purchase
+            return cls.objects.get(transaction_id=latest.transaction_id)
         except Exception as e:
             logger.error(f"Process verification result error: {str(e)}")
             return None
@@ -218,88 +243,75 @@ class Purchase(models.Model):
 
         Args:
             notification_data: 通知数据
-        """
-        try:
-            notification_type = notification_data.get('notificationType')
-            subtype = notification_data.get('subtype')
-            data = notification_data.get('data', {})
-            bundle_id = data.get('bundleId')
-            environment = data.get('environment', 'Production')
-
-            logger.error(
-                f"收到苹果通知V2: 类型={notification_type}, 子类型={subtype}, 应用={bundle_id}, 环境={environment}")
-
-            # 获取交易信息
-            transaction_info = data.get('transactionInfo', {})
-            renewal_info = data.get('renewalInfo', {})
-
-            if not transaction_info:
-                logger.error("通知中缺少交易信息")
-                return
-
-            # 提取交易信息
-            transaction_id = transaction_info.get('transactionId')
-            original_transaction_id = transaction_info.get('originalTransactionId')
-            product_id = transaction_info.get('productId')
-            purchase_date_ms = transaction_info.get('purchaseDate')
-            expires_date_ms = transaction_info.get('expiresDate')
 
-            from django.utils import timezone
-            import datetime
-
-            # 转换时间戳为datetime对象
-            if purchase_date_ms:
-                purchase_date = timezone.make_aware(
-                    datetime.datetime.fromtimestamp(purchase_date_ms / 1000)
-                )
-            else:
-                purchase_date = timezone.now()
+        Returns:
+            bool: 通知是否已处理；找不到交易对应的用户时返回 False，由调用方稍后重试
+                （用户可能尚未上传收据）。处理出错时直接抛出异常，由调用方决定是否重试
+        """
+        notification_type = notification_data.get('notificationType')
+        subtype = notification_data.get('subtype')
+        data = notification_data.get('data', {})
+        bundle_id = data.get('bundleId')
+        environment = data.get('environment', 'Production')
+
+        logger.error(
+            f"收到苹果通知V2: 类型={notification_type}, 子类型={subtype}, 应用={bundle_id}, 环境={environment}")
+
+        # 获取交易信息
+        transaction_info = data.get('transactionInfo', {})
+        renewal_info = data.get('renewalInfo', {})
+
+        if not transaction_info:
+            # 测试通知等不涉及交易的通知无需处理
+            logger.error("通知中缺少交易信息")
+            return True
+
+        # 提取交易信息
+        transaction_id = transaction_info.get('transactionId')
+        original_transaction_id = transaction_info.get('originalTransactionId')
+        product_id = transaction_info.get('productId')
+        purchase_date_ms = transaction_info.get('purchaseDate')
+        expires_date_ms = transaction_info.get('expiresDate')
+
+        from django.utils import timezone
+        import datetime
+
+        # 转换时间戳为datetime对象
+        if purchase_date_ms:
+            purchase_date = timezone.make_aware(
+                datetime.datetime.fromtimestamp(purchase_date_ms / 1000)
+            )
+        else:
+            purchase_date = timezone.now()
 
-            if expires_date_ms:
-                expires_at = timezone.make_aware(
-                    datetime.datetime.fromtimestamp(expires_date_ms / 1000)
-                )
+        if expires_date_ms:
+            expires_at = timezone.make_aware(
+                datetime.datetime.fromtimestamp(expires_date_ms / 1000)
+            )
+        else:
+            # 如果没有过期时间，设置为购买时间后的一年
+            expires_at = purchase_date + datetime.timedelta(days=365)
+
+        # 根据通知类型确定购买状态
+        is_active = True
+        status = 'success'
+        notes = f"通知类型: {notification_type}"
+        if subtype:
+            notes += f", 子类型: {subtype}"
+
+        # 处理不同类型的通知
+        if notification_type == 'SUBSCRIBED':
+            # 新订阅
+            notes += ", 用户新订阅"
+
+        elif notification_type == 'DID_CHANGE_RENEWAL_STATUS':
+            # 订阅状态更改
+            auto_renew_status = renewal_info.get('autoRenewStatus')
+            if auto_renew_status == 1:
+                notes += ", 用户开启了自动续订"
             else:
-                # 如果没有过期时间，设置为购买时间后的一年
-                expires_at = purchase_date + datetime.timedelta(days=365)
-
-            # 根据通知类型确定购买状态
-            is_active = True
-            status = 'success'
-            notes = f"通知类型: {notification_type}"
-            if subtype:
-                notes += f", 子类型: {subtype}"
-
-            # 处理不同类型的通知
-            if notification_type == 'SUBSCRIBED':
-                # 新订阅
-                notes += ", 用户新订阅"
-
-            elif notification_type == 'DID_CHANGE_RENEWAL_STATUS':
-                # 订阅状态更改
-                auto_renew_status = renewal_info.get('autoRenewStatus')
-                if auto_renew_status == 1:
-                    notes += ", 用户开启了自动续订"
-                else:
-                    notes += ", 用户关闭了自动续订"
-                    # 注意：关闭自动续订不影响当前订阅的有效性，只是到期后不再续订
-                    # 检查是否已过期
-                    if expires_at and expires_at < timezone.now():
-                        is_active = False
-                        status = 'failed'
-                        notes += ", 订阅已过期"
-                    else:
-                        notes += ", 但当前订阅仍然有效至到期日"
-
-            elif notification_type == 'DID_RENEW':
-                # 订阅自动续订成功
-                is_active = True
-                status = 'success'
-                notes += ", 订阅自动续订成功"
-
-            elif notification_type == 'DID_FAIL_TO_RENEW':
-                # 由于账单问题未能续订
-                notes += ", 由于账单问题未能续订"
+                notes += ", 用户关闭了自动续订"
+                # 注意：关闭自动续订不影响当前订阅的有效性，只是到期后不再续订
                 # 检查是否已过期
                 if expires_at and expires_at < timezone.now():
                     is_active = False
@@ -308,133 +320,124 @@ class Purchase(models.Model):
                 else:
                     notes += ", 但当前订阅仍然有效至到期日"
 
-            elif notification_type == 'EXPIRED':
-                # 订阅已过期
+        elif notification_type == 'DID_RENEW':
+            # 订阅自动续订成功
+            is_active = True
+            status = 'success'
+            notes += ", 订阅自动续订成功"
+
+        elif notification_type == 'DID_FAIL_TO_RENEW':
+            # 由于账单问题未能续订
+            notes += ", 由于账单问题未能续订"
+            # 检查是否已过期
+            if expires_at and expires_at < timezone.now():
                 is_active = False
                 status = 'failed'
                 notes += ", 订阅已过期"
-
-            elif notification_type == 'GRACE_PERIOD':
-                # 宽限期
-                notes += ", 订阅进入宽限期"
-                # 宽限期内订阅仍然有效
-
-            elif notification_type == 'PRICE_INCREASE':
-                # 价格上涨
-                notes += ", 订阅价格上涨"
-
-            elif notification_type == 'REFUND':
-                # 退款
+            else:
+                notes += ", 但当前订阅仍然有效至到期日"
+
+        elif notification_type == 'EXPIRED':
+            # 订阅已过期
+            is_active = False
+            status = 'failed'
+            notes += ", 订阅已过期"
+
+        elif notification_type == 'GRACE_PERIOD':
+            # 宽限期
+            notes += ", 订阅进入宽限期"
+            # 宽限期内订阅仍然有效
+
+        elif notification_type == 'PRICE_INCREASE':
+            # 价格上涨
+            notes += ", 订阅价格上涨"
+
+        elif notification_type == 'REFUND':
+            # 退款
+            is_active = False
+            status = 'failed'
+            notes += ", 退款成功，订阅已失效"
+            # 退款通常会立即使订阅失效
+
+        elif notification_type == 'REVOKE':
+            # 撤销
+            notes += ", 订阅被撤销"
+            # 检查是否已过期
+            if expires_at and expires_at < timezone.now():
                 is_active = False
                 status = 'failed'
-                notes += ", 退款成功，订阅已失效"
-                # 退款通常会立即使订阅失效
-
-            elif notification_type == 'REVOKE':
-                # 撤销
-                notes += ", 订阅被撤销"
-                # 检查是否已过期
-                if expires_at and expires_at < timezone.now():
-                    is_active = False
-                    status = 'failed'
-                    notes += ", 订阅已过期"
-                else:
-                    notes += ", 但当前订阅仍然有效至到期日"
-
-            # 查找用户ID
-            # 首先尝试通过original_transaction_id查找
-            existing_purchase = Purchase.objects.filter(
-                original_transaction_id=original_transaction_id
-            ).first()
-
-            user_id = None
-            if existing_purchase:
-                user_id = existing_purchase.user_id
-
-            if not user_id:
-                # 如果找不到用户ID，记录错误并跳过
-                logger.error(f"无法找到交易 {transaction_id} 的用户ID")
-                return
-
-            # 更新或创建购买记录
-            purchase, created = Purchase.objects.update_or_create(
-                transaction_id=transaction_id,
-                defaults={
-                    'user_id': user_id,
-                    'app_id': bundle_id,
-                    'product_id': product_id,
-                    'original_transaction_id': original_transaction_id,
-                    'receipt_data': json.dumps(notification_data),  # 存储完整的通知数据
-                    'purchase_date': purchase_date,
-                    'expires_at': expires_at,
-                    'is_active': is_active,
-                    'is_successful': status == 'success',
-                    'status': status,
-                    'notification_type': notification_type,
-                    'notes': notes
-                }
-            )
-
-            logger.info(
-                f"处理通知: 类型={notification_type}, 用户ID={user_id}, 产品={product_id}, 状态={status}, 到期时间={expires_at}")
-
-            # 更新用户权限
-            Purchase.update_user_privileges(user_id, purchase)
-
-        except Exception as e:
-            logger.exception(f"处理通知时出错: {str(e)}")
+                notes += ", 订阅已过期"
+            else:
+                notes += ", 但当前订阅仍然有效至到期日"
+
+        # 查找用户ID
+        # 首先尝试通过original_transaction_id查找
+        existing_purchase = Purchase.objects.filter(
+            original_transaction_id=original_transaction_id
+        ).first()
+
+        user_id = None
+        if existing_purchase:
+            user_id = existing_purchase.user_id
+
+        if not user_id:
+            # 如果找不到用户ID，记录错误，由调用方稍后重试
+            logger.error(f"无法找到交易 {transaction_id} 的用户ID")
+            return False
+
+        # 更新或创建购买记录
+        purchase = Purchase(
+            user_id=user_id,
+            app_id=bundle_id,
+            product_id=product_id,
+            transaction_id=transaction_id,
+            original_transaction_id=original_transaction_id,
+            purchase_date=purchase_date,
+            expires_at=expires_at,
+            is_active=is_active,
+            is_successful=status == 'success',
+            status=status,
+            notification_type=notification_type,
+            notes=notes
+        )
+        Purchase.upsert_transactions(
+            [purchase],
+            update_fields=Purchase.UPSERT_FIELDS + ['notification_type']
+        )
+        # 存储完整的通知数据
+        PurchaseBlob.store(transaction_id, 'notification', json.dumps(notification_data))
+
+        logger.info(
+            f"处理通知: 类型={notification_type}, 用户ID={user_id}, 产品={product_id}, 状态={status}, 到期时间={expires_at}")
+
+        # 更新用户权限
+        Purchase.update_user_privileges(user_id, purchase)
+        return True
 
     @classmethod
     def update_user_privileges(cls, user_id, purchase):
         """根据购买记录更新用户权限"""
         try:
-            from django.utils import timezone
-
-            # 获取用户所有有效的订阅，按产品分组
-            active_subscriptions = {}
+            from purchase.expiry import schedule_entitlement_expiries
+            from purchase.services import PurchaseService
 
-            # 查询用户所有有效的订阅
-            all_subscriptions = cls.objects.filter(
-                user_id=user_id,
-                is_active=True,
-                is_successful=True,
-                expires_at__gt=timezone.now()
-            )
+            # 一条查询得到用户当前的会员状态（最晚到期的有效订阅）
+            entitlement = PurchaseService.get_entitlements([user_id])[user_id]
 
-            # 按产品分组，找出每个产品的最新到期时间
-            for sub in all_subscriptions:
-                product_id = sub.product_id
-                if product_id not in active_subscriptions or sub.expires_at > active_subscriptions[
-                    product_id].expires_at:
-                    active_subscriptions[product_id] = sub
-
-            # 检查用户是否有任何有效订阅
-            has_active_subscription = bool(active_subscriptions)
-
-            # 如果有有效订阅，使用最晚的到期时间
-            latest_expires_at = None
-            if has_active_subscription:
-                # 找出最晚的到期时间
-                for product_id, sub in active_subscriptions.items():
-                    if latest_expires_at is None or sub.expires_at > latest_expires_at:
-                        latest_expires_at = sub.expires_at
-
-                logger.error(f"用户 {user_id} 有有效订阅，最晚到期时间: {latest_expires_at}")
-
-                # 更新用户会员状态为有效
-                UserService.update_premium_status(
-                    user_id=user_id,
-                    is_premium=True,
-                    expires_at=latest_expires_at
-                )
+            if entitlement['is_premium']:
+                logger.error(f"用户 {user_id} 有有效订阅，最晚到期时间: {entitlement['expires_at']}")
             else:
                 logger.error(f"用户 {user_id} 没有有效订阅，取消会员状态")
 
-                # 更新用户会员状态为无效
-                UserService.update_premium_status(
-                    user_id=user_id,
-                    is_premium=False
-                )
+            # 记录待推送的会员状态，随当前事务提交后由后台任务推送给用户中心
+            UserService.enqueue_premium_status(
+                user_id=user_id,
+                is_premium=entitlement['is_premium'],
+                app_id=entitlement['app_id'],
+                expires_at=entitlement['expires_at']
+            )
+            # 续订、退款后按新的到期时间登记或移除到期定时器
+            schedule_entitlement_expiries({user_id: entitlement})
 
         except Exception as e:
             logger.exception(f"更新用户权限时出错: {str(e)}")
@@ -459,4 +462,156 @@ class Purchase(models.Model):
             # ... 原有的处理逻辑 ...
 
         except Exception as e:
-            logger.exception(f"处理旧版通知时出错: {str(e)}")
\ No newline at end of file
+            logger.exception(f"处理旧版通知时出错: {str(e)}")
+
+
+class PurchaseBlob(models.Model):
+    """
+    交易的原始数据（收据或通知内容），压缩后单独存放
+
+    购买记录的列表、权益计算等热点查询只读取 Purchase，不会加载这些大字段。
+    """
+
+    KIND_CHOICES = [
+        ('receipt', '收据'),
+        ('notification', '通知'),
+    ]
+
+    purchase = models.OneToOneField(
+        Purchase, on_delete=models.CASCADE, primary_key=True, to_field='transaction_id',
+        db_column='transaction_id', related_name='blob', verbose_name='购买记录'
+    )
+    kind = models.CharField('类型', max_length=20, choices=KIND_CHOICES)
+    data = models.BinaryField('压缩数据')
+    updated_at = models.DateTimeField(_('更新时间'), auto_now=True)
+
+    class Meta:
+        verbose_name = '交易原始数据'
+        verbose_name_plural = verbose_name
+
+    def __str__(self):
+        return f"{self.purchase_id} - {self.get_kind_display()}"
+
+    @staticmethod
+    def compress(text):
+        return zlib.compress(text.encode('utf-8'))
+
+    @property
+    def text(self):
+        return zlib.decompress(self.data).decode('utf-8')
+
+    @classmethod
+    def store(cls, transaction_id, kind, text):
+        """一条 INSERT ... ON CONFLICT 写入或替换交易的原始数据"""
+        if not transaction_id or not text:
+            return
+        cls.objects.bulk_create(
+            [cls(purchase_id=transaction_id, kind=kind, data=cls.compress(text))],
+            update_conflicts=True,
+            unique_fields=['purchase'],
+            update_fields=['kind', 'data', 'updated_at']
+        )
+
+
+class SyncCursor(models.Model):
+    """增量任务的水位线，记录上一次成功处理到的时间"""
+
+    name = models.CharField('任务', max_length=100, unique=True)
+    value = models.DateTimeField('水位时间')
+    updated_at = models.DateTimeField(_('更新时间'), auto_now=True)
+
+    class Meta:
+        verbose_name = '同步水位'
+        verbose_name_plural = verbose_name
+
+    def __str__(self):
+        return f"{self.name}: {self.value}"
+
+
+class PremiumState(models.Model):
+    """最近一次推送给用户中心的会员状态，只有计算结果变化时才需要再次推送"""
+
+    user_id = models.IntegerField('用户ID', unique=True, help_text='UserCenter的用户ID')
+    is_premium = models.BooleanField('是否会员', default=False)
+    expires_at = models.DateTimeField('到期时间', null=True, blank=True)
+    app_id = models.CharField('应用', max_length=255, blank=True, null=True)
+    synced = models.BooleanField('已推送', default=False, help_text='推送失败时为 False，下次同步时重试')
+    updated_at = models.DateTimeField(_('更新时间'), auto_now=True)
+
+    class Meta:
+        verbose_name = '会员状态'
+        verbose_name_plural = verbose_name
+        indexes = [
+            models.Index(fields=['user_id'], name='premium_state_unsynced_idx',
+                         condition=models.Q(synced=False)),
+        ]
+
+    def __str__(self):
+        return f"用户ID:{self.user_id} - {'会员' if self.is_premium else '非会员'}"
+
+
+class PremiumStatusOutbox(models.Model):
+    """
+    待推送给用户中心的会员状态
+
+    每个用户只保留一行，多次变化合并为最新状态，由后台任务批量推送，失败后退避重试。
+    """
+
+    user_id = models.IntegerField('用户ID', unique=True, help_text='UserCenter的用户ID')
+    is_premium = models.BooleanField('是否会员', default=False)
+    expires_at = models.DateTimeField('到期时间', null=True, blank=True)
+    app_id = models.CharField('应用', max_length=255, blank=True, null=True)
+    attempts = models.IntegerField('已尝试次数', default=0)
+    next_attempt_at = models.DateTimeField('下次推送时间', db_index=True)
+    last_error = models.TextField('上次失败原因', blank=True, null=True)
+    created_at = models.DateTimeField(_('创建时间'), auto_now_add=True)
+    updated_at = models.DateTimeField(_('更新时间'), auto_now=True)
+
+    class Meta:
+        verbose_name = '会员状态推送队列'
+        verbose_name_plural = verbose_name
+        ordering = ['next_attempt_at']
+
+    def __str__(self):
+        return f"用户ID:{self.user_id} - {'会员' if self.is_premium else '非会员'} (第 {self.attempts} 次)"
+
+
+class WebhookInbox(models.Model):
+    """收到的苹果服务器通知，按 notificationUUID 去重，由后台任务解码并处理"""
+
+    STATUS_CHOICES = [
+        ('pending', '待处理'),
+        ('processing', '处理中'),
+        ('done', '已处理'),
+        ('failed', '处理失败'),
+        ('invalid', '无效通知'),
+        ('waiting', '等待购买记录'),
+    ]
+
+    notification_uuid = models.CharField('通知UUID', max_length=64, unique=True)
+    notification_type = models.CharField('通知类型', max_length=64, blank=True, null=True)
+    signed_payload = models.TextField('原始载荷')
+    status = models.CharField('状态', max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.IntegerField('已尝试次数', default=0)
+    last_error = models.TextField('上次失败原因', blank=True, null=True)
+    # 交易还没有对应的用户时记录原始交易ID，该交易的收据验证后重新处理
+    original_transaction_id = models.CharField('原始交易ID', max_length=255, blank=True, null=True)
+    received_at = models.DateTimeField('接收时间', auto_now_add=True)
+    claimed_at = models.DateTimeField('开始处理时间', null=True, blank=True)
+    processed_at = models.DateTimeField('处理完成时间', null=True, blank=True)
+
+    class Meta:
+        verbose_name = '苹果通知收件箱'
+        verbose_name_plural = verbose_name
+        ordering = ['-received_at']
+        indexes = [
+            # 补偿任务查找未处理完成的通知
+            models.Index(fields=['received_at'], name='webhook_inbox_unfinished_idx',
+                         condition=models.Q(status__in=['pending', 'processing', 'failed'])),
+            # 收据验证后按原始交易ID查找等待中的通知
+            models.Index(fields=['original_transaction_id'], name='webhook_inbox_waiting_idx',
+                         condition=models.Q(status='waiting')),
+        ]
+
+    def __str__(self):
+        return f"{self.notification_uuid} - {self.notification_type} - {self.get_status_display()}"
@@ -0,0 +1,221 @@
+"""
+会员状态推送队列（outbox）
+
+会员状态变化时只在数据库中记录需要推送的最新状态，与购买记录在同一事务中提交，
+请求本身不再同步调用用户中心。后台任务批量取出到期的记录推送：
+
+- 合并：每个用户只有一行，推送前的多次变化只推送最后一次；
+- 批量：同一应用的用户通过用户中心的批量接口一次推送，批量接口不可用时逐个推送（复用连接池）；
+- 重试：失败后按指数退避重试，超过最大次数后放弃，并标记 PremiumState 未同步，由定时同步兜底。
+
+推送期间状态又发生变化时，记录的 updated_at 会变化，推送结果只作用于推送时取出的版本，
+新的状态保留在队列中下一轮继续推送。
+"""
+import logging
+from collections import defaultdict
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from purchase.models import PremiumState, PremiumStatusOutbox
+from purchase.services import UserService
+
+logger = logging.getLogger(__name__)
+
+# 取出后的占用时间（秒），推送进程崩溃时超过该时间由其他进程重新推送
+CLAIM_TIMEOUT = 5 * 60
+# 重试退避：30 秒起每次翻倍，最长 1 小时
+RETRY_BASE_DELAY = 30
+RETRY_MAX_DELAY = 60 * 60
+# 批量接口返回 404/405 后多久内不再尝试（秒）
+BULK_UNAVAILABLE_TTL = 10 * 60
+
+DEFAULT_APP_ID = 'pocket_ai'
+
+_bulk_unavailable_until = None
+
+
+def enqueue_premium_statuses(statuses, flush=True):
+    """
+    记录一批用户需要推送的会员状态，已在队列中的用户合并为最新状态并立即到期
+
+    Args:
+        statuses: {user_id: {'is_premium', 'expires_at', 'app_id'}}
+        flush: 事务提交后是否立即触发一次推送任务
+
+    Returns:
+        int: 写入的用户数
+    """
+    if not statuses:
+        return 0
+
+    now = timezone.now()
+    PremiumStatusOutbox.objects.bulk_create(
+        [
+            PremiumStatusOutbox(
+                user_id=user_id,
+                is_premium=status['is_premium'],
+                expires_at=status.get('expires_at'),
+                app_id=status.get('app_id'),
+                attempts=0,
+                next_attempt_at=now,
+                last_error=None
+            )
+            for user_id, status in statuses.items()
+        ],
+        update_conflicts=True,
+        unique_fields=['user_id'],
+        update_fields=['is_premium', 'expires_at', 'app_id', 'attempts', 'next_attempt_at',
+                       'last_error', 'updated_at'],
+        batch_size=500
+    )
+
+    if flush:
+        from purchase.tasks import flush_premium_status_outbox
+        transaction.on_commit(lambda: flush_premium_status_outbox.delay())
+    return len(statuses)
+
+
+def _claim(batch_size):
+    """取出一批到期的记录，并把下次推送时间推后，避免被其他进程重复取出"""
+    now = timezone.now()
+    with transaction.atomic():
+        rows = list(
+            PremiumStatusOutbox.objects.select_for_update(skip_locked=True)
+            .filter(next_attempt_at__lte=now)
+            .order_by('next_attempt_at')[:batch_size]
+        )
+        # update() 不会刷新 updated_at，推送结果仍按取出时的版本匹配
+        PremiumStatusOutbox.objects.filter(pk__in=[row.pk for row in rows]).update(
+            next_attempt_at=now + timedelta(seconds=CLAIM_TIMEOUT)
+        )
+    return rows
+
+
+def _push_group(app_id, rows):
+    """
+    推送同一应用的一批记录
+
+    Returns:
+        tuple: (成功的用户ID集合, 失败原因)
+    """
+    global _bulk_unavailable_until
+
+    now = timezone.now()
+    if _bulk_unavailable_until is None or _bulk_unavailable_until <= now:
+        try:
+            pushed = UserService.bulk_update_premium_status(
+                [{'user_id': row.user_id, 'is_premium': row.is_premium, 'expires_at': row.expires_at}
+                 for row in rows],
+                app_id=app_id
+            )
+        except requests.RequestException as e:
+            logger.error(f"批量推送 {len(rows)} 个用户的会员状态失败: {str(e)}")
+            return set(), str(e)
+
+        if pushed is not None:
+            return pushed, '用户中心未能更新该用户'
+
+        logger.warning(f"用户中心不支持批量更新会员状态，{BULK_UNAVAILABLE_TTL} 秒内改为逐个推送")
+        _bulk_unavailable_until = now + timedelta(seconds=BULK_UNAVAILABLE_TTL)
+
+    pushed = {
+        row.user_id for row in rows
+        if UserService.update_premium_status(
+            user_id=row.user_id,
+            is_premium=row.is_premium,
+            app_id=app_id,
+            expires_at=row.expires_at
+        )
+    }
+    return pushed, '推送失败'
+
+
+def _retry_delay(attempts):
+    return min(RETRY_BASE_DELAY * 2 ** (attempts - 1), RETRY_MAX_DELAY)
+
+
+def _record_results(rows, pushed, error, max_attempts):
+    """成功的记录出队并标记已同步，失败的记录退避重试或放弃"""
+    now = timezone.now()
+    with transaction.atomic():
+        # 锁定仍是推送时取出版本的记录，期间被新状态覆盖的记录保留在队列中
+        current = set(
+            PremiumStatusOutbox.objects.select_for_update()
+            .filter(pk__in=[row.pk for row in rows])
+            .values_list('pk', 'updated_at')
+        )
+        rows = [row for row in rows if (row.pk, row.updated_at) in current]
+
+        finished, retries, synced_states = [], defaultdict(list), []
+        for row in rows:
+            state = PremiumState(user_id=row.user_id, is_premium=row.is_premium,
+                                 expires_at=row.expires_at, app_id=row.app_id)
+            if row.user_id in pushed:
+                state.synced = True
+            elif row.attempts + 1 >= max_attempts:
+                logger.error(f"推送用户 {row.user_id} 的会员状态失败 {row.attempts + 1} 次，放弃推送: {error}")
+                state.synced = False
+            else:
+                retries[row.attempts + 1].append(row.pk)
+                continue
+            finished.append(row.pk)
+            synced_states.append(state)
+
+        if finished:
+            PremiumStatusOutbox.objects.filter(pk__in=finished).delete()
+        # 同一尝试次数的记录退避时间相同，一条 UPDATE 处理
+        for attempts, pks in retries.items():
+            PremiumStatusOutbox.objects.filter(pk__in=pks).update(
+                attempts=attempts,
+                next_attempt_at=now + timedelta(seconds=_retry_delay(attempts)),
+                last_error=error
+            )
+
+        PremiumState.objects.bulk_create(
+            synced_states,
+            update_conflicts=True,
+            unique_fields=['user_id'],
+            update_fields=['is_premium', 'expires_at', 'app_id', 'synced', 'updated_at'],
+            batch_size=500
+        )
+
+
+def flush_premium_outbox(batch_size=None, max_attempts=None):
+    """
+    推送队列中所有到期的会员状态
+
+    Returns:
+        int: 推送成功的用户数
+    """
+    batch_size = batch_size or settings.PREMIUM_OUTBOX_BATCH_SIZE
+    max_attempts = max_attempts or settings.PREMIUM_OUTBOX_MAX_ATTEMPTS
+
+    pushed_total = 0
+    while True:
+        rows = _claim(batch_size)
+        if not rows:
+            break
+
+        groups = defaultdict(list)
+        for row in rows:
+            groups[row.app_id or DEFAULT_APP_ID].append(row)
+
+        for app_id, group in groups.items():
+            try:
+                pushed, error = _push_group(app_id, group)
+            except Exception as e:
+                logger.exception(f"推送会员状态时出错: {str(e)}")
+                pushed, error = set(), str(e)
+            _record_results(group, pushed, error, max_attempts)
+            pushed_total += len(pushed)
+
+        if len(rows) < batch_size:
+            break
+
+    if pushed_total:
+        logger.info(f"推送会员状态完成: 成功 {pushed_total} 个用户")
+    return pushed_total
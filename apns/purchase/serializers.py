@@ -7,7 +7,10 @@ class PurchaseSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Purchase
-        fields = '__all__'
+        # 显式列出字段，交易的原始数据（PurchaseBlob）不随购买记录返回
+        fields = ('id', 'user_id', 'app_id', 'product_id', 'transaction_id', 'original_transaction_id',
+                  'purchase_date', 'expires_at', 'is_active', 'is_successful', 'status',
+                  'notification_type', 'notes', 'created_at', 'updated_at')
         read_only_fields = ('created_at', 'updated_at')
 
 
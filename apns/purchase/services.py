@@ -1,11 +1,35 @@
+import hashlib
 import logging
 from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
 import requests
 import datetime
+from requests.adapters import HTTPAdapter
 from configurations.models import AppleAppConfiguration
+from configurations.registry import app_registry
 
 logger = logging.getLogger(__name__)
 
+RECEIPT_CACHE_PREFIX = 'apns:receipt'
+
+
+def _receipt_cache_key(receipt_data, app_id):
+    """收据内容较大，按 (收据, 应用) 的摘要作为缓存键"""
+    digest = hashlib.sha256(f'{app_id}\0{receipt_data}'.encode()).hexdigest()
+    return f'{RECEIPT_CACHE_PREFIX}:{digest}'
+
+
+def _receipt_cache_ttl(expires_at):
+    """
+    缓存到收据中最新交易的到期时间：到期前同一收据的验证结果不会变化，
+    到期后可能出现续订交易，需要重新向苹果验证。已到期的收据只短暂缓存，吸收客户端的重试。
+    """
+    if expires_at is None:
+        return settings.RECEIPT_CACHE_MAX_TTL
+    remaining = int((expires_at - timezone.now()).total_seconds())
+    return max(min(remaining, settings.RECEIPT_CACHE_MAX_TTL), settings.RECEIPT_CACHE_EXPIRED_TTL)
+
 
 class PurchaseService:
     """购买服务类，处理与购买相关的业务逻辑"""
@@ -28,8 +52,24 @@ class PurchaseService:
             # 避免循环导入
             from purchase.models import Purchase
 
+            # 同一收据在缓存有效期内已验证过，且最新交易已为该用户记录时，直接返回本地记录；
+            # 交易之后被退款、撤销或过期（通知已将记录标记为无效）时重新向苹果验证
+            cache_key = _receipt_cache_key(receipt_data, app_id)
+            cached = cache.get(cache_key)
+            if cached and cached['user_id'] == user_id:
+                purchase = Purchase.objects.filter(
+                    transaction_id=cached['transaction_id'], user_id=user_id,
+                    is_active=True, is_successful=True
+                ).first()
+                if purchase:
+                    logger.info(f"收据验证命中缓存: 用户 {user_id}, 交易 {purchase.transaction_id}")
+                    return True, purchase
+
+            # 这份收据之前验证时响应中的原始交易ID，用于直接发往该订阅所在的环境
+            original_transaction_id = cached.get('original_transaction_id') if cached else None
+
             # 验证收据
-            verification_result = Purchase.verify_receipt(receipt_data, sandbox, app_id)
+            verification_result = Purchase.verify_receipt(receipt_data, sandbox, app_id, original_transaction_id)
 
             if verification_result.get('status') != 0:
                 error_message = f"收据验证失败，状态码: {verification_result.get('status')}"
@@ -37,16 +77,25 @@ class PurchaseService:
                 return False, error_message
 
             # 处理验证结果
-            purchase = Purchase.process_verification_result(verification_result, user_id)
+            purchase = Purchase.process_verification_result(verification_result, user_id, app_id)
 
             if not purchase:
                 error_message = "处理购买记录失败"
                 logger.error(error_message)
                 return False, error_message
 
+            if purchase.user_id != user_id:
+                error_message = "该收据的订阅已关联到其他账号"
+                logger.warning(f"用户 {user_id} 提交的收据的最新交易 {purchase.transaction_id} 属于用户 {purchase.user_id}")
+                return False, error_message
+
             # 更新用户权限
             Purchase.update_user_privileges(user_id, purchase)
 
+            cache.set(cache_key, {'user_id': user_id, 'transaction_id': purchase.transaction_id,
+                                  'original_transaction_id': purchase.original_transaction_id},
+                      _receipt_cache_ttl(purchase.expires_at))
+
             return True, purchase
 
         except Exception as e:
@@ -74,6 +123,66 @@ class PurchaseService:
             expires_at__gt=timezone.now()
         )
 
+    @staticmethod
+    def iter_entitlements(user_ids=None, now=None, chunk_size=2000):
+        """
+        一条查询计算用户当前的会员状态，使用服务端游标流式返回
+
+        每个用户的购买记录按 (是否有效订阅, 到期时间, 更新时间) 倒序排列，
+        用窗口函数取第一行：有有效订阅时为最晚到期的那条，否则为最近更新的那条。
+
+        Args:
+            user_ids: 用户ID列表，为 None 时计算所有有购买记录的用户
+            now: 计算时间，默认为当前时间
+
+        Yields:
+            tuple: (user_id, {'is_premium', 'expires_at', 'app_id'})
+        """
+        from django.db.models import BooleanField, Case, DateTimeField, F, Q, Value, When, Window
+        from django.db.models.functions import FirstValue
+        from django.utils import timezone
+        from purchase.models import Purchase
+
+        now = now or timezone.now()
+        active = Q(is_active=True, is_successful=True, expires_at__gt=now)
+        is_active_subscription = Case(When(active, then=Value(True)), default=Value(False),
+                                      output_field=BooleanField())
+        active_expiry = Case(When(active, then=F('expires_at')), output_field=DateTimeField())
+
+        def first_value(expression):
+            return Window(
+                FirstValue(expression),
+                partition_by=[F('user_id')],
+                order_by=[is_active_subscription.desc(), active_expiry.desc(nulls_last=True),
+                          F('updated_at').desc()]
+            )
+
+        purchases = Purchase.objects.all()
+        if user_ids is not None:
+            purchases = purchases.filter(user_id__in=user_ids)
+
+        rows = purchases.annotate(
+            entitled=first_value(is_active_subscription),
+            entitled_until=first_value(active_expiry),
+            entitled_app_id=first_value(F('app_id')),
+        ).order_by().values_list('user_id', 'entitled', 'entitled_until', 'entitled_app_id').distinct()
+
+        for user_id, is_premium, expires_at, app_id in rows.iterator(chunk_size=chunk_size):
+            yield user_id, {'is_premium': bool(is_premium), 'expires_at': expires_at, 'app_id': app_id}
+
+    @staticmethod
+    def get_entitlements(user_ids, now=None):
+        """
+        批量计算一组用户当前的会员状态
+
+        Returns:
+            dict: {user_id: {'is_premium', 'expires_at', 'app_id'}}，没有购买记录的用户视为非会员
+        """
+        entitlements = dict(PurchaseService.iter_entitlements(user_ids, now))
+        for user_id in user_ids:
+            entitlements.setdefault(user_id, {'is_premium': False, 'expires_at': None, 'app_id': None})
+        return entitlements
+
     @staticmethod
     def has_active_subscription(user_id, product_id=None):
         """
@@ -108,9 +217,50 @@ class PurchaseService:
         return False, None
 
 
+def _build_user_center_session():
+    """用户中心的连接池，同一进程内复用连接"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+user_center_session = _build_user_center_session()
+
+
 class UserService:
     """用户服务类，处理与用户中心的通信"""
 
+    # 用户中心请求超时：(连接, 读取) 秒
+    TIMEOUT = (3, 10)
+
+    @staticmethod
+    def _auth_headers(app_id):
+        """使用应用配置中的管理员令牌访问用户中心，app_id 可以是应用名称或 Bundle ID"""
+        headers = {}
+        if app_id:
+            try:
+                try:
+                    config = app_registry.get(app_id)
+                except AppleAppConfiguration.DoesNotExist:
+                    config = app_registry.get_by_bundle_id(app_id)
+                if getattr(config, 'admin_token', None):
+                    headers['Authorization'] = f"{config.admin_token}"
+            except AppleAppConfiguration.DoesNotExist:
+                logger.error(f"找不到应用 {app_id} 的配置")
+        return headers
+
+    @staticmethod
+    def _status_data(user_id, is_premium, expires_at):
+        if expires_at and not isinstance(expires_at, str):
+            expires_at = expires_at.isoformat()
+        return {
+            "user_id": user_id,
+            "is_premium": is_premium,
+            "expires_at": expires_at or None,
+        }
+
     @staticmethod
     def update_premium_status(user_id, is_premium, app_id='pocket_ai', expires_at=None):
         """
@@ -128,52 +278,21 @@ class UserService:
         try:
             # 构建请求URL
             api_url = f"{settings.BASE_URL}/users/api/users/{user_id}/update_premium_status/"
+            data = UserService._status_data(user_id, is_premium, expires_at)
 
-            # 构建请求数据
-
-            if expires_at:
-                expires_at_str = expires_at.isoformat()
-            else:
-                expires_at_str = None
-
-            data = {
-                "user_id": user_id,
-                "is_premium": is_premium,
-                "expires_at": expires_at_str,
-            }
-
-            logger.error(f"data: {data}")
-
-            # 获取API密钥
-            headers = {}
-            if app_id:
-                try:
-                    config = AppleAppConfiguration.objects.get(name=app_id)
-                    if hasattr(config, 'admin_token'):
-                        headers['Authorization'] = f"{config.admin_token}"
-                except AppleAppConfiguration.DoesNotExist:
-                    logger.error(f"找不到应用 {app_id} 的配置")
-
-            # 发送请求
-            response = requests.post(
+            response = user_center_session.post(
                 api_url,
                 json=data,
-                headers=headers,
-                timeout=10  # 设置超时时间
+                headers=UserService._auth_headers(app_id),
+                timeout=UserService.TIMEOUT
             )
 
-            # 检查响应
-            status_code = response.status_code
-            logger.error(f"status_code: {status_code}")
-
-            result = response.json()
-
-            if status_code == 200:
-                logger.error(f"成功更新用户 {user_id} 的会员状态: is_premium={is_premium}, expires_at={expires_at}")
+            if response.status_code == 200:
+                logger.info(f"成功更新用户 {user_id} 的会员状态: is_premium={is_premium}, expires_at={expires_at}")
                 return True
-            else:
-                logger.error(f"更新用户 {user_id} 的会员状态失败: {result.get('message')}")
-                return False
+
+            logger.error(f"更新用户 {user_id} 的会员状态失败: HTTP {response.status_code} {response.text[:200]}")
+            return False
 
         except requests.RequestException as e:
             logger.exception(f"请求用户中心API时出错: {str(e)}")
@@ -181,3 +300,43 @@ class UserService:
         except Exception as e:
             logger.exception(f"更新用户会员状态时出错: {str(e)}")
             return False
+
+    @staticmethod
+    def bulk_update_premium_status(statuses, app_id='pocket_ai'):
+        """
+        通过批量接口更新一批用户的会员状态
+
+        Args:
+            statuses: [{'user_id', 'is_premium', 'expires_at'}, ...]
+
+        Returns:
+            set: 更新成功的用户ID；批量接口不存在（404/405）时返回 None，由调用方逐个推送
+
+        Raises:
+            requests.RequestException: 网络错误或用户中心返回其他错误
+        """
+        response = user_center_session.post(
+            f"{settings.BASE_URL}/users/api/users/bulk_update_premium_status/",
+            json={'users': [
+                UserService._status_data(item['user_id'], item['is_premium'], item['expires_at'])
+                for item in statuses
+            ]},
+            headers=UserService._auth_headers(app_id),
+            timeout=UserService.TIMEOUT
+        )
+        if response.status_code in (404, 405):
+            return None
+        response.raise_for_status()
+
+        # 用户中心可以在 data.failed 中返回未能更新的用户
+        failed = set((response.json().get('data') or {}).get('failed') or [])
+        return {item['user_id'] for item in statuses} - failed
+
+    @staticmethod
+    def enqueue_premium_status(user_id, is_premium, app_id=None, expires_at=None):
+        """
+        记录需要推送给用户中心的会员状态，与调用方的数据库事务一同提交，由后台任务批量推送
+        """
+        from purchase.outbox import enqueue_premium_statuses
+
+        enqueue_premium_statuses({user_id: {'is_premium': is_premium, 'expires_at': expires_at, 'app_id': app_id}})
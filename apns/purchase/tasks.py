@@ -1,65 +1,167 @@
 from celery import shared_task
 import logging
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.db.models import Q
+from django.db.models.functions import Mod
 from django.utils import timezone
-from purchase.models import Purchase
-from purchase.services import UserService
+from purchase.expiry import process_due_expiries, schedule_entitlement_expiries
+from purchase.mirror import forward_mirrors
+from purchase.models import Purchase, PremiumState, PremiumStatusOutbox, SyncCursor
+from purchase.outbox import enqueue_premium_statuses, flush_premium_outbox
+from purchase.services import PurchaseService
+from purchase.webhooks import process_inbox_notification, process_unfinished_notifications
+from utils.leases import run_with_lease
 
 logger = logging.getLogger(__name__)
 
+# 每批计算和比较的用户数
+SYNC_BATCH_SIZE = 500
+# 水位回退秒数，避免漏掉水位附近才提交的更新
+SYNC_WATERMARK_OVERLAP = 60
+
 
 @shared_task
 def sync_user_premium_status():
-    """定期同步用户的会员状态"""
+    """
+    定期同步用户的会员状态，分片数大于 1 时按 user_id 取模分发给各分片任务
+
+    会员到期由 process_premium_expiries 按到期时间处理，续订、退款由通知处理，
+    这里每小时运行一次，补上遗漏的变化并重新登记到期定时器。
+    """
+    scheduled_at = timezone.now().replace(second=0, microsecond=0)
+    shards = settings.PREMIUM_SYNC_SHARDS
+    if shards <= 1:
+        return sync_user_premium_status_shard(0, 1, scheduled_at.isoformat())
+
+    for shard in range(shards):
+        sync_user_premium_status_shard.delay(shard, shards, scheduled_at.isoformat())
+    return True
+
+
+@shared_task
+def sync_user_premium_status_shard(shard, shards, scheduled_at):
+    """同步一个分片的会员状态，上一轮尚未结束时跳过本轮"""
+    return run_with_lease(
+        f'sync-premium-status:{shard}/{shards}',
+        lambda: _sync_user_premium_status(shard, shards),
+        ttl=settings.PREMIUM_SYNC_LEASE_TTL,
+        scheduled_at=datetime.fromisoformat(scheduled_at)
+    )
+
+
+def _sync_user_premium_status(shard=0, shards=1):
+    """
+    增量同步一个分片内用户的会员状态
+
+    只处理上次同步以来购买记录有更新、或订阅到期时间越过当前时间的用户，
+    以及上次推送失败的用户；计算出的会员状态与上次推送的一致时跳过，
+    有变化的用户写入推送队列，由 flush_premium_status_outbox 批量推送。
+    首次运行没有水位时处理全部用户。
+    """
     try:
-        logger.info("开始同步用户会员状态")
-
-        # 获取所有用户ID（去重）
-        user_ids = Purchase.objects.values_list('user_id', flat=True).distinct()
-
-        for user_id in user_ids:
-            try:
-                # 获取用户的有效订阅
-                active_subscriptions = Purchase.objects.filter(
-                    user_id=user_id,
-                    is_active=True,
-                    is_successful=True,
-                    expires_at__gt=timezone.now()
-                ).order_by('-expires_at')
-
-                if active_subscriptions.exists():
-                    # 用户有有效订阅，使用最晚的到期时间
-                    latest_subscription = active_subscriptions.first()
-                    app_id = latest_subscription.app_id
-
-                    UserService.update_premium_status(
-                        user_id=user_id,
-                        is_premium=True,
-                        app_id=app_id,
-                        expires_at=latest_subscription.expires_at
-                    )
-
-                    logger.info(f"同步用户 {user_id} 的会员状态: 有效，到期时间={latest_subscription.expires_at}")
-                else:
-                    # 用户没有有效订阅
-                    # 获取用户最后一条记录的app_id
-                    last_purchase = Purchase.objects.filter(user_id=user_id).order_by('-updated_at').first()
-                    app_id = last_purchase.app_id if last_purchase else None
-
-                    UserService.update_premium_status(
-                        user_id=user_id,
-                        is_premium=False,
-                        app_id=app_id
-                    )
-
-                    logger.info(f"同步用户 {user_id} 的会员状态: 无效")
-
-            except Exception as e:
-                logger.exception(f"同步用户 {user_id} 的会员状态时出错: {str(e)}")
-
-        logger.info("用户会员状态同步完成")
-
-        return True
+        now = timezone.now()
+        cursor_name = f'sync-premium-status:{shard}/{shards}'
+        cursor = SyncCursor.objects.filter(name=cursor_name).first()
+        # 回退一段时间，覆盖水位附近尚未提交的事务
+        since = cursor.value - timedelta(seconds=SYNC_WATERMARK_OVERLAP) if cursor else None
+        logger.info(f"开始同步用户会员状态 (分片 {shard}/{shards})，水位: {since}")
+
+        purchases = Purchase.objects.all()
+        pending_states = PremiumState.objects.filter(synced=False)
+        if shards > 1:
+            purchases = purchases.alias(shard=Mod('user_id', shards)).filter(shard=shard)
+            pending_states = pending_states.alias(shard=Mod('user_id', shards)).filter(shard=shard)
+        if since:
+            purchases = purchases.filter(
+                Q(updated_at__gt=since) | Q(expires_at__gt=since, expires_at__lte=now)
+            )
+
+        user_ids = set(purchases.order_by().values_list('user_id', flat=True).distinct())
+        user_ids.update(pending_states.values_list('user_id', flat=True))
+        user_ids = sorted(user_ids)
+
+        queued = 0
+        for start in range(0, len(user_ids), SYNC_BATCH_SIZE):
+            queued += _sync_premium_batch(user_ids[start:start + SYNC_BATCH_SIZE], now)
+
+        SyncCursor.objects.update_or_create(name=cursor_name, defaults={'value': now})
+        logger.info(f"用户会员状态同步完成: 检查 {len(user_ids)} 个用户，{queued} 个加入推送队列")
+
+        return queued
 
     except Exception as e:
         logger.exception(f"同步用户会员状态任务出错: {str(e)}")
-        return False
\ No newline at end of file
+        return False
+
+
+def _sync_premium_batch(user_ids, now):
+    """计算一批用户的会员状态，与上次推送结果不同的用户写入推送队列，返回写入数"""
+    entitlements = PurchaseService.get_entitlements(user_ids, now)
+    schedule_entitlement_expiries(entitlements)
+    states = {state.user_id: state for state in PremiumState.objects.filter(user_id__in=user_ids)}
+    # 已在队列中的用户等待推送即可，状态有新的变化时由写入方合并
+    queued = set(PremiumStatusOutbox.objects.filter(user_id__in=user_ids).values_list('user_id', flat=True))
+
+    changed = {}
+    for user_id in user_ids:
+        entitlement = entitlements[user_id]
+        state = states.get(user_id)
+        if user_id in queued or (state and state.synced and state.is_premium == entitlement['is_premium']
+                                 and state.expires_at == entitlement['expires_at']):
+            continue
+
+        logger.info(f"用户 {user_id} 的会员状态有变化: is_premium={entitlement['is_premium']}, "
+                    f"到期时间={entitlement['expires_at']}")
+        changed[user_id] = entitlement
+
+    return enqueue_premium_statuses(changed)
+
+
+@shared_task
+def flush_premium_status_outbox():
+    """批量推送队列中到期的会员状态，正在推送时合并为结束后补跑一次"""
+    return run_with_lease(
+        'flush-premium-status-outbox',
+        flush_premium_outbox,
+        ttl=settings.PREMIUM_SYNC_LEASE_TTL,
+        coalesce=True
+    )
+
+
+@shared_task
+def process_premium_expiries():
+    """重新计算已到期用户的会员状态，正在处理时合并为结束后补跑一次"""
+    return run_with_lease(
+        'process-premium-expiries',
+        process_due_expiries,
+        ttl=settings.PREMIUM_SYNC_LEASE_TTL,
+        coalesce=True
+    )
+
+
+@shared_task
+def process_webhook_notification(notification_uuid):
+    """处理收件箱中的一条苹果通知，重复投递时直接跳过"""
+    return process_inbox_notification(notification_uuid)
+
+
+@shared_task
+def process_webhook_inbox():
+    """补偿处理收件箱中投递丢失或处理失败的苹果通知"""
+    return run_with_lease(
+        'process-webhook-inbox',
+        process_unfinished_notifications,
+        ttl=settings.PREMIUM_SYNC_LEASE_TTL
+    )
+
+
+@shared_task
+def forward_webhook_mirrors():
+    """把苹果通知转发给镜像目标，正在转发时合并为结束后补跑一次"""
+    return run_with_lease(
+        'forward-webhook-mirrors',
+        forward_mirrors,
+        ttl=5 * 60,
+        coalesce=True
+    )
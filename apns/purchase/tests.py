@@ -1,3 +1,708 @@
-from django.test import TestCase
+import json
+from datetime import timedelta
+from json import dumps
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from . import expiry, mirror, outbox, verifier
+from .expiry import process_due_expiries
+from .models import Purchase, PurchaseBlob, PremiumState, PremiumStatusOutbox, SyncCursor, WebhookInbox
+from .outbox import enqueue_premium_statuses, flush_premium_outbox
+from .services import UserService
+from .tasks import _sync_user_premium_status
+from .webhooks import process_inbox_notification, process_unfinished_notifications
+
+
+class PremiumSyncTests(TestCase):
+    def _purchase(self, user_id, expires_in, **kwargs):
+        return Purchase.objects.create(
+            user_id=user_id,
+            app_id='pocket_ai',
+            transaction_id=kwargs.pop('transaction_id', f't-{user_id}-{expires_in}'),
+            purchase_date=timezone.now() - timedelta(days=30),
+            expires_at=timezone.now() + timedelta(days=expires_in),
+            is_active=True,
+            is_successful=True,
+            **kwargs
+        )
+
+    def _flush(self, pushed=None):
+        """推送队列，返回本次推送的 {user_id: 状态}"""
+        pushed = {} if pushed is None else pushed
+
+        def bulk_update(statuses, app_id):
+            pushed.update({item['user_id']: item for item in statuses})
+            return {item['user_id'] for item in statuses}
+
+        with mock.patch('purchase.outbox.UserService.bulk_update_premium_status', side_effect=bulk_update):
+            flush_premium_outbox()
+        return pushed
+
+    def test_only_changed_entitlements_are_pushed(self):
+        self._purchase(1, 30)
+        self._purchase(1, 60)
+        self._purchase(2, -10)
+
+        self.assertEqual(_sync_user_premium_status(), 2)
+        pushed = self._flush()
+        self.assertTrue(pushed[1]['is_premium'])
+        self.assertGreater(pushed[1]['expires_at'], timezone.now() + timedelta(days=59))
+        self.assertFalse(pushed[2]['is_premium'])
+        self.assertFalse(PremiumStatusOutbox.objects.exists())
+
+        # 没有变化时不再推送
+        self.assertEqual(_sync_user_premium_status(), 0)
+        self.assertEqual(self._flush(), {})
+
+        # 订阅在上次同步之后到期：记录本身没有更新，按到期时间越过水位找到
+        cursor = SyncCursor.objects.get()
+        SyncCursor.objects.update(value=cursor.value - timedelta(hours=1))
+        Purchase.objects.filter(user_id=1).update(expires_at=timezone.now() - timedelta(minutes=5))
+        self.assertEqual(_sync_user_premium_status(), 1)
+        self.assertFalse(self._flush()[1]['is_premium'])
+        self.assertFalse(PremiumState.objects.get(user_id=1).is_premium)
+
+    def test_abandoned_pushes_are_resynced(self):
+        self._purchase(1, 30)
+        self.assertEqual(_sync_user_premium_status(), 1)
+
+        with mock.patch('purchase.outbox.UserService.bulk_update_premium_status', return_value=set()):
+            flush_premium_outbox(max_attempts=1)
+        self.assertFalse(PremiumStatusOutbox.objects.exists())
+        self.assertFalse(PremiumState.objects.get(user_id=1).synced)
+
+        # 放弃推送的用户由下一轮同步重新加入队列
+        self.assertEqual(_sync_user_premium_status(), 1)
+        self.assertIn(1, self._flush())
+        self.assertTrue(PremiumState.objects.get(user_id=1).synced)
+
+
+class PremiumOutboxTests(TestCase):
+    def setUp(self):
+        outbox._bulk_unavailable_until = None
+
+    def test_changes_are_coalesced_per_user(self):
+        expires_at = timezone.now() + timedelta(days=30)
+        enqueue_premium_statuses({1: {'is_premium': False, 'app_id': 'pocket_ai'}}, flush=False)
+        enqueue_premium_statuses({1: {'is_premium': True, 'expires_at': expires_at, 'app_id': 'pocket_ai'},
+                                  2: {'is_premium': False, 'app_id': 'pocket_ai'}}, flush=False)
+        self.assertEqual(PremiumStatusOutbox.objects.count(), 2)
+
+        with mock.patch('purchase.outbox.UserService.bulk_update_premium_status',
+                        return_value={1, 2}) as bulk_update:
+            self.assertEqual(flush_premium_outbox(), 2)
+
+        # 同一应用的用户一次批量推送，只推送最新状态
+        bulk_update.assert_called_once()
+        statuses = {item['user_id']: item for item in bulk_update.call_args.args[0]}
+        self.assertTrue(statuses[1]['is_premium'])
+        self.assertEqual(statuses[1]['expires_at'], expires_at)
+        self.assertFalse(PremiumStatusOutbox.objects.exists())
+
+    def test_newer_state_survives_inflight_push(self):
+        enqueue_premium_statuses({1: {'is_premium': True, 'app_id': 'pocket_ai'}}, flush=False)
+
+        def bulk_update(statuses, app_id):
+            # 推送期间用户状态又发生变化
+            enqueue_premium_statuses({1: {'is_premium': False, 'app_id': 'pocket_ai'}}, flush=False)
+            return {1}
+
+        with mock.patch('purchase.outbox.UserService.bulk_update_premium_status', side_effect=bulk_update):
+            flush_premium_outbox()
+
+        row = PremiumStatusOutbox.objects.get(user_id=1)
+        self.assertFalse(row.is_premium)
+        self.assertLessEqual(row.next_attempt_at, timezone.now())
+
+    @mock.patch('purchase.outbox.UserService.update_premium_status')
+    @mock.patch('purchase.outbox.UserService.bulk_update_premium_status', return_value=None)
+    def test_falls_back_to_single_pushes_and_retries(self, bulk_update, update):
+        enqueue_premium_statuses({1: {'is_premium': True, 'app_id': 'pocket_ai'},
+                                  2: {'is_premium': True, 'app_id': 'pocket_ai'}}, flush=False)
+        update.side_effect = lambda user_id, **kwargs: user_id == 1
+
+        self.assertEqual(flush_premium_outbox(), 1)
+        self.assertEqual(update.call_count, 2)
+
+        row = PremiumStatusOutbox.objects.get()
+        self.assertEqual((row.user_id, row.attempts), (2, 1))
+        self.assertGreater(row.next_attempt_at, timezone.now())
+        self.assertTrue(PremiumState.objects.get(user_id=1).synced)
+
+        # 未到重试时间不推送；批量接口不可用期间不再尝试
+        self.assertEqual(flush_premium_outbox(), 0)
+        PremiumStatusOutbox.objects.update(next_attempt_at=timezone.now())
+        update.side_effect = None
+        update.return_value = True
+        self.assertEqual(flush_premium_outbox(), 1)
+        bulk_update.assert_called_once()
+        self.assertFalse(PremiumStatusOutbox.objects.exists())
+
+    def test_results_are_recorded_in_constant_queries(self):
+        from purchase.outbox import _claim, _record_results
+
+        enqueue_premium_statuses({user_id: {'is_premium': True, 'app_id': 'pocket_ai'}
+                                  for user_id in range(1, 31)}, flush=False)
+        PremiumStatusOutbox.objects.filter(user_id__gt=20).update(attempts=9)
+        rows = _claim(100)
+
+        # 锁定、出队、退避各一条语句，再加一次写入 PremiumState（另外两条是保存点）
+        with self.assertNumQueries(6):
+            _record_results(rows, pushed=set(range(1, 11)), error='推送失败', max_attempts=10)
+
+        self.assertEqual(
+            sorted(PremiumStatusOutbox.objects.values_list('user_id', 'attempts')),
+            [(user_id, 1) for user_id in range(11, 21)]
+        )
+        self.assertEqual(PremiumState.objects.filter(synced=True).count(), 10)
+        self.assertEqual(PremiumState.objects.filter(synced=False).count(), 10)
+
+    @mock.patch('purchase.services.user_center_session.post')
+    def test_bulk_endpoint(self, post):
+        post.return_value = mock.Mock(status_code=200, json=lambda: {'data': {'failed': [2]}})
+        pushed = UserService.bulk_update_premium_status(
+            [{'user_id': 1, 'is_premium': True, 'expires_at': None},
+             {'user_id': 2, 'is_premium': False, 'expires_at': None}]
+        )
+        self.assertEqual(pushed, {1})
+        self.assertEqual(len(post.call_args.kwargs['json']['users']), 2)
+
+        post.return_value = mock.Mock(status_code=404)
+        self.assertIsNone(UserService.bulk_update_premium_status(
+            [{'user_id': 1, 'is_premium': True, 'expires_at': None}]
+        ))
+
+
+class EntitlementQueryTests(TestCase):
+    def _purchase(self, user_id, app_id, expires_in, transaction_id, **kwargs):
+        return Purchase.objects.create(
+            user_id=user_id,
+            app_id=app_id,
+            transaction_id=transaction_id,
+            purchase_date=timezone.now() - timedelta(days=30),
+            expires_at=timezone.now() + timedelta(days=expires_in),
+            is_successful=True,
+            **kwargs
+        )
+
+    def test_single_query_picks_latest_active_expiry(self):
+        from .services import PurchaseService
+
+        self._purchase(1, 'pocket_ai', 30, 't1')
+        self._purchase(1, 'com.example.other', 90, 't2')
+        self._purchase(1, 'com.example.refunded', 120, 't3', is_active=False)
+        self._purchase(2, 'pocket_ai', -1, 't4')
+        self._purchase(2, 'com.example.latest', -5, 't5')
+
+        with self.assertNumQueries(1):
+            entitlements = PurchaseService.get_entitlements([1, 2, 3])
+
+        self.assertTrue(entitlements[1]['is_premium'])
+        self.assertEqual(entitlements[1]['app_id'], 'com.example.other')
+        self.assertGreater(entitlements[1]['expires_at'], timezone.now() + timedelta(days=89))
+        # 没有有效订阅时取最近更新的记录的应用
+        self.assertEqual(entitlements[2], {'is_premium': False, 'expires_at': None,
+                                           'app_id': 'com.example.latest'})
+        self.assertEqual(entitlements[3], {'is_premium': False, 'expires_at': None, 'app_id': None})
+        self.assertEqual(dict(PurchaseService.iter_entitlements()).keys(), {1, 2})
+
+    @mock.patch('purchase.services.UserService.update_premium_status')
+    def test_sync_user_status_enqueues_entitlement(self, update_premium_status):
+        from rest_framework.test import APIRequestFactory
+        from .views import PurchaseListView
+
+        self._purchase(1, 'pocket_ai', 30, 't1')
+        self._purchase(1, 'com.example.other', 90, 't2')
+
+        request = APIRequestFactory().post('/api/purchase/list/sync_user_status/', {'user_id': 1}, format='json')
+        request.remote_user = 'user-center'
+        # 查询有效订阅、写入推送队列各一条
+        with self.assertNumQueries(2):
+            response = PurchaseListView.as_view({'post': 'sync_user_status'})(request)
+
+        # 会员状态与其他调用方一样进入推送队列，不在请求中同步推送
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['transaction_id'] for item in response.data['data']], ['t2', 't1'])
+        update_premium_status.assert_not_called()
+        row = PremiumStatusOutbox.objects.get(user_id=1)
+        self.assertEqual((row.is_premium, row.app_id), (True, 'com.example.other'))
+
+
+class ExpiryTimerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def _purchase(self, user_id, expires_in, transaction_id, **kwargs):
+        return Purchase.objects.create(
+            user_id=user_id,
+            app_id='pocket_ai',
+            transaction_id=transaction_id,
+            purchase_date=timezone.now() - timedelta(days=30),
+            expires_at=timezone.now() + expires_in,
+            is_active=True,
+            is_successful=True,
+            **kwargs
+        )
+
+    def test_only_expired_users_are_reevaluated(self):
+        self._purchase(1, timedelta(days=30), 't1')
+        purchase = self._purchase(2, timedelta(hours=1), 't2')
+        Purchase.update_user_privileges(1, None)
+        Purchase.update_user_privileges(2, purchase)
+        PremiumStatusOutbox.objects.all().delete()
+
+        self.assertEqual(process_due_expiries(), 0)
+
+        # 用户 2 的订阅到期，只有该用户被重新计算
+        with mock.patch('purchase.expiry.timezone.now', return_value=timezone.now() + timedelta(hours=2)):
+            self.assertEqual(process_due_expiries(), 1)
+
+        self.assertFalse(PremiumStatusOutbox.objects.get(user_id=2).is_premium)
+        self.assertFalse(PremiumStatusOutbox.objects.filter(user_id=1).exists())
+        self.assertEqual(set(cache.get(expiry.EXPIRY_KEY)), {1})
+
+    def test_renewal_and_refund_reschedule(self):
+        purchase = self._purchase(1, timedelta(days=30), 't1')
+        Purchase.update_user_privileges(1, purchase)
+        first = cache.get(expiry.EXPIRY_KEY)[1]
+
+        renewal = self._purchase(1, timedelta(days=60), 't2')
+        Purchase.update_user_privileges(1, renewal)
+        self.assertGreater(cache.get(expiry.EXPIRY_KEY)[1], first)
+
+        Purchase.objects.filter(user_id=1).update(is_active=False)
+        Purchase.update_user_privileges(1, renewal)
+        self.assertNotIn(1, cache.get(expiry.EXPIRY_KEY))
+
+    def test_remaining_subscription_is_rescheduled(self):
+        self._purchase(1, timedelta(days=30), 't1')
+        expiry.schedule_entitlement_expiries(
+            {1: {'is_premium': True, 'expires_at': timezone.now() + timedelta(seconds=1)}}
+        )
+
+        with mock.patch('purchase.expiry.timezone.now', return_value=timezone.now() + timedelta(seconds=2)):
+            self.assertEqual(process_due_expiries(), 1)
+
+        self.assertTrue(PremiumStatusOutbox.objects.get(user_id=1).is_premium)
+        self.assertGreater(cache.get(expiry.EXPIRY_KEY)[1], (timezone.now() + timedelta(days=29)).timestamp())
+
+
+class ReceiptCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def _verification_result(self, transaction_id, expires_in):
+        expires_ms = int((timezone.now() + expires_in).timestamp() * 1000)
+        return {
+            'status': 0,
+            'latest_receipt_info': [{
+                'transaction_id': transaction_id,
+                'original_transaction_id': 'o1',
+                'product_id': 'premium.monthly',
+                'purchase_date_ms': str(expires_ms - 30 * 24 * 3600 * 1000),
+                'expires_date_ms': str(expires_ms),
+            }],
+        }
+
+    @mock.patch('purchase.models.Purchase.verify_receipt')
+    def test_repeated_receipt_is_served_locally(self, verify_receipt):
+        from .services import PurchaseService
+
+        verify_receipt.return_value = self._verification_result('t1', timedelta(days=30))
+        success, purchase = PurchaseService.verify_and_process_receipt('receipt', 1)
+        self.assertTrue(success)
+
+        with mock.patch('purchase.models.Purchase.update_user_privileges') as update_privileges:
+            success, cached = PurchaseService.verify_and_process_receipt('receipt', 1)
+        self.assertTrue(success)
+        self.assertEqual(cached.pk, purchase.pk)
+        verify_receipt.assert_called_once()
+        update_privileges.assert_not_called()
+
+        # 其他用户提交同一收据、或收据内容不同时仍向苹果验证
+        PurchaseService.verify_and_process_receipt('receipt', 2)
+        PurchaseService.verify_and_process_receipt('other-receipt', 1)
+        self.assertEqual(verify_receipt.call_count, 3)
+
+    @mock.patch('purchase.models.Purchase.verify_receipt')
+    def test_inactive_purchase_is_not_served_from_cache(self, verify_receipt):
+        from .services import PurchaseService
+
+        verify_receipt.return_value = self._verification_result('t1', timedelta(days=30))
+        PurchaseService.verify_and_process_receipt('receipt', 1)
+
+        # 退款通知把交易标记为无效后，同一收据重新向苹果验证
+        Purchase.objects.filter(transaction_id='t1').update(is_active=False, is_successful=False, status='failed')
+        PurchaseService.verify_and_process_receipt('receipt', 1)
+        self.assertEqual(verify_receipt.call_count, 2)
+
+        # 首次验证时不知道收据所属的订阅，重新验证时使用上次响应中的原始交易ID
+        self.assertIsNone(verify_receipt.call_args_list[0].args[3])
+        self.assertEqual(verify_receipt.call_args_list[1].args[3], 'o1')
+
+    def test_ttl_follows_latest_expiry(self):
+        from .services import _receipt_cache_ttl
+
+        with self.settings(RECEIPT_CACHE_MAX_TTL=86400, RECEIPT_CACHE_EXPIRED_TTL=300):
+            self.assertAlmostEqual(_receipt_cache_ttl(timezone.now() + timedelta(hours=1)), 3600, delta=2)
+            self.assertEqual(_receipt_cache_ttl(timezone.now() + timedelta(days=30)), 86400)
+            self.assertEqual(_receipt_cache_ttl(timezone.now() - timedelta(days=1)), 300)
+            self.assertEqual(_receipt_cache_ttl(None), 86400)
+
+
+class ReceiptVerifierTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def _session(self, environments):
+        """按环境返回固定状态码的会话，记录请求的环境"""
+        session = mock.Mock()
+        session.calls = []
+
+        def post(url, json, timeout, stream):
+            environment = next(env for env, endpoint in verifier.ENDPOINTS.items() if endpoint == url)
+            session.calls.append(environment)
+            result = {'status': environments[environment]}
+            if result['status'] == 0:
+                result['latest_receipt_info'] = [{'original_transaction_id': 'o1'}]
+            return mock.Mock(iter_content=lambda chunk_size: [dumps(result).encode()])
+
+        session.post.side_effect = post
+        return session
+
+    def test_sandbox_environment_is_remembered(self):
+        session = self._session({verifier.PRODUCTION: 21007, verifier.SANDBOX: 0})
+        receipt_verifier = verifier.ReceiptVerifier(session=session, race=False)
+
+        result = receipt_verifier.verify({'receipt-data': 'r'}, app_id='pocket_ai')
+        self.assertEqual(result['environment'], verifier.SANDBOX)
+        self.assertEqual(session.calls, [verifier.PRODUCTION, verifier.SANDBOX])
+
+        # 同一订阅的后续验证直接发往沙盒环境
+        session.calls.clear()
+        receipt_verifier.verify({'receipt-data': 'r'}, app_id='pocket_ai', original_transaction_id='o1')
+        self.assertEqual(session.calls, [verifier.SANDBOX])
+
+    def test_sandbox_subscription_does_not_change_app_default(self):
+        session = self._session({verifier.PRODUCTION: 21007, verifier.SANDBOX: 0})
+        receipt_verifier = verifier.ReceiptVerifier(session=session, race=False)
+        receipt_verifier.verify({'receipt-data': 'r'}, app_id='pocket_ai')
+
+        # 同一应用的其他订阅、订阅未知的收据和其他应用的同名订阅仍先发往正式环境
+        session.calls.clear()
+        receipt_verifier.verify({'receipt-data': 'r2'}, app_id='pocket_ai', original_transaction_id='o2')
+        receipt_verifier.verify({'receipt-data': 'r3'}, app_id='pocket_ai')
+        receipt_verifier.verify({'receipt-data': 'r4'}, app_id='other_app', original_transaction_id='o1')
+        self.assertEqual(session.calls, [verifier.PRODUCTION, verifier.SANDBOX] * 3)
+
+    def test_race_for_unknown_subscription(self):
+        session = self._session({verifier.PRODUCTION: 21007, verifier.SANDBOX: 0})
+        receipt_verifier = verifier.ReceiptVerifier(session=session, race=True)
+
+        result = receipt_verifier.verify({'receipt-data': 'r'}, app_id='pocket_ai')
+        self.assertEqual(result['status'], 0)
+        self.assertEqual(sorted(session.calls), [verifier.PRODUCTION, verifier.SANDBOX])
+
+        # 已知订阅所在环境时不再同时请求
+        session.calls.clear()
+        receipt_verifier.verify({'receipt-data': 'r'}, app_id='pocket_ai', original_transaction_id='o1')
+        self.assertEqual(session.calls, [verifier.SANDBOX])
+
+
+class VerifyResponseParserTests(TestCase):
+    def _response(self, transactions=50):
+        purchase_ms = 1700000000000
+        history = [{
+            'transaction_id': str(i),
+            'original_transaction_id': 'o1',
+            'product_id': 'premium.monthly',
+            'purchase_date_ms': str(purchase_ms + i * 1000),
+            'expires_date_ms': str(purchase_ms + i * 1000 + 86400000),
+            'web_order_line_item_id': str(i),
+        } for i in range(transactions)]
+        history.insert(10, history.pop())
+        return {
+            'status': 0,
+            'environment': 'Production',
+            'receipt': {'bundle_id': 'com.example.app', 'in_app': history, 'receipt_type': '正式'},
+            'latest_receipt_info': history,
+            'latest_receipt': 'A' * 5000,
+            'pending_renewal_info': [{'auto_renew_status': '1'}],
+        }
+
+    def test_trims_transactions_across_chunk_boundaries(self):
+        response = self._response()
+        raw = dumps(response, indent=1, ensure_ascii=False).encode()
+
+        for chunk_size in (1, 7, 4096, len(raw)):
+            chunks = [raw[i:i + chunk_size] for i in range(0, len(raw), chunk_size)]
+            result = verifier.parse_verify_response(chunks)
+
+            self.assertEqual(result['status'], 0)
+            self.assertEqual(result['latest_receipt'], response['latest_receipt'])
+            self.assertEqual(result['pending_renewal_info'], response['pending_renewal_info'])
+            self.assertEqual([t['transaction_id'] for t in result['latest_receipt_info']],
+                             [str(i) for i in range(50)])
+            self.assertNotIn('web_order_line_item_id', result['latest_receipt_info'][0])
+            self.assertEqual(result['receipt']['bundle_id'], 'com.example.app')
+            self.assertEqual([t['transaction_id'] for t in result['receipt']['in_app']], ['49'])
+
+    def test_error_responses(self):
+        self.assertEqual(verifier.parse_verify_response([b'{"status": 2100', b'7}']), {'status': 21007})
+        self.assertEqual(verifier.parse_verify_response([b'{"status": 0, "latest_receipt_info": []}']),
+                         {'status': 0, 'latest_receipt_info': []})
+        for raw in (b'<html>Bad Gateway</html>', b'{"status": 0', b'{"status" 0}'):
+            with self.assertRaises(ValueError):
+                verifier.parse_verify_response([raw])
+
+
+class TransactionUpsertTests(TestCase):
+    def _transaction(self, transaction_id, expires_in_days, **kwargs):
+        expires_ms = int((timezone.now() + timedelta(days=expires_in_days)).timestamp() * 1000)
+        return {
+            'transaction_id': transaction_id,
+            'original_transaction_id': 'o1',
+            'product_id': 'premium.monthly',
+            'purchase_date_ms': str(expires_ms - 30 * 86400000),
+            'expires_date_ms': str(expires_ms),
+            **kwargs
+        }
+
+    @mock.patch('purchase.models.Purchase.update_user_privileges')
+    @mock.patch('purchase.models.Purchase.verify_receipt')
+    def test_same_receipt_from_another_user_keeps_ownership(self, verify_receipt, update_privileges):
+        from .services import PurchaseService
+
+        verify_receipt.return_value = {'status': 0, 'latest_receipt_info': [self._transaction('t1', -30),
+                                                                              self._transaction('t2', 1)]}
+        self.assertTrue(PurchaseService.verify_and_process_receipt('receipt', 1)[0])
+
+        # 续订后另一个账号提交同一收据：已有交易和同一订阅的新交易都仍归属原用户
+        verify_receipt.return_value['latest_receipt_info'].append(self._transaction('t3', 30))
+        with self.assertLogs('purchase.models', level='WARNING'):
+            success, message = PurchaseService.verify_and_process_receipt('other-receipt', 2)
+        self.assertFalse(success)
+        self.assertEqual(message, '该收据的订阅已关联到其他账号')
+        self.assertEqual(set(Purchase.objects.values_list('user_id', flat=True)), {1})
+        self.assertEqual(Purchase.objects.count(), 3)
+
+    def test_full_history_is_written(self):
+        Purchase.objects.create(user_id=1, transaction_id='t1', purchase_date=timezone.now(),
+                                notification_type='DID_RENEW')
+        PurchaseBlob.store('t1', 'notification', '{"notification": 1}')
+        result = {
+            'status': 0,
+            'latest_receipt': 'latest',
+            'latest_receipt_info': [
+                self._transaction('t1', -30),
+                self._transaction('t2', -1, cancellation_date_ms='1'),
+                self._transaction('t3', 29),
+            ],
+        }
+
+        # 查找订阅的已有归属、写入交易、查找等待的通知、写入收据、读取最新交易
+        with self.assertNumQueries(5):
+            purchase = Purchase.process_verification_result(result, 1)
+
+        self.assertEqual(purchase.transaction_id, 't3')
+        self.assertEqual(purchase.blob.text, 'latest')
+        purchases = {p.transaction_id: p for p in Purchase.objects.all()}
+        self.assertEqual(purchases.keys(), {'t1', 't2', 't3'})
+        self.assertFalse(purchases['t2'].is_active)
+        # 已有交易更新状态，但保留通知写入的数据
+        self.assertTrue(purchases['t1'].is_successful)
+        self.assertEqual(purchases['t1'].notification_type, 'DID_RENEW')
+        self.assertEqual(purchases['t1'].blob.text, '{"notification": 1}')
+
+    @mock.patch('purchase.models.Purchase.update_user_privileges')
+    def test_notification_upserts_transaction(self, update_privileges):
+        Purchase.objects.create(user_id=1, transaction_id='t1', original_transaction_id='o1',
+                                purchase_date=timezone.now(), is_active=True, is_successful=True)
+        expires_ms = int((timezone.now() - timedelta(days=1)).timestamp() * 1000)
+
+        Purchase.process_notification({
+            'notificationType': 'EXPIRED',
+            'data': {
+                'bundleId': 'com.example.app',
+                'transactionInfo': {'transactionId': 't1', 'originalTransactionId': 'o1',
+                                    'productId': 'premium.monthly', 'expiresDate': expires_ms},
+            },
+        })
+
+        purchase = Purchase.objects.get(transaction_id='t1')
+        self.assertFalse(purchase.is_active)
+        self.assertEqual(purchase.notification_type, 'EXPIRED')
+        self.assertEqual(purchase.app_id, 'com.example.app')
+        self.assertEqual(json.loads(purchase.blob.text)['notificationType'], 'EXPIRED')
+        update_privileges.assert_called_once()
+
+
+@mock.patch('purchase.mirror.mirror_session.post')
+class WebhookInboxTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def _signed_payload(self, notification_uuid='n1', notification_type='EXPIRED', version='2.0'):
+        import jwt
+
+        transaction_info = jwt.encode({
+            'transactionId': 't1', 'originalTransactionId': 'o1', 'bundleId': 'com.example.app',
+            'productId': 'premium.monthly', 'purchaseDate': 1700000000000, 'originalPurchaseDate': 1700000000000,
+            'expiresDate': int((timezone.now() - timedelta(days=1)).timestamp() * 1000),
+        }, 'secret', algorithm='HS256')
+        return jwt.encode({
+            'notificationType': notification_type, 'notificationUUID': notification_uuid,
+            'version': version, 'signedDate': 1700000000000,
+            'data': {'appAppleId': 1, 'bundleId': 'com.example.app', 'environment': 'Production',
+                     'signedTransactionInfo': transaction_info},
+        }, 'secret', algorithm='HS256')
+
+    @mock.patch('purchase.tasks.process_webhook_notification.delay')
+    def test_webhook_only_stores_notification(self, delay, post):
+        signed_payload = self._signed_payload()
+        for _ in range(2):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post('/api/purchase/webhook/', {'signedPayload': signed_payload},
+                                            content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+
+        item = WebhookInbox.objects.get()
+        self.assertEqual((item.notification_uuid, item.notification_type, item.status), ('n1', 'EXPIRED', 'pending'))
+        delay.assert_called_with('n1')
+        post.assert_not_called()
+
+        response = self.client.post('/api/purchase/webhook/', {'signedPayload': 'garbage'},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    @mock.patch('purchase.models.Purchase.update_user_privileges')
+    def test_processing_is_idempotent(self, update_privileges, post):
+        Purchase.objects.create(user_id=1, transaction_id='t1', original_transaction_id='o1',
+                                purchase_date=timezone.now(), is_active=True, is_successful=True)
+        WebhookInbox.objects.create(notification_uuid='n1', signed_payload=self._signed_payload())
+
+        self.assertTrue(process_inbox_notification('n1'))
+        self.assertFalse(process_inbox_notification('n1'))
+
+        self.assertEqual(WebhookInbox.objects.get().status, 'done')
+        self.assertFalse(Purchase.objects.get(transaction_id='t1').is_active)
+        update_privileges.assert_called_once()
+        # 镜像转发只写入队列，由后台任务转发
+        post.assert_not_called()
+        self.assertEqual(mirror.backlog_size(settings.WEBHOOK_MIRROR_TARGETS[0]), 1)
+
+    def test_invalid_and_unfinished_notifications(self, post):
+        WebhookInbox.objects.create(notification_uuid='old', signed_payload=self._signed_payload('old', version='1.0'))
+        WebhookInbox.objects.create(notification_uuid='new', signed_payload=self._signed_payload('new'))
+        WebhookInbox.objects.update(received_at=timezone.now() - timedelta(minutes=5))
+        WebhookInbox.objects.create(notification_uuid='recent', signed_payload=self._signed_payload('recent'))
+
+        # 补偿任务只处理超过等待时间仍未处理的通知
+        self.assertEqual(process_unfinished_notifications(), 2)
+        statuses = dict(WebhookInbox.objects.values_list('notification_uuid', 'status'))
+        self.assertEqual(statuses, {'old': 'invalid', 'new': 'waiting', 'recent': 'pending'})
+
+    @mock.patch('purchase.models.Purchase.update_user_privileges')
+    def test_notification_before_receipt_waits_for_verification(self, update_privileges, post):
+        WebhookInbox.objects.create(notification_uuid='n1', signed_payload=self._signed_payload())
+        WebhookInbox.objects.update(received_at=timezone.now() - timedelta(days=1))
+
+        # 交易还没有对应的用户时等待，不能当作已处理，也不消耗重试次数
+        self.assertTrue(process_inbox_notification('n1'))
+        item = WebhookInbox.objects.get()
+        self.assertEqual((item.status, item.original_transaction_id), ('waiting', 'o1'))
+        update_privileges.assert_not_called()
+        with self.settings(WEBHOOK_INBOX_MAX_ATTEMPTS=1):
+            self.assertEqual(process_unfinished_notifications(), 0)
+        self.assertEqual(WebhookInbox.objects.get().status, 'waiting')
+
+        # 一天后用户上传收据，验证写入购买记录后重新处理该通知
+        with mock.patch('purchase.tasks.process_webhook_notification.delay',
+                        side_effect=process_inbox_notification) as delay:
+            with self.captureOnCommitCallbacks(execute=True):
+                Purchase.process_verification_result({'status': 0, 'latest_receipt_info': [{
+                    'transaction_id': 't1', 'original_transaction_id': 'o1', 'product_id': 'premium.monthly',
+                    'purchase_date_ms': '1700000000000',
+                    'expires_date_ms': str(int((timezone.now() + timedelta(days=29)).timestamp() * 1000)),
+                }]}, user_id=1)
+        delay.assert_called_once_with('n1')
+        self.assertEqual(WebhookInbox.objects.get().status, 'done')
+        # 通知中的过期状态覆盖收据验证的结果
+        self.assertFalse(Purchase.objects.get(transaction_id='t1').is_active)
+
+    @mock.patch('purchase.models.Purchase.update_user_privileges')
+    def test_sweeper_replays_waiting_notification_once_purchase_exists(self, update_privileges, post):
+        WebhookInbox.objects.create(notification_uuid='n1', signed_payload=self._signed_payload())
+        WebhookInbox.objects.update(received_at=timezone.now() - timedelta(minutes=5))
+        process_inbox_notification('n1')
+
+        # 购买记录由其他途径写入（或与通知处理同时提交）时，由补偿任务发现并重新处理
+        Purchase.objects.create(user_id=1, transaction_id='t1', original_transaction_id='o1',
+                                purchase_date=timezone.now(), is_active=True, is_successful=True)
+        self.assertEqual(process_unfinished_notifications(), 1)
+        self.assertEqual(WebhookInbox.objects.get().status, 'done')
+
+
+@mock.patch('purchase.mirror.mirror_session.post')
+class WebhookMirrorTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    @override_settings(WEBHOOK_MIRROR_TARGETS=['https://a.example.com/webhook/', 'https://b.example.com/webhook/'])
+    def test_each_target_gets_every_notification(self, post):
+        post.return_value = mock.Mock(status_code=200)
+        mirror.enqueue_mirror('p1')
+        mirror.enqueue_mirror('p2')
+
+        self.assertEqual(mirror.forward_mirrors(), {'forwarded': 4, 'rejected': 0, 'dropped': 0})
+        self.assertEqual([(call.args[0], call.kwargs['data']['signedPayload']) for call in post.call_args_list], [
+            ('https://a.example.com/webhook/', 'p1'), ('https://a.example.com/webhook/', 'p2'),
+            ('https://b.example.com/webhook/', 'p1'), ('https://b.example.com/webhook/', 'p2'),
+        ])
+        self.assertEqual(post.call_args.kwargs['timeout'], mirror.TIMEOUT)
+
+    @override_settings(WEBHOOK_MIRROR_TARGETS=['https://a.example.com/webhook/'], WEBHOOK_MIRROR_MAX_ATTEMPTS=2)
+    def test_unavailable_target_is_retried_in_order(self, post):
+        target = 'https://a.example.com/webhook/'
+        mirror.enqueue_mirror('p1')
+        mirror.enqueue_mirror('p2')
+
+        # 镜像不可用时放回队首，本轮不再继续转发
+        post.return_value = mock.Mock(status_code=503)
+        self.assertEqual(mirror.forward_mirrors(), {'forwarded': 0, 'rejected': 0, 'dropped': 0})
+        self.assertEqual(post.call_count, 1)
+        self.assertEqual(mirror.backlog_size(target), 2)
+
+        # 超过最大尝试次数后丢弃
+        self.assertEqual(mirror.forward_mirrors()['dropped'], 1)
+        self.assertEqual(mirror.backlog_size(target), 1)
+
+        post.return_value = mock.Mock(status_code=200)
+        self.assertEqual(mirror.forward_mirrors(), {'forwarded': 1, 'rejected': 0, 'dropped': 0})
+        self.assertEqual(post.call_args.kwargs['data']['signedPayload'], 'p2')
+
+    @override_settings(WEBHOOK_MIRROR_TARGETS=['https://a.example.com/webhook/'])
+    def test_rejected_notifications_are_counted_separately(self, post):
+        mirror.enqueue_mirror('p1')
+        mirror.enqueue_mirror('p2')
+
+        # 镜像返回其他 4xx 时不重试，单独计数
+        post.side_effect = [mock.Mock(status_code=400), mock.Mock(status_code=200)]
+        with self.assertLogs('purchase.mirror', level='ERROR') as logs:
+            self.assertEqual(mirror.forward_mirrors(), {'forwarded': 1, 'rejected': 1, 'dropped': 0})
+        self.assertIn('HTTP 400', logs.output[0])
+        self.assertEqual(mirror.backlog_size('https://a.example.com/webhook/'), 0)
+
+    @override_settings(WEBHOOK_MIRROR_TARGETS=['https://a.example.com/webhook/'], WEBHOOK_MIRROR_BACKLOG=3)
+    def test_backlog_is_bounded(self, post):
+        post.return_value = mock.Mock(status_code=200)
+        for i in range(5):
+            mirror.enqueue_mirror(f'p{i}')
+
+        self.assertEqual(mirror.backlog_size('https://a.example.com/webhook/'), 3)
+        mirror.forward_mirrors()
+        self.assertEqual([call.kwargs['data']['signedPayload'] for call in post.call_args_list], ['p2', 'p3', 'p4'])
@@ -0,0 +1,331 @@
+"""
+苹果收据验证（verifyReceipt）
+
+苹果要求先向正式环境验证，返回 21007 时再向沙盒环境验证（21008 反之），
+TestFlight 和审核的收据因此每次都要多一次往返。这里按 (应用, original_transaction_id) 记住订阅所在的环境，
+original_transaction_id 取自验证成功的响应，同一订阅的后续验证直接发往该环境。
+环境只属于单个订阅：应用里混有沙盒和正式用户时，一个沙盒订阅不会让其他订阅也先发往沙盒，
+订阅未知时始终先尝试正式环境（或调用方指定的默认环境）。
+
+订阅环境未知的收据也可以配置为同时向两个环境验证（RECEIPT_VERIFY_RACE），取先返回的有效结果。
+所有请求复用同一个连接池，避免每次验证重新建立 TLS 连接。
+
+include-history 的响应包含用户全部的购买历史，长期订阅用户可达数百 KB，而处理时只用到最新的交易。
+响应按块流式读取，逐个元素解析 latest_receipt_info 和 receipt.in_app，不再一次构造整个响应的对象树：
+latest_receipt_info 的每笔交易只保留入库需要的字段并按到期时间排序，
+receipt.in_app 与之重复，只保留到期时间最晚的交易。
+"""
+import codecs
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+PRODUCTION = 'Production'
+SANDBOX = 'Sandbox'
+
+ENDPOINTS = {
+    PRODUCTION: 'https://buy.itunes.apple.com/verifyReceipt',
+    SANDBOX: 'https://sandbox.itunes.apple.com/verifyReceipt',
+}
+
+# 21007：沙盒收据发到了正式环境；21008：正式收据发到了沙盒环境
+REDIRECT_STATUS = {21007: SANDBOX, 21008: PRODUCTION}
+
+ENV_KEY_PREFIX = 'apns:receipt-env'
+ENV_TTL = 30 * 24 * 60 * 60
+
+# 请求超时：(连接, 读取) 秒
+TIMEOUT = (5, 30)
+
+# 流式读取响应的块大小
+CHUNK_SIZE = 64 * 1024
+
+
+def _transaction_order(transaction):
+    """交易的先后：订阅按到期时间，非订阅交易按购买时间"""
+    try:
+        return int(transaction.get('expires_date_ms') or transaction.get('purchase_date_ms') or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+# 入库需要的交易字段
+TRANSACTION_FIELDS = (
+    'transaction_id', 'original_transaction_id', 'product_id', 'purchase_date_ms',
+    'expires_date_ms', 'cancellation_date_ms', 'cancellation_reason',
+)
+
+
+class _TransactionHistory:
+    """保留全部交易的入库字段，按到期时间从早到晚排序，最后一笔即最新的交易"""
+
+    def __init__(self):
+        self.transactions = []
+
+    def add(self, transaction):
+        if isinstance(transaction, dict):
+            self.transactions.append(
+                {field: transaction[field] for field in TRANSACTION_FIELDS if field in transaction}
+            )
+
+    def result(self):
+        return sorted(self.transactions, key=_transaction_order)
+
+
+class _LatestTransactions:
+    """只保留到期时间最晚的交易（并列时都保留，保持原有顺序）"""
+
+    def __init__(self):
+        self.latest = []
+        self.order = None
+
+    def add(self, transaction):
+        if not isinstance(transaction, dict):
+            return
+        order = _transaction_order(transaction)
+        if self.order is None or order > self.order:
+            self.latest, self.order = [transaction], order
+        elif order == self.order:
+            self.latest.append(transaction)
+
+    def result(self):
+        return self.latest
+
+
+# 需要逐个元素解析的数组及其归并方式，以及为了到达这些数组需要逐个字段解析的对象
+STREAMED_ARRAYS = {
+    ('latest_receipt_info',): _TransactionHistory,
+    ('receipt', 'in_app'): _LatestTransactions,
+}
+STREAMED_OBJECTS = {('receipt',)}
+
+
+class _TextStream:
+    """把字节块流转换为可按 JSON 值读取的文本缓冲区，已读取的部分及时丢弃"""
+
+    WHITESPACE = ' \t\n\r'
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.json_decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.exhausted = False
+
+    def _fill(self):
+        """读取下一块，没有更多数据时返回 False"""
+        if self.exhausted:
+            return False
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            self.exhausted = True
+            self.buffer = self.buffer[self.pos:] + self.decoder.decode(b'', final=True)
+        else:
+            self.buffer = self.buffer[self.pos:] + self.decoder.decode(chunk)
+        self.pos = 0
+        return True
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in self.WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                raise ValueError('收据验证响应不完整')
+
+    def next_char(self):
+        char = self.peek()
+        self.pos += 1
+        return char
+
+    def expect(self, expected):
+        char = self.next_char()
+        if char != expected:
+            raise ValueError(f'收据验证响应格式错误: 期望 {expected!r}，实际 {char!r}')
+
+    def value(self):
+        """读取一个完整的 JSON 值，缓冲区中的数据不完整时继续读取"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.json_decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # 每次至少让未解析的数据翻倍再重试，避免很长的值（如 latest_receipt）被反复从头解析
+                pending = len(self.buffer) - self.pos
+                if not self._fill():
+                    raise
+                while len(self.buffer) - self.pos < 2 * pending and self._fill():
+                    pass
+                continue
+            # 数字可能恰好在块的边界处被截断
+            if end == len(self.buffer) and not self.exhausted and isinstance(value, (int, float)):
+                self._fill()
+                continue
+            self.pos = end
+            return value
+
+    def drain(self):
+        """读完剩余的数据，使连接可以放回连接池"""
+        for _ in self.chunks:
+            pass
+
+
+def _parse_array(stream, reducer):
+    stream.expect('[')
+    if stream.peek() == ']':
+        stream.next_char()
+        return reducer.result()
+    while True:
+        reducer.add(stream.value())
+        if stream.next_char() == ']':
+            return reducer.result()
+
+
+def _parse_object(stream, path=()):
+    stream.expect('{')
+    result = {}
+    if stream.peek() == '}':
+        stream.next_char()
+        return result
+    while True:
+        key = stream.value()
+        stream.expect(':')
+        child = path + (key,)
+        if child in STREAMED_ARRAYS and stream.peek() == '[':
+            result[key] = _parse_array(stream, STREAMED_ARRAYS[child]())
+        elif child in STREAMED_OBJECTS and stream.peek() == '{':
+            result[key] = _parse_object(stream, child)
+        else:
+            result[key] = stream.value()
+        if stream.next_char() == '}':
+            return result
+
+
+def parse_verify_response(chunks):
+    """
+    流式解析 verifyReceipt 的响应
+
+    与 json.loads 的结果相同，只是 latest_receipt_info 中的交易只保留入库字段并按到期时间排序，
+    receipt.in_app 中只保留到期时间最晚的交易。
+
+    Args:
+        chunks: 响应的字节块迭代器
+
+    Raises:
+        ValueError: 响应不是合法的 JSON 对象
+    """
+    stream = _TextStream(chunks)
+    result = _parse_object(stream)
+    stream.drain()
+    return result
+
+
+class ReceiptVerifier:
+    """带环境记忆和连接池的收据验证器"""
+
+    def __init__(self, session=None, race=None):
+        self.session = session or self._build_session()
+        self._race_enabled = race
+        self._executor = None
+
+    @staticmethod
+    def _build_session():
+        session = requests.Session()
+        session.mount('https://', HTTPAdapter(pool_connections=2, pool_maxsize=16))
+        return session
+
+    @property
+    def race_enabled(self):
+        if self._race_enabled is None:
+            return settings.RECEIPT_VERIFY_RACE
+        return self._race_enabled
+
+    def verify(self, request_data, app_id=None, original_transaction_id=None, default_environment=PRODUCTION):
+        """
+        验证收据
+
+        Args:
+            request_data: 发给 verifyReceipt 的请求体（receipt-data、password 等）
+            app_id: 应用ID，与原始交易ID一起作为环境记忆的键
+            original_transaction_id: 之前验证这份收据时响应中的原始交易ID（已知时）
+            default_environment: 订阅环境未知时首先尝试的环境
+
+        Returns:
+            dict: 苹果返回的验证结果，environment 字段为实际验证的环境
+        """
+        environment = self._remembered_transaction(app_id, original_transaction_id)
+
+        if environment is None and self.race_enabled:
+            result = self._race(request_data)
+        else:
+            environment = environment or default_environment
+            result = self._post(environment, request_data)
+            if result.get('status') in REDIRECT_STATUS:
+                result = self._post(REDIRECT_STATUS[result['status']], request_data)
+
+        if result.get('status') == 0:
+            self._remember(app_id, result)
+        return result
+
+    def _post(self, environment, request_data):
+        response = self.session.post(ENDPOINTS[environment], json=request_data, timeout=TIMEOUT, stream=True)
+        try:
+            result = parse_verify_response(response.iter_content(chunk_size=CHUNK_SIZE))
+        finally:
+            response.close()
+        result.setdefault('environment', environment)
+        return result
+
+    def _race(self, request_data):
+        """同时向两个环境验证，返回第一个不需要换环境的结果"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='receipt-verify')
+
+        futures = [self._executor.submit(self._post, environment, request_data) for environment in ENDPOINTS]
+        result, error = None, None
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except requests.RequestException as e:
+                error = e
+                continue
+            if result.get('status') not in REDIRECT_STATUS:
+                return result
+
+        if result is None:
+            raise error
+        return result
+
+    @staticmethod
+    def _transaction_key(app_id, original_transaction_id):
+        return f'{ENV_KEY_PREFIX}:{app_id}:{original_transaction_id}'
+
+    def _remembered_transaction(self, app_id, original_transaction_id):
+        if not original_transaction_id:
+            return None
+        return cache.get(self._transaction_key(app_id, original_transaction_id))
+
+    def _remember(self, app_id, result):
+        environment = result.get('environment')
+        if environment not in ENDPOINTS:
+            return
+
+        entries = {}
+        for transaction in result.get('latest_receipt_info') or result.get('receipt', {}).get('in_app') or []:
+            original_transaction_id = transaction.get('original_transaction_id')
+            if original_transaction_id:
+                entries[self._transaction_key(app_id, original_transaction_id)] = environment
+        if entries:
+            cache.set_many(entries, ENV_TTL)
+
+
+receipt_verifier = ReceiptVerifier()
@@ -1,23 +1,17 @@
-import base64
-import json
-
-import jwt
-import requests
 from rest_framework import status, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAdminUser
 
-from configurations.models import AppleAppConfiguration
 from .models import Purchase
 from .serializers import (
     VerifyReceiptSerializer,
-    NotificationSerializer,
     PurchaseSerializer
 )
 from .services import PurchaseService, UserService
 import logging
 from .tasks import sync_user_premium_status
+from .webhooks import store_notification
 from django.utils import timezone
 from utils.mixins import CreateModelMixin, ListModelMixin, RetrieveModelMixin
 from utils.permissions import IsAuthenticatedExternal
@@ -64,56 +58,36 @@ class PurchaseVerificationView(CreateModelMixin, GenericViewSet):
 class AppleWebhookView(CreateModelMixin, GenericViewSet):
     """
     处理来自Apple的服务器通知
+
+    只把原始的 signedPayload 写入收件箱后立即返回，解码和处理由后台任务完成。
     """
     permission_classes = [permissions.AllowAny]  # Apple服务器通知无需认证
 
     def create(self, request, *args, **kwargs):
-        try:
-            logger.error("收到苹果服务器通知")
-
-            # 记录原始请求数据，便于调试
-            logger.error(f"通知原始数据: {request.data}")
-
-            requests.post("https://pocket.nicebudgeting.com/apns/api/purchase/webhook/", data=request.data)
-
-            signed_payload = request.data.get('signedPayload')
-            if not signed_payload:
-                return Response({"status": "error", "message": "Missing signedPayload"}, status=400)
-
-            notification_data = verify_and_decode_signed_payload(signed_payload)
-            if not notification_data:
-                return Response({"status": "error", "message": "Invalid signedPayload"}, status=400)
-
-            complete_notification = parse_apple_notification(notification_data)
-
-            if 'notificationType' in complete_notification and 'version' in complete_notification and complete_notification['version'] == '2.0':
-                serializer = NotificationSerializer(data=complete_notification)
-            else:
-                # 旧格式通知，使用旧的序列化器
-                logger.warning("收到旧版格式通知，尝试使用旧格式处理")
-                from .serializers import OldNotificationSerializer
-                serializer = OldNotificationSerializer(data=request.data)
+        signed_payload = request.data.get('signedPayload')
+        if not signed_payload:
+            return Response({"status": "error", "message": "Missing signedPayload"}, status=400)
 
-            logger.error(f"通知解析后数据: {complete_notification}")
-
-            if not serializer.is_valid():
-                logger.error(f"通知数据无效: {serializer.errors}")
-                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-
-            # 异步处理通知
-            Purchase.process_notification(serializer.validated_data)
-
-            # 立即返回成功响应，避免苹果服务器重试
+        try:
+            notification_uuid = store_notification(signed_payload)
+        except Exception as e:
+            # 写入失败时返回错误，由苹果服务器重试，避免丢失通知
+            logger.exception(f"保存苹果通知时出错: {str(e)}")
             return Response({
-                'code': 200,
-                'msg': 'success',
-                'data': {}
-            })
+                'code': 500,
+                'msg': 'failure',
+                'data': {},
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-        except Exception as e:
-            logger.exception(f"处理通知时出错: {str(e)}")
-            # 即使出错也返回200状态码，避免苹果服务器重试
-            return Response({'success': False, 'message': str(e)}, status=status.HTTP_200_OK)
+        if not notification_uuid:
+            return Response({"status": "error", "message": "Invalid signedPayload"}, status=400)
+
+        logger.info(f"收到苹果服务器通知: {notification_uuid}")
+        return Response({
+            'code': 200,
+            'msg': 'success',
+            'data': {}
+        })
 
 
 class PurchaseListView(ListModelMixin, RetrieveModelMixin, GenericViewSet):
@@ -218,57 +192,37 @@ class PurchaseListView(ListModelMixin, RetrieveModelMixin, GenericViewSet):
             }, status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            # 获取用户的有效订阅
-            active_subscriptions = Purchase.objects.filter(
+            user_id = int(user_id)
+            now = timezone.now()
+
+            # 获取用户的有效订阅，最晚到期的一条即当前的会员状态
+            active_subscriptions = list(Purchase.objects.filter(
                 user_id=user_id,
                 is_active=True,
                 is_successful=True,
-                expires_at__gt=timezone.now()
-            ).order_by('-expires_at')
-
-            if active_subscriptions.exists():
-                # 用户有有效订阅
-                latest_subscription = active_subscriptions.first()
-
-                success = UserService.update_premium_status(
-                    user_id=user_id,
-                    is_premium=True,
-                    expires_at=latest_subscription.expires_at
-                )
-
-                if success:
-                    return Response({
-                        'code': 200,
-                        'msg': 'success',
-                        'data': PurchaseSerializer(active_subscriptions).data
-                    })
-                else:
-                    return Response({
-                        'code': 500,
-                        'msg': 'failure',
-                        'data': f'更新用户 {user_id} 的会员状态失败',
-                    }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+                expires_at__gt=now
+            ).order_by('-expires_at', '-updated_at'))
+
+            if active_subscriptions:
+                latest = active_subscriptions[0]
+                entitlement = {'is_premium': True, 'expires_at': latest.expires_at, 'app_id': latest.app_id}
             else:
-                # 用户没有有效订阅
-                # 获取用户最后一条记录的app_id
-
-                success = UserService.update_premium_status(
-                    user_id=user_id,
-                    is_premium=False,
-                )
-
-                if success:
-                    return Response({
-                        'code': 200,
-                        'msg': 'success',
-                        'data': PurchaseSerializer(active_subscriptions).data
-                    })
-                else:
-                    return Response({
-                        'code': 500,
-                        'msg': 'failure',
-                        'data': f'更新用户 {user_id} 的会员状态失败',
-                    }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+                # 没有有效订阅时，应用取最近更新的购买记录
+                entitlement = PurchaseService.get_entitlements([user_id], now)[user_id]
+
+            # 与其他调用方一样记录待推送的会员状态，由后台任务推送给用户中心
+            UserService.enqueue_premium_status(
+                user_id=user_id,
+                is_premium=entitlement['is_premium'],
+                app_id=entitlement['app_id'],
+                expires_at=entitlement['expires_at']
+            )
+
+            return Response({
+                'code': 200,
+                'msg': 'success',
+                'data': PurchaseSerializer(active_subscriptions, many=True).data
+            })
 
         except Exception as e:
             logger.exception(f"同步用户 {user_id} 的会员状态时出错: {str(e)}")
@@ -277,181 +231,3 @@ class PurchaseListView(ListModelMixin, RetrieveModelMixin, GenericViewSet):
                 'msg': 'failure',
                 'data': f'同步用户状态失败: {str(e)}',
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-
-def decode_signed_payload(signed_payload):
-    """
-    解析苹果 App Store Server Notifications V2 的 signedPayload（不验证签名）
-
-    参数:
-        signed_payload: 苹果发送的签名载荷
-
-    返回:
-        解析后的通知数据字典
-    """
-    try:
-        # 1. 将 signedPayload 分割为三部分（header.payload.signature）
-        parts = signed_payload.split('.')
-        if len(parts) != 3:
-            logger.error(f"无效的 signedPayload 格式: {signed_payload[:50]}...")
-            return None
-
-        # 2. 解码 payload 部分
-        payload_part = parts[1]
-
-        # 添加填充以避免 base64 解码错误
-        payload_part += '=' * ((4 - len(payload_part) % 4) % 4)
-
-        # 解码 base64
-        try:
-            decoded_payload = base64.urlsafe_b64decode(payload_part)
-            notification_data = json.loads(decoded_payload)
-            logger.debug(f"成功解析 payload: {notification_data.get('notificationType', 'unknown')}")
-            return notification_data
-        except Exception as e:
-            logger.error(f"解码 payload 失败: {str(e)}")
-            return None
-
-    except Exception as e:
-        logger.error(f"解析 signedPayload 时出错: {str(e)}")
-        return None
-
-
-def get_apple_public_key():
-    """
-    从配置中获取苹果公钥
-
-    返回:
-        公钥对象
-    """
-    try:
-        # 从配置中获取公钥
-        config = AppleAppConfiguration.objects.filter(name='pocket_ai').first()
-        logger.error(f"config: {config.auth_key}")
-        if not config or not config.auth_key:
-            logger.warning("找不到苹果应用配置或公钥为空")
-            return None
-        return config.auth_key
-    except Exception as e:
-        logger.error(f"获取苹果公钥时出错: {str(e)}")
-        return None
-
-
-def verify_and_decode_signed_payload(signed_payload):
-    """
-    验证并解析苹果 App Store Server Notifications V2 的 signedPayload
-
-    参数:
-        signed_payload: 苹果发送的签名载荷
-
-    返回:
-        解析后的通知数据字典，如果验证失败则返回None
-    """
-    try:
-        # 1. 获取JWT头部以获取算法
-        try:
-            header = jwt.get_unverified_header(signed_payload)
-            alg = header.get('alg', 'ES256')
-            logger.debug(f"JWT头部: alg={alg}")
-        except Exception as e:
-            logger.error(f"获取JWT头部时出错: {str(e)}")
-            return decode_signed_payload(signed_payload)
-
-        # 2. 获取公钥
-        public_key = get_apple_public_key()
-
-        if not public_key:
-            logger.warning("无法获取公钥，将不验证签名")
-            return decode_signed_payload(signed_payload)
-
-        # 3. 验证并解码JWT
-        try:
-            decoded = jwt.decode(
-                signed_payload,
-                public_key,
-                algorithms=[alg],
-                options={"verify_exp": True}
-            )
-            logger.info("JWT签名验证成功")
-            return decoded
-        except jwt.ExpiredSignatureError:
-            logger.warning("JWT已过期，但仍将处理通知")
-            return decode_signed_payload(signed_payload)
-        except jwt.InvalidSignatureError:
-            logger.warning("JWT签名无效")
-            return decode_signed_payload(signed_payload)  # 仍然返回解析的数据，但记录警告
-        except Exception as e:
-            logger.error(f"验证JWT时出错: {str(e)}")
-            return decode_signed_payload(signed_payload)
-
-    except Exception as e:
-        logger.error(f"处理signedPayload时出错: {str(e)}")
-        # 作为最后的尝试，使用不验证签名的方式解析
-        try:
-            return jwt.decode(
-                signed_payload,
-                options={"verify_signature": False}
-            )
-        except Exception:
-            return None
-
-
-def parse_apple_notification(notification_data):
-    """
-    解析苹果 App Store Server Notifications V2 的完整通知数据
-
-    参数:
-        notification_data: 已解析的通知数据字典
-
-    返回:
-        包含完整信息的通知数据字典
-    """
-    try:
-        # 1. 获取基本通知信息
-        result = {
-            'notificationType': notification_data.get('notificationType'),
-            'subtype': notification_data.get('subtype'),
-            'notificationUUID': notification_data.get('notificationUUID'),
-            'version': notification_data.get('version'),
-            'signedDate': notification_data.get('signedDate')
-        }
-
-        # 2. 解析 data 部分
-        data = notification_data.get('data', {})
-        result['data'] = {
-            'appAppleId': data.get('appAppleId'),
-            'bundleId': data.get('bundleId'),
-            'bundleVersion': data.get('bundleVersion'),
-            'environment': data.get('environment'),
-        }
-
-        # 3. 解析 signedTransactionInfo
-        signed_transaction_info = data.get('signedTransactionInfo')
-        if signed_transaction_info:
-            transaction_info = verify_and_decode_signed_payload(signed_transaction_info)
-            if transaction_info:
-                result['data']['transactionInfo'] = transaction_info
-                logger.info(
-                    f"成功解析交易信息: {transaction_info.get('productId')}, 交易ID: {transaction_info.get('transactionId')}")
-
-        # 4. 解析 signedRenewalInfo
-        signed_renewal_info = data.get('signedRenewalInfo')
-        if signed_renewal_info:
-            renewal_info = verify_and_decode_signed_payload(signed_renewal_info)
-            if renewal_info:
-                result['data']['renewalInfo'] = renewal_info
-                logger.info(
-                    f"成功解析续订信息: 自动续订状态: {renewal_info.get('autoRenewStatus')}, 下次续订日期: {renewal_info.get('renewalDate')}")
-
-        # 5. 解析其他可能的嵌套 JWT
-        for key, value in data.items():
-            if key.startswith('signed') and key not in ['signedTransactionInfo', 'signedRenewalInfo']:
-                decoded_value = verify_and_decode_signed_payload(value)
-                if decoded_value:
-                    result['data'][key.replace('signed', '')] = decoded_value
-
-        return result
-
-    except Exception as e:
-        logger.error(f"解析完整通知数据时出错: {str(e)}")
-        return notification_data  # 返回原始数据
\ No newline at end of file
@@ -0,0 +1,388 @@
+"""
+苹果 App Store Server Notifications V2 的解析和入库后处理
+
+Webhook 请求只把原始的 signedPayload 按 notificationUUID 写入 WebhookInbox 后立即返回，
+解码、验证签名和更新购买记录都在后台任务中完成，镜像转发写入 purchase.mirror 的队列。同一通知重复推送时只保留一行，
+已处理完成的通知不会再次处理，苹果的重试因此不会产生副作用。
+"""
+import base64
+import hashlib
+import json
+import logging
+from datetime import timedelta
+
+import jwt
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from configurations.models import AppleAppConfiguration
+from configurations.registry import app_registry
+
+logger = logging.getLogger(__name__)
+
+# 处理中的通知超过该时间（秒）仍未完成时视为处理进程已退出，由补偿任务重新处理
+CLAIM_TIMEOUT = 10 * 60
+# 刚收到的通知由投递的任务处理，补偿任务只处理超过该时间（秒）仍未处理的通知
+SWEEP_DELAY = 60
+
+
+def decode_signed_payload(signed_payload):
+    """
+    解析苹果 App Store Server Notifications V2 的 signedPayload（不验证签名）
+
+    参数:
+        signed_payload: 苹果发送的签名载荷
+
+    返回:
+        解析后的通知数据字典
+    """
+    try:
+        # 1. 将 signedPayload 分割为三部分（header.payload.signature）
+        parts = signed_payload.split('.')
+        if len(parts) != 3:
+            logger.error(f"无效的 signedPayload 格式: {signed_payload[:50]}...")
+            return None
+
+        # 2. 解码 payload 部分
+        payload_part = parts[1]
+
+        # 添加填充以避免 base64 解码错误
+        payload_part += '=' * ((4 - len(payload_part) % 4) % 4)
+
+        # 解码 base64
+        try:
+            decoded_payload = base64.urlsafe_b64decode(payload_part)
+            notification_data = json.loads(decoded_payload)
+            logger.debug(f"成功解析 payload: {notification_data.get('notificationType', 'unknown')}")
+            return notification_data
+        except Exception as e:
+            logger.error(f"解码 payload 失败: {str(e)}")
+            return None
+
+    except Exception as e:
+        logger.error(f"解析 signedPayload 时出错: {str(e)}")
+        return None
+
+
+def get_apple_public_key():
+    """
+    从配置中获取苹果公钥
+
+    返回:
+        公钥对象
+    """
+    try:
+        # 从进程内的配置注册表获取公钥
+        try:
+            config = app_registry.get('pocket_ai')
+        except AppleAppConfiguration.DoesNotExist:
+            config = None
+        if not config or not config.auth_key:
+            logger.warning("找不到苹果应用配置或公钥为空")
+            return None
+        return config.auth_key
+    except Exception as e:
+        logger.error(f"获取苹果公钥时出错: {str(e)}")
+        return None
+
+
+def verify_and_decode_signed_payload(signed_payload):
+    """
+    验证并解析苹果 App Store Server Notifications V2 的 signedPayload
+
+    参数:
+        signed_payload: 苹果发送的签名载荷
+
+    返回:
+        解析后的通知数据字典，如果验证失败则返回None
+    """
+    try:
+        # 1. 获取JWT头部以获取算法
+        try:
+            header = jwt.get_unverified_header(signed_payload)
+            alg = header.get('alg', 'ES256')
+            logger.debug(f"JWT头部: alg={alg}")
+        except Exception as e:
+            logger.error(f"获取JWT头部时出错: {str(e)}")
+            return decode_signed_payload(signed_payload)
+
+        # 2. 获取公钥
+        public_key = get_apple_public_key()
+
+        if not public_key:
+            logger.warning("无法获取公钥，将不验证签名")
+            return decode_signed_payload(signed_payload)
+
+        # 3. 验证并解码JWT
+        try:
+            decoded = jwt.decode(
+                signed_payload,
+                public_key,
+                algorithms=[alg],
+                options={"verify_exp": True}
+            )
+            logger.info("JWT签名验证成功")
+            return decoded
+        except jwt.ExpiredSignatureError:
+            logger.warning("JWT已过期，但仍将处理通知")
+            return decode_signed_payload(signed_payload)
+        except jwt.InvalidSignatureError:
+            logger.warning("JWT签名无效")
+            return decode_signed_payload(signed_payload)  # 仍然返回解析的数据，但记录警告
+        except Exception as e:
+            logger.error(f"验证JWT时出错: {str(e)}")
+            return decode_signed_payload(signed_payload)
+
+    except Exception as e:
+        logger.error(f"处理signedPayload时出错: {str(e)}")
+        # 作为最后的尝试，使用不验证签名的方式解析
+        try:
+            return jwt.decode(
+                signed_payload,
+                options={"verify_signature": False}
+            )
+        except Exception:
+            return None
+
+
+def parse_apple_notification(notification_data):
+    """
+    解析苹果 App Store Server Notifications V2 的完整通知数据
+
+    参数:
+        notification_data: 已解析的通知数据字典
+
+    返回:
+        包含完整信息的通知数据字典
+    """
+    try:
+        # 1. 获取基本通知信息
+        result = {
+            'notificationType': notification_data.get('notificationType'),
+            'subtype': notification_data.get('subtype'),
+            'notificationUUID': notification_data.get('notificationUUID'),
+            'version': notification_data.get('version'),
+            'signedDate': notification_data.get('signedDate')
+        }
+
+        # 2. 解析 data 部分
+        data = notification_data.get('data', {})
+        result['data'] = {
+            'appAppleId': data.get('appAppleId'),
+            'bundleId': data.get('bundleId'),
+            'bundleVersion': data.get('bundleVersion'),
+            'environment': data.get('environment'),
+        }
+
+        # 3. 解析 signedTransactionInfo
+        signed_transaction_info = data.get('signedTransactionInfo')
+        if signed_transaction_info:
+            transaction_info = verify_and_decode_signed_payload(signed_transaction_info)
+            if transaction_info:
+                result['data']['transactionInfo'] = transaction_info
+                logger.info(
+                    f"成功解析交易信息: {transaction_info.get('productId')}, 交易ID: {transaction_info.get('transactionId')}")
+
+        # 4. 解析 signedRenewalInfo
+        signed_renewal_info = data.get('signedRenewalInfo')
+        if signed_renewal_info:
+            renewal_info = verify_and_decode_signed_payload(signed_renewal_info)
+            if renewal_info:
+                result['data']['renewalInfo'] = renewal_info
+                logger.info(
+                    f"成功解析续订信息: 自动续订状态: {renewal_info.get('autoRenewStatus')}, 下次续订日期: {renewal_info.get('renewalDate')}")
+
+        # 5. 解析其他可能的嵌套 JWT
+        for key, value in data.items():
+            if key.startswith('signed') and key not in ['signedTransactionInfo', 'signedRenewalInfo']:
+                decoded_value = verify_and_decode_signed_payload(value)
+                if decoded_value:
+                    result['data'][key.replace('signed', '')] = decoded_value
+
+        return result
+
+    except Exception as e:
+        logger.error(f"解析完整通知数据时出错: {str(e)}")
+        return notification_data  # 返回原始数据
+
+
+def store_notification(signed_payload):
+    """
+    把原始的 signedPayload 写入收件箱，同一通知重复推送时只保留第一次
+
+    只解码载荷取出 notificationUUID（不验证签名），签名验证和处理在后台任务中完成。
+
+    Returns:
+        str: 通知UUID，载荷无法解码时返回 None
+    """
+    from purchase.models import WebhookInbox
+    from purchase.tasks import process_webhook_notification
+
+    notification_data = decode_signed_payload(signed_payload)
+    if not notification_data:
+        return None
+
+    notification_uuid = (notification_data.get('notificationUUID')
+                         or hashlib.sha256(signed_payload.encode()).hexdigest()[:64])
+    # INSERT ... ON CONFLICT DO NOTHING，苹果重试时不会产生新的记录
+    WebhookInbox.objects.bulk_create(
+        [WebhookInbox(
+            notification_uuid=notification_uuid,
+            notification_type=notification_data.get('notificationType'),
+            signed_payload=signed_payload
+        )],
+        ignore_conflicts=True
+    )
+    transaction.on_commit(lambda: process_webhook_notification.delay(notification_uuid))
+    return notification_uuid
+
+
+def _claim(notification_uuid, now):
+    """认领一条通知，已处理完成或正在被其他进程处理的通知返回 False"""
+    from purchase.models import WebhookInbox
+
+    return WebhookInbox.objects.filter(notification_uuid=notification_uuid).filter(
+        Q(status__in=['pending', 'failed'])
+        | Q(status='processing', claimed_at__lt=now - timedelta(seconds=CLAIM_TIMEOUT))
+    ).update(status='processing', claimed_at=now, attempts=F('attempts') + 1) > 0
+
+
+def _decode(signed_payload):
+    """
+    验证并解析通知，返回序列化器校验后的数据
+
+    Raises:
+        ValueError: 通知无效，重试也无法处理
+    """
+    from purchase.serializers import NotificationSerializer
+
+    notification_data = verify_and_decode_signed_payload(signed_payload)
+    if not notification_data:
+        raise ValueError('Invalid signedPayload')
+
+    complete_notification = parse_apple_notification(notification_data)
+    if complete_notification.get('version') != '2.0':
+        raise ValueError(f"不支持的通知版本: {complete_notification.get('version')}")
+
+    serializer = NotificationSerializer(data=complete_notification)
+    if not serializer.is_valid():
+        raise ValueError(f"通知数据无效: {serializer.errors}")
+    return serializer.validated_data
+
+
+def process_inbox_notification(notification_uuid):
+    """
+    处理收件箱中的一条通知，可以重复调用：已处理完成的通知直接跳过
+
+    Returns:
+        bool: 本次是否处理了该通知
+    """
+    from purchase.models import Purchase, WebhookInbox
+
+    if not _claim(notification_uuid, timezone.now()):
+        return False
+
+    item = WebhookInbox.objects.get(notification_uuid=notification_uuid)
+    if item.attempts == 1:
+        # 镜像转发由后台任务完成，不影响本地处理
+        from purchase.mirror import enqueue_mirror
+        from purchase.tasks import forward_webhook_mirrors
+
+        if enqueue_mirror(item.signed_payload):
+            transaction.on_commit(lambda: forward_webhook_mirrors.delay())
+
+    try:
+        notification_data = _decode(item.signed_payload)
+    except ValueError as e:
+        logger.error(f"苹果通知 {notification_uuid} 无效: {str(e)}")
+        item.status, item.last_error = 'invalid', str(e)
+        item.save(update_fields=['status', 'last_error'])
+        return True
+
+    try:
+        with transaction.atomic():
+            if Purchase.process_notification(notification_data):
+                item.status, item.last_error, item.processed_at = 'done', None, timezone.now()
+                item.save(update_fields=['status', 'last_error', 'processed_at'])
+            else:
+                # 通知常常先于客户端上传收据到达：交易还没有对应的用户时等待，
+                # 该交易的收据验证后（或补偿任务发现购买记录已存在时）重新处理，不消耗重试次数
+                transaction_info = notification_data.get('data', {}).get('transactionInfo') or {}
+                item.status, item.last_error = 'waiting', '找不到交易对应的用户，等待收据验证'
+                item.original_transaction_id = transaction_info.get('originalTransactionId')
+                item.save(update_fields=['status', 'last_error', 'original_transaction_id'])
+    except Exception as e:
+        logger.exception(f"处理苹果通知 {notification_uuid} 时出错: {str(e)}")
+        WebhookInbox.objects.filter(pk=item.pk).update(status='failed', last_error=str(e))
+    return True
+
+
+def replay_waiting_notifications(original_transaction_ids):
+    """
+    购买记录写入后，重新处理这些交易上等待用户的通知（事务提交后投递任务）
+
+    Returns:
+        int: 重新投递的通知数
+    """
+    from purchase.models import WebhookInbox
+    from purchase.tasks import process_webhook_notification
+
+    original_transaction_ids = [value for value in original_transaction_ids if value]
+    if not original_transaction_ids:
+        return 0
+
+    waiting = WebhookInbox.objects.filter(status='waiting', original_transaction_id__in=original_transaction_ids)
+    uuids = list(waiting.values_list('notification_uuid', flat=True))
+    if not uuids:
+        return 0
+
+    WebhookInbox.objects.filter(notification_uuid__in=uuids, status='waiting').update(status='pending')
+    for notification_uuid in uuids:
+        transaction.on_commit(lambda notification_uuid=notification_uuid:
+                              process_webhook_notification.delay(notification_uuid))
+    logger.info(f"重新处理等待购买记录的苹果通知: {len(uuids)} 条")
+    return len(uuids)
+
+
+def process_unfinished_notifications(batch_size=500):
+    """
+    补偿处理：投递丢失、处理失败或处理进程退出的通知，并清理过期的已处理通知
+
+    等待购买记录的通知一般在收据验证时重新处理；这里再检查一次购买记录已经存在的，
+    覆盖收据验证与通知处理同时提交等情况。
+
+    Returns:
+        int: 处理的通知数
+    """
+    from purchase.models import Purchase, WebhookInbox
+
+    now = timezone.now()
+    resolved = list(
+        WebhookInbox.objects.filter(
+            status='waiting',
+            original_transaction_id__in=Purchase.objects.values('original_transaction_id')
+        ).values_list('pk', flat=True)[:batch_size]
+    )
+    WebhookInbox.objects.filter(pk__in=resolved, status='waiting').update(status='pending')
+
+    uuids = list(
+        WebhookInbox.objects.filter(
+            status__in=['pending', 'processing', 'failed'],
+            received_at__lt=now - timedelta(seconds=SWEEP_DELAY),
+            attempts__lt=settings.WEBHOOK_INBOX_MAX_ATTEMPTS
+        ).order_by('received_at').values_list('notification_uuid', flat=True)[:batch_size]
+    )
+    processed = sum(process_inbox_notification(notification_uuid) for notification_uuid in uuids)
+
+    # 保留期内仍未等到购买记录的通知一并清理
+    expired = WebhookInbox.objects.filter(
+        status__in=['done', 'invalid', 'waiting'],
+        received_at__lt=now - timedelta(days=settings.WEBHOOK_INBOX_RETENTION_DAYS)
+    ).values_list('pk', flat=True)[:batch_size]
+    WebhookInbox.objects.filter(pk__in=list(expired)).delete()
+
+    if processed:
+        logger.info(f"补偿处理苹果通知: {processed} 条")
+    return processed
@@ -0,0 +1,134 @@
+"""
+定时任务的租约
+
+Celery beat 按固定周期投递任务，本身不保证上一次执行已经结束，部署多个 beat 实例时
+同一周期还会投递多次。这里提供两层保护：
+
+- 周期占位：同一任务的同一计划时间只执行一次，多个 beat 重复投递时后到的直接跳过；
+- 执行租约：同一任务（或同一分片）同时只有一个执行者，租约到期自动释放，避免进程崩溃后永久锁死。
+  拿不到租约时可以直接跳过，也可以合并：记下一个待执行标记，由持有者结束后立即补跑一次。
+
+每次执行记录耗时和相对计划时间的延迟，写入日志和缓存，便于观察任务是否跟得上周期。
+有 Redis 时直接使用 Redis，本地开发使用内存缓存时回退到 Django 缓存接口。
+"""
+import logging
+import time
+import uuid
+
+from django.core.cache import cache
+from django.utils import timezone
+
+from .redis_client import get_redis_connection
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'apns:lease'
+
+# 仅当值仍为自己的令牌时才删除，避免误删租约过期后被他人重新获取的租约
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# 执行统计保留时间
+STATS_TTL = 24 * 60 * 60
+
+
+def _set_if_absent(key, value, ttl):
+    redis = get_redis_connection()
+    if redis is not None:
+        return bool(redis.set(key, value, nx=True, ex=ttl))
+    return cache.add(key, value, ttl)
+
+
+def _pop(key):
+    """读取并删除一个标记，返回是否存在"""
+    redis = get_redis_connection()
+    if redis is not None:
+        return bool(redis.delete(key))
+    existed = cache.get(key) is not None
+    cache.delete(key)
+    return existed
+
+
+class Lease:
+    """基于 SET NX EX 的互斥租约"""
+
+    def __init__(self, name, ttl):
+        self.key = f'{KEY_PREFIX}:{name}'
+        self.ttl = ttl
+        self.token = uuid.uuid4().hex
+
+    def acquire(self):
+        return _set_if_absent(self.key, self.token, self.ttl)
+
+    def release(self):
+        redis = get_redis_connection()
+        if redis is not None:
+            redis.eval(RELEASE_SCRIPT, 1, self.key, self.token)
+        elif cache.get(self.key) == self.token:
+            cache.delete(self.key)
+
+
+def claim_slot(name, scheduled_at, ttl):
+    """占用某次计划执行，同一计划时间只有第一个调用者返回 True"""
+    return _set_if_absent(f'{KEY_PREFIX}:{name}:slot:{scheduled_at.isoformat()}', 1, ttl)
+
+
+def get_run_stats(name):
+    """最近一次执行的统计"""
+    return cache.get(f'{KEY_PREFIX}:{name}:stats')
+
+
+def run_with_lease(name, func, ttl, scheduled_at=None, coalesce=False):
+    """
+    在租约保护下执行定时任务
+
+    Args:
+        name: 租约名称，分片任务应包含分片编号
+        func: 无参数的执行函数
+        ttl: 租约有效期（秒），应大于单次执行的最长耗时
+        scheduled_at: 计划执行时间，提供时同一计划时间只执行一次，并据此计算延迟
+        coalesce: 租约被占用时是否请求持有者结束后补跑一次，否则直接跳过
+
+    Returns:
+        func 的返回值，跳过执行时返回 None
+    """
+    if scheduled_at is not None and not claim_slot(name, scheduled_at, ttl):
+        logger.info(f"定时任务 {name} 的 {scheduled_at:%Y-%m-%d %H:%M:%S} 批次已执行，跳过")
+        return None
+
+    rerun_key = f'{KEY_PREFIX}:{name}:rerun'
+    lease = Lease(name, ttl)
+    if not lease.acquire():
+        if coalesce:
+            _set_if_absent(rerun_key, 1, ttl)
+            logger.warning(f"定时任务 {name} 上一次执行尚未结束，结束后补跑")
+        else:
+            logger.warning(f"定时任务 {name} 上一次执行尚未结束，跳过本次")
+        return None
+
+    try:
+        while True:
+            started_at = timezone.now()
+            started = time.monotonic()
+            result = func()
+            duration_ms = (time.monotonic() - started) * 1000
+            lag_ms = (started_at - scheduled_at).total_seconds() * 1000 if scheduled_at else 0
+
+            cache.set(f'{KEY_PREFIX}:{name}:stats', {
+                'started_at': started_at.isoformat(),
+                'duration_ms': round(duration_ms),
+                'lag_ms': round(lag_ms),
+                'result': result,
+            }, STATS_TTL)
+            logger.info(f"定时任务 {name} 完成: 耗时 {duration_ms:.0f}ms, 延迟 {lag_ms:.0f}ms, 结果 {result}")
+
+            if not (coalesce and _pop(rerun_key)):
+                return result
+            # 补跑的延迟从合并请求时算起已无意义，按立即执行记录
+            scheduled_at = timezone.now()
+    finally:
+        lease.release()
@@ -0,0 +1,87 @@
+"""
+迁移中使用的自定义操作
+"""
+from django.db import migrations
+
+
+class AddIndexConcurrently(migrations.AddIndex):
+    """
+    在 PostgreSQL 上使用 CREATE INDEX CONCURRENTLY 创建索引，建索引期间不锁写入；
+    其他数据库（开发环境的 SQLite）退化为普通的 CREATE INDEX。
+
+    CONCURRENTLY 不能在事务中执行，使用该操作的迁移需要设置 atomic = False。
+    """
+
+    def _concurrently(self, schema_editor):
+        return schema_editor.connection.vendor == 'postgresql'
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+        if self._concurrently(schema_editor):
+            schema_editor.add_index(model, self.index, concurrently=True)
+        else:
+            schema_editor.add_index(model, self.index)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+        if self._concurrently(schema_editor):
+            schema_editor.remove_index(model, self.index, concurrently=True)
+        else:
+            schema_editor.remove_index(model, self.index)
+
+    def describe(self):
+        return f"{super().describe()} (concurrently)"
+
+
+class AddUniqueConstraintConcurrently(migrations.AddConstraint):
+    """
+    在 PostgreSQL 上先用 CREATE UNIQUE INDEX CONCURRENTLY 建唯一索引，再用
+    ALTER TABLE ... ADD CONSTRAINT ... UNIQUE USING INDEX 挂为约束，建索引期间不锁写入；
+    其他数据库退化为普通的 AddConstraint。只支持按字段、不带条件的 UniqueConstraint。
+
+    并发建索引失败时会留下无效索引，需要先删除同名索引再重新执行迁移。
+    使用该操作的迁移需要设置 atomic = False。
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+        if schema_editor.connection.vendor != 'postgresql':
+            return super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+        quote = schema_editor.quote_name
+        table = quote(model._meta.db_table)
+        name = quote(self.constraint.name)
+        columns = ', '.join(quote(model._meta.get_field(field).column) for field in self.constraint.fields)
+        schema_editor.execute(f'CREATE UNIQUE INDEX CONCURRENTLY {name} ON {table} ({columns})')
+        schema_editor.execute(f'ALTER TABLE {table} ADD CONSTRAINT {name} UNIQUE USING INDEX {name}')
+
+    def describe(self):
+        return f"{super().describe()} (concurrently)"
+
+
+class AlterFieldAddIndexConcurrently(migrations.AlterField):
+    """
+    把字段改为 db_index=True，在 PostgreSQL 上使用 CREATE INDEX CONCURRENTLY 创建该字段的索引，
+    索引名与 Django 自动生成的一致；其他数据库退化为普通的 AlterField。
+
+    只适用于除 db_index 外字段定义不变的情况。使用该操作的迁移需要设置 atomic = False。
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if not self.allow_migrate_model(schema_editor.connection.alias, model):
+            return
+        if schema_editor.connection.vendor != 'postgresql':
+            return super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+        field = model._meta.get_field(self.name)
+        schema_editor.execute(schema_editor._create_index_sql(model, fields=[field], concurrently=True))
+
+    def describe(self):
+        return f"{super().describe()} (concurrently)"
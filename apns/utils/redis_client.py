@@ -0,0 +1,15 @@
+from django.conf import settings
+
+
+def get_redis_connection():
+    """
+    返回默认缓存所使用的 Redis 连接
+
+    仅当默认缓存配置为 django_redis 时可用，本地开发使用内存缓存时返回 None，
+    调用方需要自行回退到 Django 缓存接口。
+    """
+    if 'django_redis' not in settings.CACHES['default']['BACKEND']:
+        return None
+
+    from django_redis import get_redis_connection as django_redis_connection
+    return django_redis_connection('default')